@@ -1,19 +1,24 @@
-from fastapi import FastAPI, Request, Form, Depends, UploadFile, File, HTTPException, status
-from fastapi.responses import HTMLResponse, RedirectResponse, Response, JSONResponse
+from fastapi import FastAPI, Request, Form, Depends, UploadFile, File, HTTPException, Query, status
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, JSONResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
+from fastapi.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, ForeignKey, and_, or_, extract, func, UniqueConstraint
+from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, ForeignKey, and_, or_, extract, func, case, tuple_, UniqueConstraint, Index
+from sqlalchemy import event, inspect, text
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
+from sqlalchemy.orm import sessionmaker, Session, relationship, joinedload
 from datetime import datetime, date, timedelta
 import os
 import io
 import re
 import unicodedata
 import calendar
-from typing import Optional, Tuple
+import threading
+from collections import namedtuple
+from typing import List, Optional, Tuple
 from urllib.parse import quote
 from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
@@ -157,12 +162,51 @@ templates.env.filters["to_local_time"] = to_local_time
 templates.env.globals["has_page_access"] = has_page_access
 templates.env.globals["today"] = get_today
 
+# Bytecode cache cho Jinja2: mỗi worker không phải biên dịch lại ~40 template
+# (theo_doi_dau_v2.html, timekeeping_v1_detail.html... vài nghìn dòng) từ source.
+# Jinja2 tự so checksum source nên file cache cũ không bao giờ được dùng nhầm.
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", os.path.join(BASE_DIR, ".jinja_cache"))
+try:
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+except OSError as e:
+    print(f"Không tạo được thư mục cache template {TEMPLATE_CACHE_DIR}: {e}")
+
+def warm_up_templates(env=None):
+    """Nạp trước toàn bộ template vào cache của Jinja2 environment.
+
+    Trả về (số template đã nạp, thời gian ms, danh sách template lỗi).
+    Template lỗi chỉ được ghi lại, lỗi thật sẽ hiện ra khi render như trước.
+    """
+    import time
+    env = env or templates.env
+    started = time.perf_counter()
+    loaded = 0
+    failed = []
+    for name in env.list_templates(extensions=["html"]):
+        try:
+            env.get_template(name)
+            loaded += 1
+        except Exception as e:
+            failed.append((name, str(e)))
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return loaded, elapsed_ms, failed
+
+# Warm-up ngay khi import: chạy được cả dưới WSGI (PythonAnywhere) vốn không có lifespan event.
+# Tắt bằng TEMPLATE_WARMUP=0 (vd. khi chạy script/CLI không cần render).
+if os.getenv("TEMPLATE_WARMUP", "1").strip() not in {"0", "false", "FALSE", "no", "NO"}:
+    _warmup_loaded, _warmup_ms, _warmup_failed = warm_up_templates()
+    print(f"Templates warmed up: {_warmup_loaded} template trong {_warmup_ms:.0f} ms")
+    for _name, _error in _warmup_failed:
+        print(f"Warning: Không biên dịch được template {_name}: {_error}")
+
 # Models
 class Employee(Base):
     __tablename__ = "employees"
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
+    name_key = Column(String, index=True)  # normalize_key(name): bỏ dấu, viết hoa, gộp khoảng trắng
     birth_date = Column(Date)  # Ngày tháng năm sinh
     phone = Column(String)
     cccd = Column(String)  # Số CCCD
@@ -255,6 +299,8 @@ class Route(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     route_code = Column(String, nullable=False)  # NA_002, NA_004, etc.
+    route_code_key = Column(String, index=True)  # normalize_key(route_code)
+    is_tang_cuong = Column(Integer, default=0, index=True)  # 1: tuyến "Tăng Cường" (tính từ route_code)
     route_name = Column(String, nullable=False)
     distance = Column(Float)  # KM/Chuyến
     unit_price = Column(Float)  # Đơn giá (VNĐ)
@@ -282,6 +328,8 @@ class DailyRoute(Base):
     cargo_weight = Column(Float, default=0)  # Tải trọng
     driver_name = Column(String)  # Tên lái xe
     license_plate = Column(String)  # Biển số xe
+    driver_name_key = Column(String, index=True)  # normalize_key(driver_name)
+    license_plate_key = Column(String, index=True)  # normalize_key(license_plate)
     employee_name = Column(String)  # Tên nhân viên
     status = Column(String, default="Online")  # Trạng thái: Online hoặc OFF
     notes = Column(String)
@@ -292,6 +340,9 @@ class DailyRoute(Base):
 
 class FuelRecord(Base):
     __tablename__ = "fuel_records"
+    __table_args__ = (
+        Index('idx_fuel_records_date_plate', 'date', 'license_plate'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     date = Column(Date, nullable=False)  # Ngày đổ dầu
@@ -373,6 +424,8 @@ class RevenueRecord(Base):
     route_name = Column(String)  # Lộ trình (cho tuyến tăng cường)
     license_plate = Column(String)  # Biển số xe
     driver_name = Column(String)  # Tên tài xế
+    driver_name_key = Column(String, index=True)  # normalize_key(driver_name)
+    license_plate_key = Column(String, index=True)  # normalize_key(license_plate)
     notes = Column(String)  # Ghi chú
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -520,6 +573,44 @@ class Document(Base):
     creator = relationship("Account", foreign_keys=[created_by])
     updater = relationship("Account", foreign_keys=[updated_by])
 
+class StoredFile(Base):
+    """
+    Blob file upload lưu theo nội dung (content-addressed): Picture/blobs/ab/cd/<sha256>.<ext>.
+    Cùng một file upload nhiều lần chỉ tốn một bản trên đĩa; ref_count là số tham chiếu
+    (Employee.documents, Vehicle.inspection_documents, Vehicle.phu_hieu_files) tới blob.
+    """
+    __tablename__ = "stored_files"
+    
+    sha256 = Column(String(64), primary_key=True)
+    path = Column(String, nullable=False, unique=True)  # Relative path từ root project
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Attachment(Base):
+    """
+    File đính kèm của nhân viên/xe (giấy tờ, sổ đăng kiểm, phù hiệu vận tải), mỗi file một dòng.
+    Cột JSON cũ (Employee.documents, Vehicle.inspection_documents, Vehicle.phu_hieu_files)
+    chỉ còn là bản sao để tương thích, được ghi lại từ bảng này.
+    """
+    __tablename__ = "attachments_v2"
+    __table_args__ = (
+        Index('idx_attachments_v2_entity', 'entity_type', 'entity_id', 'file_type'),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    entity_type = Column(String, nullable=False)  # employee, vehicle
+    entity_id = Column(Integer, nullable=False)
+    file_path = Column(String, nullable=False)  # Giá trị như trong cột JSON cũ (Picture/... hoặc tên file trong static/uploads)
+    file_name = Column(String, nullable=False)  # Tên file gốc khi upload
+    file_size = Column(Integer)
+    mime_type = Column(String)
+    file_type = Column(String)  # document, inspection, phu_hieu
+    sha256 = Column(String(64), index=True)  # Blob trong stored_files (None với file cũ chưa gộp)
+    description = Column(String)
+    uploaded_by = Column(Integer, ForeignKey("accounts.id"), nullable=True)
+    uploaded_at = Column(DateTime, default=datetime.utcnow)
+
 class AuditLog(Base):
     """Bảng nhật ký hệ thống - ghi lại mọi thay đổi"""
     __tablename__ = "audit_logs"
@@ -563,6 +654,8 @@ class TimekeepingDetail(Base):
     date = Column(Date, nullable=False)
     license_plate = Column(String)
     driver_name = Column(String)
+    driver_name_key = Column(String, index=True)  # normalize_key(driver_name)
+    license_plate_key = Column(String, index=True)  # normalize_key(license_plate)
     trip_code = Column(String)  # Mã chuyến
     notes = Column(String)  # Ghi chú
     status = Column(String, default="Onl")  # Status: Onl hoặc OFF
@@ -573,6 +666,11 @@ class TimekeepingDetail(Base):
     total_amount = Column(Float, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Index cho phân trang keyset của API lọc: (table_id, route_code, date, id)
+    __table_args__ = (
+        Index('ix_timekeeping_details_filter_keyset', 'table_id', func.coalesce(route_code, ''), 'date', 'id'),
+    )
 
 
 class RoutePrice(Base):
@@ -617,6 +715,84 @@ class SalaryMonthly(Base):
     )
 
 
+class ExpiryEntry(Base):
+    """
+    Chỉ mục ngày hết hạn: đăng kiểm/phù hiệu (xe), bằng lái/CCCD (nhân viên), tài liệu hành chính.
+    Mỗi trường có ngày hết hạn của một bản ghi còn hiệu lực là một dòng, index theo ngày,
+    được cập nhật trong cùng transaction khi trường nguồn thay đổi (xem _sync_expiry_index).
+    """
+    __tablename__ = "expiry_index"
+    __table_args__ = (
+        UniqueConstraint('entity_type', 'entity_id', 'field', name='uq_expiry_index_entity_field'),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    entity_type = Column(String, nullable=False)  # vehicle, employee, document
+    entity_id = Column(Integer, nullable=False)
+    field = Column(String, nullable=False)  # inspection_expiry, phu_hieu_expired_date, license_expiry, cccd_expiry, expiry_date
+    expiry_date = Column(Date, nullable=False, index=True)
+    label = Column(String)  # Biển số xe / tên nhân viên / tiêu đề tài liệu
+
+class CacheVersion(Base):
+    """
+    Version của các loại dữ liệu được cache trong process (tuyến, xe, nhân viên...).
+    Tăng trong cùng transaction với thay đổi dữ liệu để mọi worker dùng chung transport.db biết cache đã cũ.
+    """
+    __tablename__ = "cache_versions"
+    
+    name = Column(String, primary_key=True)  # routes, vehicles, employees...
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+# ==================== NORMALIZED KEYS ====================
+# Cột *_key lưu sẵn dạng chuẩn hóa (bỏ dấu, viết hoa, gộp khoảng trắng) để so khớp tên/mã bằng index
+# thay vì chuẩn hóa từng dòng lúc truy vấn. Được điền bởi mapper event khi insert/update qua ORM;
+# bulk_insert_mappings/bulk_update_mappings không chạy event nên phải đi qua with_normalized_keys.
+NORMALIZED_KEY_COLUMNS = {
+    Route: {"route_code_key": "route_code"},
+    Employee: {"name_key": "name"},
+    DailyRoute: {"driver_name_key": "driver_name", "license_plate_key": "license_plate"},
+    RevenueRecord: {"driver_name_key": "driver_name", "license_plate_key": "license_plate"},
+    TimekeepingDetail: {"driver_name_key": "driver_name", "license_plate_key": "license_plate"},
+}
+TANG_CUONG_KEY = "TANG CUONG"
+
+def normalize_key(value) -> str:
+    """Chuẩn hóa chuỗi tiếng Việt để so sánh: bỏ dấu (kể cả đ/Đ), viết hoa, gộp khoảng trắng"""
+    if value is None:
+        return ""
+    normalized = unicodedata.normalize("NFKD", str(value).replace("đ", "d").replace("Đ", "D"))
+    normalized = "".join(c for c in normalized if unicodedata.category(c) != "Mn")
+    return " ".join(normalized.upper().split())
+
+def is_tang_cuong_code(route_code) -> bool:
+    """Mã tuyến có phải "Tăng Cường" không (không phân biệt dấu, hoa thường, khoảng trắng)"""
+    return normalize_key(route_code).replace(" ", "") == TANG_CUONG_KEY.replace(" ", "")
+
+def with_normalized_keys(model, values: dict) -> dict:
+    """Bổ sung các cột *_key vào dict values (dùng cho bulk_insert_mappings/bulk_update_mappings)"""
+    for key_column, source_column in NORMALIZED_KEY_COLUMNS[model].items():
+        if source_column in values:
+            values[key_column] = normalize_key(values[source_column]) or None
+    if model is Route and "route_code" in values:
+        values["is_tang_cuong"] = 1 if is_tang_cuong_code(values["route_code"]) else 0
+    return values
+
+def _fill_normalized_keys(mapper, connection, target):
+    for key_column, source_column in NORMALIZED_KEY_COLUMNS[mapper.class_].items():
+        setattr(target, key_column, normalize_key(getattr(target, source_column)) or None)
+    if isinstance(target, Route):
+        target.is_tang_cuong = 1 if is_tang_cuong_code(target.route_code) else 0
+
+for _model in NORMALIZED_KEY_COLUMNS:
+    event.listen(_model, "before_insert", _fill_normalized_keys)
+    event.listen(_model, "before_update", _fill_normalized_keys)
+
+def find_tang_cuong_route(db: Session) -> Optional[Route]:
+    """Tuyến "Tăng Cường" (tra theo cột is_tang_cuong đã index)"""
+    return db.query(Route).filter(Route.is_tang_cuong == 1).order_by(Route.id).first()
+
 
 # Helper function để lấy giá tuyến theo ngày
 def get_route_price_by_date(db: Session, route_id: int, target_date: date) -> Optional[RoutePrice]:
@@ -916,6 +1092,380 @@ def get_db():
     finally:
         db.close()
 
+# ==================== REFERENCE DATA CACHE ====================
+# Tuyến / xe / nhân viên ít thay đổi (vài lần mỗi tháng) nhưng gần như trang nào cũng truy vấn lại.
+# Cache trong process, đánh dấu bằng version của từng loại dữ liệu trong bảng cache_versions:
+# version tăng trong CÙNG transaction với mọi thêm/sửa/xóa bản ghi loại đó (bắt qua session event nên mọi
+# handler add/edit/delete đều tự bump), mỗi request đọc lại bảng version (vài dòng) một lần, nên khi chạy
+# nhiều worker trên cùng transport.db, worker nào cũng thấy cache của mình đã cũ ngay sau commit.
+# Bản ghi trả ra là namedtuple bất biến, không gắn với Session - chỉ có các cột, không có relationship.
+RouteRef = namedtuple("RouteRef", [column.name for column in Route.__table__.columns])
+VehicleRef = namedtuple("VehicleRef", [column.name for column in Vehicle.__table__.columns])
+EmployeeRef = namedtuple("EmployeeRef", [column.name for column in Employee.__table__.columns])
+
+REFERENCE_ENTITIES = {
+    "routes": (Route, RouteRef),
+    "vehicles": (Vehicle, VehicleRef),
+    "employees": (Employee, EmployeeRef),
+}
+
+# Các loại dữ liệu có version trong cache_versions (dữ liệu tham chiếu + dữ liệu của các API list dùng ETag)
+CACHE_VERSION_MODELS = {
+    **{name: model for name, (model, _) in REFERENCE_ENTITIES.items()},
+    "vehicle_assignments": VehicleAssignment,
+    "fuel_records": FuelRecord,
+    "diesel_prices": DieselPriceHistory,
+    "documents": Document,
+    "roles": Role,
+}
+
+# Version trong process: vẫn bump sau commit để cache đúng cả khi DB chưa có bảng cache_versions (chưa chạy init_db)
+_reference_versions = {name: 0 for name in REFERENCE_ENTITIES}
+_reference_cache = {}  # name -> ((version DB, version process), tuple bản ghi)
+_reference_cache_lock = threading.Lock()
+_cache_versions_table_ready = False
+
+def _has_cache_versions_table(connection) -> bool:
+    """Bảng cache_versions đã được tạo chưa (chỉ nhớ kết quả khi đã có, để DB được migrate sau vẫn nhận)"""
+    global _cache_versions_table_ready
+    if not _cache_versions_table_ready:
+        _cache_versions_table_ready = inspect(connection).has_table(CacheVersion.__tablename__)
+    return _cache_versions_table_ready
+
+def bump_reference_version(*names: str):
+    """Đánh dấu cache trong process của các loại dữ liệu tham chiếu đã cũ"""
+    with _reference_cache_lock:
+        for name in names:
+            _reference_versions[name] = _reference_versions.get(name, 0) + 1
+
+def get_cache_versions(db: Session) -> dict:
+    """
+    Version hiện tại của các loại dữ liệu được cache: {name: (version DB, version process)}.
+    Bảng cache_versions chỉ đọc một lần cho mỗi session (mỗi request); commit/rollback sẽ đọc lại.
+    """
+    db_versions = db.info.get("cache_versions")
+    if db_versions is None:
+        db_versions = {}
+        if _has_cache_versions_table(db.connection()):
+            db_versions = dict(db.query(CacheVersion.name, CacheVersion.version).all())
+        db.info["cache_versions"] = db_versions
+    with _reference_cache_lock:
+        local_versions = dict(_reference_versions)
+    return {
+        name: (db_versions.get(name, 0), local_versions.get(name, 0))
+        for name in set(db_versions) | set(local_versions)
+    }
+
+def get_reference_records(db: Session, name: str) -> tuple:
+    """Toàn bộ bản ghi (kể cả đã xóa mềm) của một loại dữ liệu tham chiếu, sắp theo id"""
+    # Đọc version TRƯỚC dữ liệu: nếu có commit xen giữa, dữ liệu chỉ có thể mới hơn version đã lưu kèm
+    version = get_cache_versions(db).get(name, (0, 0))
+    with _reference_cache_lock:
+        cached = _reference_cache.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    
+    model, record_type = REFERENCE_ENTITIES[name]
+    rows = db.query(*[getattr(model, field) for field in record_type._fields]).order_by(model.id).all()
+    records = tuple(record_type(*row) for row in rows)
+    with _reference_cache_lock:
+        # Không lưu nếu version trong process đã bị bump trong lúc đang đọc (dữ liệu vừa đọc có thể đã cũ)
+        if _reference_versions.get(name, 0) == version[1]:
+            _reference_cache[name] = (version, records)
+    return records
+
+def get_active_routes(db: Session, route_status: Optional[str] = None) -> List[RouteRef]:
+    """Tuyến đang hoạt động (is_active = 1, status = 1), tùy chọn lọc theo route_status (ONL/OFF)"""
+    return [
+        route for route in get_reference_records(db, "routes")
+        if route.is_active == 1 and route.status == 1
+        and (route_status is None or route.route_status == route_status)
+    ]
+
+def get_active_vehicles(db: Session, order_by_plate: bool = False) -> List[VehicleRef]:
+    """Xe đang hoạt động (status = 1)"""
+    vehicles = [vehicle for vehicle in get_reference_records(db, "vehicles") if vehicle.status == 1]
+    if order_by_plate:
+        vehicles.sort(key=lambda vehicle: vehicle.license_plate or "")
+    return vehicles
+
+def get_active_employees(db: Session, working_only: bool = False, order_by_name: bool = False) -> List[EmployeeRef]:
+    """Nhân viên chưa bị xóa (status = 1); working_only: chỉ lấy nhân viên Đang làm việc"""
+    employees = [
+        employee for employee in get_reference_records(db, "employees")
+        if employee.status == 1 and (not working_only or employee.employee_status == "Đang làm việc")
+    ]
+    if order_by_name:
+        employees.sort(key=lambda employee: employee.name or "")
+    return employees
+
+# ==================== CONDITIONAL GET (ETag) ====================
+# API list trả JSON kèm ETag tính từ version (cache_versions) của các loại dữ liệu mà response phụ thuộc.
+# Trình duyệt tự gửi If-None-Match khi gọi lại → trả 304 ngay, trước khi chạy query chính và serialize.
+def versioned_etag(request: Request, db: Session, *names: str, extra: str = "") -> Optional[str]:
+    """
+    ETag (weak) cho response phụ thuộc vào các loại dữ liệu `names` và query string của request.
+    Trả None khi DB chưa có bảng cache_versions: version trong process không đủ tin cậy giữa các worker.
+    """
+    import hashlib
+    versions = get_cache_versions(db)
+    if not _cache_versions_table_ready:
+        return None
+    parts = [request.url.path, str(request.url.query), extra]
+    parts += [f"{name}={versions.get(name, (0, 0))[0]}" for name in names]
+    return f'W/"{hashlib.md5("|".join(parts).encode("utf-8")).hexdigest()}"'
+
+def etag_matches(request: Request, etag: Optional[str]) -> bool:
+    """If-None-Match của request có khớp ETag hiện tại không (so sánh weak)"""
+    header = request.headers.get("if-none-match")
+    if not etag or not header:
+        return False
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+def with_etag(response: Response, etag: Optional[str]) -> Response:
+    """Gắn ETag vào response; no-cache để trình duyệt luôn hỏi lại server (và nhận 304 nếu không đổi)"""
+    if etag:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def mark_cache_versions_changed(session, *names: str):
+    """
+    Tăng version (cùng transaction) cho các loại dữ liệu đã thay đổi; cache trong process được bump sau commit.
+    Gọi tay sau bulk_insert_mappings/bulk_update_mappings vì các thao tác bulk không chạy after_flush.
+    """
+    if not names:
+        return
+    session.info.setdefault("reference_changes", set()).update(names)
+    
+    connection = session.connection()
+    if _has_cache_versions_table(connection):
+        now = datetime.utcnow()
+        for name in sorted(set(names)):
+            connection.execute(text(
+                "INSERT INTO cache_versions (name, version, updated_at) VALUES (:name, 1, :now) "
+                "ON CONFLICT(name) DO UPDATE SET version = version + 1, updated_at = :now"
+            ), {"name": name, "now": now})
+
+@event.listens_for(SessionLocal, "after_flush")
+def _track_reference_changes(session, flush_context):
+    """Tăng version (cùng transaction) cho loại dữ liệu tham chiếu vừa bị thêm/sửa/xóa"""
+    flushed = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        for name, model in CACHE_VERSION_MODELS.items():
+            if isinstance(obj, model):
+                flushed.add(name)
+    mark_cache_versions_changed(session, *flushed)
+
+@event.listens_for(SessionLocal, "after_commit")
+def _bump_reference_versions_after_commit(session):
+    session.info.pop("cache_versions", None)
+    changed = session.info.pop("reference_changes", None)
+    if changed:
+        bump_reference_version(*changed)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_reference_changes(session):
+    session.info.pop("cache_versions", None)
+    session.info.pop("reference_changes", None)
+
+# ==================== EXPIRY INDEX ====================
+# entity_type -> (model, ((trường ngày hết hạn, tên hiển thị), ...), thuộc tính làm label, điều kiện còn hiệu lực)
+EXPIRY_SOURCES = {
+    "vehicle": (Vehicle, (("inspection_expiry", "Đăng kiểm"), ("phu_hieu_expired_date", "Phù hiệu vận tải")),
+                "license_plate", lambda vehicle: vehicle.status in (None, 1)),
+    "employee": (Employee, (("license_expiry", "Bằng lái"), ("cccd_expiry", "CCCD")),
+                 "name", lambda employee: employee.status in (None, 1)),
+    "document": (Document, (("expiry_date", "Tài liệu"),),
+                 "title", lambda document: document.status != "archived"),
+}
+EXPIRY_FIELD_LABELS = {field: field_label for _, fields, _, _ in EXPIRY_SOURCES.values() for field, field_label in fields}
+EXPIRY_HORIZONS = (7, 30, 90)
+
+# entity_type -> trang quản lý; API trả dữ liệu của entity chỉ cho user có quyền xem trang đó
+ENTITY_PAGE_PATHS = {"vehicle": "/vehicles", "employee": "/employees", "document": "/administrative", "route": "/routes"}
+
+def viewable_entity_types(db: Session, current_user: dict) -> set:
+    """Các entity_type mà user được xem (theo quyền view trang quản lý tương ứng)"""
+    return {
+        entity_type for entity_type, page_path in ENTITY_PAGE_PATHS.items()
+        if check_permission(db, current_user["id"], page_path, "view")
+    }
+
+_expiry_index_table_ready = False
+
+def _has_expiry_index_table(connection) -> bool:
+    """Bảng expiry_index đã được tạo chưa (chỉ nhớ kết quả khi đã có, giống cache_versions)"""
+    global _expiry_index_table_ready
+    if not _expiry_index_table_ready:
+        _expiry_index_table_ready = inspect(connection).has_table(ExpiryEntry.__tablename__)
+    return _expiry_index_table_ready
+
+def expiry_index_rows(entity_type: str, obj) -> List[dict]:
+    """Các dòng expiry_index của một bản ghi nguồn (rỗng nếu đã xóa mềm/lưu trữ)"""
+    _, fields, label_attr, is_active = EXPIRY_SOURCES[entity_type]
+    if not is_active(obj):
+        return []
+    return [
+        {"entity_type": entity_type, "entity_id": obj.id, "field": field,
+         "expiry_date": getattr(obj, field), "label": getattr(obj, label_attr)}
+        for field, _ in fields
+        if getattr(obj, field) is not None
+    ]
+
+def _replace_expiry_rows(connection, entity_type: str, entity_id: int, rows: List[dict]):
+    connection.execute(
+        ExpiryEntry.__table__.delete().where(
+            ExpiryEntry.entity_type == entity_type, ExpiryEntry.entity_id == entity_id
+        )
+    )
+    if rows:
+        connection.execute(ExpiryEntry.__table__.insert(), rows)
+
+def rebuild_expiry_index(db: Session) -> int:
+    """Dựng lại toàn bộ expiry_index từ các bảng nguồn (dùng khi migrate), chưa commit"""
+    db.execute(ExpiryEntry.__table__.delete())
+    total = 0
+    for entity_type, (model, _, _, _) in EXPIRY_SOURCES.items():
+        rows = [row for obj in db.query(model).all() for row in expiry_index_rows(entity_type, obj)]
+        if rows:
+            db.execute(ExpiryEntry.__table__.insert(), rows)
+        total += len(rows)
+    return total
+
+@event.listens_for(SessionLocal, "after_flush")
+def _sync_expiry_index(session, flush_context):
+    """Cập nhật expiry_index (cùng transaction) cho xe/nhân viên/tài liệu vừa thêm/sửa/xóa"""
+    changes = []
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        for entity_type, (model, fields, label_attr, _) in EXPIRY_SOURCES.items():
+            if not isinstance(obj, model):
+                continue
+            if obj in session.deleted:
+                changes.append((entity_type, obj.id, []))
+            elif obj in session.new or any(
+                inspect(obj).attrs[name].history.has_changes()
+                for name in [field for field, _ in fields] + [label_attr, "status"]
+            ):
+                changes.append((entity_type, obj.id, expiry_index_rows(entity_type, obj)))
+    if not changes:
+        return
+    connection = session.connection()
+    if not _has_expiry_index_table(connection):
+        return
+    for entity_type, entity_id, rows in changes:
+        _replace_expiry_rows(connection, entity_type, entity_id, rows)
+
+# ==================== SEARCH INDEX (FTS5) ====================
+# Bảng ảo FTS5 search_fts đánh chỉ mục tài liệu + dữ liệu danh mục, được trigger SQLite giữ đồng bộ.
+# Tokenizer unicode61 bỏ dấu tiếng Việt; riêng "đ" không phải ký tự có dấu nên được thay bằng "d" trước khi index/tìm.
+# rowid = id * 8 + mã loại để trigger xóa/cập nhật theo rowid (không phải quét bảng FTS).
+SEARCH_FTS_TABLE = "search_fts"
+# entity_type -> (bảng nguồn, mã loại, biểu thức title, biểu thức body, điều kiện được index); {row} = new/old/tên bảng
+SEARCH_SOURCES = {
+    "document": ("documents", 1, "{row}.title",
+                 "coalesce({row}.description, '') || ' ' || coalesce({row}.notes, '') || ' ' || coalesce({row}.document_type, '')",
+                 "1"),
+    "employee": ("employees", 2, "{row}.name",
+                 "coalesce({row}.phone, '') || ' ' || coalesce({row}.position, '') || ' ' || coalesce({row}.driving_license, '')",
+                 "coalesce({row}.status, 1) = 1"),
+    "vehicle": ("vehicles", 3, "{row}.license_plate",
+                "coalesce({row}.vehicle_type, '')",
+                "coalesce({row}.status, 1) = 1"),
+    "route": ("routes", 4, "{row}.route_code",
+              "coalesce({row}.route_name, '') || ' ' || coalesce({row}.route_type, '')",
+              "coalesce({row}.status, 1) = 1"),
+}
+SEARCH_ROWID_FACTOR = 8
+
+def fold_search_text(value: str) -> str:
+    """Chuẩn hóa chuỗi tìm kiếm giống lúc index: đ/Đ -> d/D (dấu còn lại do tokenizer bỏ)"""
+    return value.replace("đ", "d").replace("Đ", "D")
+
+def _fold_search_sql(expression: str) -> str:
+    return f"replace(replace({expression}, 'đ', 'd'), 'Đ', 'D')"
+
+def _search_select_sql(entity_type: str, row: str) -> str:
+    """SELECT các cột của search_fts cho một bản ghi nguồn (row = new/old trong trigger, tên bảng khi rebuild)"""
+    table, code, title_sql, body_sql, condition_sql = SEARCH_SOURCES[entity_type]
+    return (
+        f"SELECT {row}.id * {SEARCH_ROWID_FACTOR} + {code}, '{entity_type}', {row}.id, "
+        f"{_fold_search_sql(title_sql.format(row=row))}, {_fold_search_sql(body_sql.format(row=row))} "
+        f"WHERE {condition_sql.format(row=row)}"
+    )
+
+def search_index_ddl() -> List[str]:
+    """Câu lệnh tạo bảng FTS5 và trigger insert/update/delete cho từng bảng nguồn"""
+    statements = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_FTS_TABLE} USING fts5("
+        "entity_type UNINDEXED, entity_id UNINDEXED, title, body, "
+        "tokenize = 'unicode61 remove_diacritics 2')"
+    ]
+    for entity_type, (table, code, _, _, _) in SEARCH_SOURCES.items():
+        insert_sql = f"INSERT INTO {SEARCH_FTS_TABLE}(rowid, entity_type, entity_id, title, body) {_search_select_sql(entity_type, 'new')};"
+        delete_sql = f"DELETE FROM {SEARCH_FTS_TABLE} WHERE rowid = old.id * {SEARCH_ROWID_FACTOR} + {code};"
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS {SEARCH_FTS_TABLE}_{table}_ai AFTER INSERT ON {table} BEGIN {insert_sql} END",
+            f"CREATE TRIGGER IF NOT EXISTS {SEARCH_FTS_TABLE}_{table}_au AFTER UPDATE ON {table} BEGIN {delete_sql} {insert_sql} END",
+            f"CREATE TRIGGER IF NOT EXISTS {SEARCH_FTS_TABLE}_{table}_ad AFTER DELETE ON {table} BEGIN {delete_sql} END",
+        ]
+    return statements
+
+def rebuild_search_index(db: Session) -> int:
+    """Tạo (nếu chưa có) và nạp lại toàn bộ search_fts từ các bảng nguồn, chưa commit. Chỉ hỗ trợ SQLite."""
+    for statement in search_index_ddl():
+        db.execute(text(statement))
+    db.execute(text(f"DELETE FROM {SEARCH_FTS_TABLE}"))
+    for entity_type, (table, _, _, _, _) in SEARCH_SOURCES.items():
+        select_sql = _search_select_sql(entity_type, table).replace(" WHERE ", f" FROM {table} WHERE ", 1)
+        db.execute(text(f"INSERT INTO {SEARCH_FTS_TABLE}(rowid, entity_type, entity_id, title, body) {select_sql}"))
+    return db.execute(text(f"SELECT count(*) FROM {SEARCH_FTS_TABLE}")).scalar()
+
+_search_index_ready = False
+
+def has_search_index(db: Session) -> bool:
+    """search_fts đã được tạo chưa (init_db); chưa có thì nơi gọi quay về LIKE"""
+    global _search_index_ready
+    if not _search_index_ready and engine.url.get_backend_name() == "sqlite":
+        _search_index_ready = inspect(db.connection()).has_table(SEARCH_FTS_TABLE)
+    return _search_index_ready
+
+def search_match_query(q: str) -> Optional[str]:
+    """Chuyển chuỗi người dùng nhập thành biểu thức MATCH: mọi từ đều phải có, tìm theo tiền tố ("51B-123" -> "51b"* "123"*)"""
+    import re
+    tokens = re.findall(r"\w+", fold_search_text(q).lower())
+    return " ".join(f'"{token}"*' for token in tokens) or None
+
+def search_index_hits(db: Session, q: str, entity_types: Optional[List[str]] = None, limit: int = 20) -> List[tuple]:
+    """[(entity_type, entity_id, score)] theo thứ hạng bm25 (title nặng hơn body)"""
+    match = search_match_query(q)
+    if not match:
+        return []
+    sql = (
+        f"SELECT entity_type, entity_id, bm25({SEARCH_FTS_TABLE}, 0, 0, 10.0, 1.0) AS score "
+        f"FROM {SEARCH_FTS_TABLE} WHERE {SEARCH_FTS_TABLE} MATCH :match"
+    )
+    params = {"match": match, "limit": limit}
+    if entity_types:
+        sql += " AND entity_type IN (" + ", ".join(f":type_{i}" for i in range(len(entity_types))) + ")"
+        params.update({f"type_{i}": entity_type for i, entity_type in enumerate(entity_types)})
+    sql += " ORDER BY score LIMIT :limit"
+    return [tuple(row) for row in db.execute(text(sql), params)]
+
+def search_entity_ids(db: Session, entity_type: str, q: str) -> Optional[List[int]]:
+    """Id các bản ghi `entity_type` khớp `q` (không giới hạn), hoặc None nếu chưa có search_fts"""
+    if not has_search_index(db):
+        return None
+    return [entity_id for _, entity_id, _ in search_index_hits(db, q, [entity_type], limit=-1)]
+
 def get_current_user(request: Request):
     """
     Dependency to get current logged-in user from session.
@@ -1239,22 +1789,221 @@ def ensure_directory_exists(directory_path: str):
         os.makedirs(directory_path, exist_ok=True)
     return directory_path
 
+# File upload được chép xuống đĩa theo từng chunk trong threadpool:
+# RAM không tăng theo kích thước file và event loop không bị chặn khi nhiều người cùng upload.
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE_MB", "20")) * 1024 * 1024
+
+class UploadTooLargeError(ValueError):
+    """File upload vượt quá giới hạn kích thước"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        super().__init__(f"File vượt quá giới hạn {max_size / 1024 / 1024:.0f}MB")
+
+def write_upload_to_disk(source, destination: str, max_size: int = MAX_UPLOAD_SIZE) -> Tuple[int, str]:
+    """Chép file-like `source` xuống `destination` theo từng chunk.
+
+    Ghi ra file tạm (tên riêng cho mỗi lần ghi) rồi mới đổi tên, nên không bao giờ để lại file dở dang
+    và hai request cùng ghi một blob (cùng nội dung → cùng path) không giẫm lên file tạm của nhau.
+    Trả về (số byte, sha256 hex); vượt max_size thì raise UploadTooLargeError.
+    """
+    import hashlib
+    import tempfile
+    digest = hashlib.sha256()
+    size = 0
+    directory = os.path.dirname(os.path.abspath(destination))
+    ensure_directory_exists(directory)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(destination) + ".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            for chunk in iter_upload_chunks(source, max_size):
+                size += len(chunk)
+                digest.update(chunk)
+                buffer.write(chunk)
+        os.chmod(temp_path, 0o644)  # mkstemp tạo file 0600, file upload cần đọc được như file ghi bằng open()
+        try:
+            os.replace(temp_path, destination)
+        except OSError:
+            # Request khác vừa ghi xong cùng file (Windows không cho replace file đang mở): coi như thành công
+            if not os.path.exists(destination):
+                raise
+            os.remove(temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return size, digest.hexdigest()
+
+def iter_upload_chunks(source, max_size: int = MAX_UPLOAD_SIZE):
+    """Đọc file-like theo từng chunk UPLOAD_CHUNK_SIZE, raise UploadTooLargeError khi vượt max_size"""
+    size = 0
+    while True:
+        chunk = source.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if max_size and size > max_size:
+            raise UploadTooLargeError(max_size)
+        yield chunk
+
+def hash_upload(source, max_size: int = MAX_UPLOAD_SIZE) -> Tuple[int, str]:
+    """Tính (số byte, sha256 hex) của file-like mà không ghi ra đĩa"""
+    import hashlib
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter_upload_chunks(source, max_size):
+        size += len(chunk)
+        digest.update(chunk)
+    return size, digest.hexdigest()
+
+async def stream_upload_to_disk(file: UploadFile, destination: str, max_size: int = MAX_UPLOAD_SIZE) -> Tuple[int, str]:
+    """Phiên bản async của write_upload_to_disk cho UploadFile (chạy trong threadpool)"""
+    await file.seek(0)
+    return await run_in_threadpool(write_upload_to_disk, file.file, destination, max_size)
+
+def upload_file_size(file: UploadFile) -> int:
+    """Kích thước UploadFile mà không đọc nội dung vào RAM"""
+    current = file.file.tell()
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(current)
+    return size
+
 # ==================== DOCUMENTS UPLOAD CONFIGURATION ====================
 # Base directory for document uploads
 DOCUMENTS_UPLOAD_DIR = "uploads/documents"
 
 # Allowed document file types
 ALLOWED_DOCUMENT_EXTENSIONS = {".pdf", ".doc", ".docx", ".jpg", ".jpeg", ".png"}
+MAX_DOCUMENT_SIZE = 10 * 1024 * 1024  # 10MB
+DOCUMENT_MEDIA_TYPES = {
+    ".pdf": "application/pdf",
+    ".doc": "application/msword",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png"
+}
 
 def ensure_document_dirs():
-    """Ensure document upload directories exist"""
+    """Ensure document upload directories exist (theo BASE_DIR, không phụ thuộc working directory)"""
     # Create main documents directory
-    ensure_directory_exists(DOCUMENTS_UPLOAD_DIR)
+    ensure_directory_exists(os.path.join(BASE_DIR, DOCUMENTS_UPLOAD_DIR))
     
     # Create subdirectories by type/category
     subdirs = ["contracts", "company", "tax", "others"]
     for subdir in subdirs:
-        ensure_directory_exists(os.path.join(DOCUMENTS_UPLOAD_DIR, subdir))
+        ensure_directory_exists(os.path.join(BASE_DIR, DOCUMENTS_UPLOAD_DIR, subdir))
+
+def resolve_document_path(file_path: str) -> Optional[str]:
+    """Đường dẫn tuyệt đối của file tài liệu, None nếu nằm ngoài thư mục uploads/documents hoặc không tồn tại.
+
+    Document.file_path là relative path từ root project; resolve theo BASE_DIR (không phụ thuộc
+    working directory) và chặn path thoát ra ngoài thư mục lưu trữ (../, symlink).
+    """
+    if not file_path:
+        return None
+    storage_root = os.path.realpath(os.path.join(BASE_DIR, DOCUMENTS_UPLOAD_DIR))
+    full_path = os.path.realpath(os.path.join(BASE_DIR, file_path))
+    if os.path.commonpath([storage_root, full_path]) != storage_root:
+        return None
+    return full_path if os.path.isfile(full_path) else None
+
+def parse_byte_range(range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
+    """Parse header Range dạng "bytes=start-end" (một khoảng).
+
+    Trả về (start, end) tính cả end; (-1, -1) nếu khoảng không thỏa mãn được (416);
+    None nếu header không hợp lệ hoặc có nhiều khoảng (khi đó trả cả file, đúng RFC 9110).
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start_text, _, end_text = ranges.strip().partition("-")
+    try:
+        if start_text == "":
+            # bytes=-N: N byte cuối
+            suffix = int(end_text)
+            if suffix <= 0:
+                return (-1, -1)
+            return (max(file_size - suffix, 0), file_size - 1)
+        start = int(start_text)
+        end = int(end_text) if end_text else None
+    except ValueError:
+        return None
+    if end is not None and start > end:
+        return None
+    if start >= file_size:
+        return (-1, -1)
+    if end is None:
+        end = file_size - 1
+    return (start, min(end, file_size - 1))
+
+def iter_file_range(full_path: str, start: int, length: int):
+    with open(full_path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(UPLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def document_file_response(request: Request, full_path: str, media_type: str, content_disposition: str) -> Response:
+    """Trả file tài liệu có ETag/Last-Modified (304), Range (206/416) và Cache-Control private.
+
+    PDF viewer của trình duyệt tải theo từng đoạn khi tua trang và revalidate khi mở lại,
+    nên không phải tải lại cả file scan.
+    """
+    import hashlib
+    from email.utils import formatdate, parsedate_to_datetime
+    from fastapi.responses import StreamingResponse
+
+    stat_result = os.stat(full_path)
+    file_size = stat_result.st_size
+    etag = '"' + hashlib.md5(f"{stat_result.st_mtime_ns}-{file_size}".encode()).hexdigest() + '"'
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": content_disposition,
+    }
+
+    def not_modified_since(header_value: Optional[str]) -> bool:
+        if not header_value:
+            return False
+        try:
+            return int(stat_result.st_mtime) <= parsedate_to_datetime(header_value).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    # If-None-Match được ưu tiên hơn If-Modified-Since
+    if request.headers.get("if-none-match"):
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={k: v for k, v in headers.items() if k != "Content-Disposition"})
+    elif not_modified_since(request.headers.get("if-modified-since")):
+        return Response(status_code=304, headers={k: v for k, v in headers.items() if k != "Content-Disposition"})
+
+    range_header = request.headers.get("range")
+    if range_header:
+        # If-Range: chỉ trả một đoạn nếu file chưa đổi so với bản client đang có (so sánh strong)
+        if_range = request.headers.get("if-range")
+        if if_range and if_range.strip() != etag and if_range.strip() != last_modified:
+            range_header = None
+    byte_range = parse_byte_range(range_header, file_size) if range_header else None
+
+    if byte_range == (-1, -1):
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{file_size}", "Accept-Ranges": "bytes"})
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        headers.update({"Content-Range": f"bytes {start}-{end}/{file_size}", "Content-Length": str(length)})
+        return StreamingResponse(iter_file_range(full_path, start, length), status_code=206, media_type=media_type, headers=headers)
+
+    return FileResponse(full_path, media_type=media_type, headers=headers, stat_result=stat_result)
 
 def get_document_category_folder(category: str, document_type: str) -> str:
     """Map category/document_type to folder structure"""
@@ -1288,15 +2037,72 @@ def validate_document_file(filename: str) -> Tuple[bool, Optional[str]]:
     
     return True, None
 
-def save_uploaded_file(
+# ==================== CONTENT-ADDRESSED STORAGE ====================
+# File upload (giấy tờ nhân viên, sổ đăng kiểm, phù hiệu) lưu theo SHA-256 nội dung,
+# chia 2 cấp thư mục để mỗi thư mục không quá nhiều file.
+BLOB_DIR = os.path.join(PICTURE_BASE_DIR, "blobs")
+
+def blob_file_path(sha256: str, file_extension: str) -> str:
+    """Relative path của blob: Picture/blobs/ab/cd/<sha256><ext>"""
+    return "/".join((BLOB_DIR.replace("\\", "/"), sha256[:2], sha256[2:4], sha256 + file_extension))
+
+def acquire_stored_file(db: Session, sha256: str, path: str, size: int) -> str:
+    """Thêm 1 tham chiếu tới blob (tạo row nếu chưa có), trả về path của blob.
+
+    Dùng upsert trên cùng transaction với thay đổi entity: rollback thì ref_count cũng rollback,
+    và hai request upload cùng file một lúc không đụng unique constraint.
+    """
+    db.execute(
+        text(
+            "INSERT INTO stored_files (sha256, path, size, ref_count, created_at) "
+            "VALUES (:sha256, :path, :size, 1, :created_at) "
+            "ON CONFLICT(sha256) DO UPDATE SET ref_count = ref_count + 1"
+        ),
+        {"sha256": sha256, "path": path, "size": size, "created_at": datetime.utcnow()},
+    )
+    return db.execute(text("SELECT path FROM stored_files WHERE sha256 = :sha256"), {"sha256": sha256}).scalar()
+
+def release_stored_file(db: Session, file_path: str) -> Optional[str]:
+    """Bớt 1 tham chiếu tới file; trả về path cần xóa trên đĩa SAU KHI commit (None nếu còn được dùng).
+
+    File cũ không nằm trong stored_files (path theo timestamp, static/uploads) không dùng chung
+    với ai nên luôn được trả về để xóa như trước.
+    """
+    stored = db.query(StoredFile).filter(StoredFile.path == file_path).first()
+    if not stored:
+        return file_path
+    stored.ref_count -= 1
+    if stored.ref_count > 0:
+        return None
+    db.delete(stored)
+    return file_path
+
+def purge_released_files(db: Session, file_paths):
+    """Xóa trên đĩa các file release_stored_file trả về, gọi sau db.commit().
+
+    Blob trong BLOB_DIR không bị xóa ở đây: request khác có thể vừa dùng lại blob (thấy file đã có nên
+    không ghi) mà chưa commit stored_files. Blob không còn tham chiếu được scripts/gc_files.py dọn sau
+    (có grace period theo mtime và thư mục cách ly).
+    """
+    blob_prefix = BLOB_DIR.replace("\\", "/") + "/"
+    for file_path in file_paths:
+        if not file_path or file_path.replace("\\", "/").startswith(blob_prefix):
+            continue
+        if db.query(StoredFile.sha256).filter(StoredFile.path == file_path).first():
+            continue
+        delete_file_if_exists(file_path)
+
+async def save_uploaded_file(
     file: UploadFile,
     category: str,
     subcategory: str,
     entity_id: str,
-    entity_type: str = "vehicle"
+    entity_type: str = "vehicle",
+    *,
+    db: Session
 ) -> str:
     """
-    Lưu file upload với cấu trúc thư mục mới
+    Lưu file upload vào kho content-addressed và thêm 1 tham chiếu tới blob
     
     Args:
         file: UploadFile object
@@ -1304,9 +2110,10 @@ def save_uploaded_file(
         subcategory: Thư mục con (registration, insurance, vehicle_photos, etc.)
         entity_id: ID của entity (license_plate cho vehicle, id cho employee, etc.)
         entity_type: Loại entity (vehicle, employee, etc.)
+        db: Session của request; ref_count được ghi cùng transaction với entity
     
     Returns:
-        str: Relative path từ root project (ví dụ: Picture/vehicles/registration/vehicle_50H14740_20260122103015.jpg)
+        str: Relative path từ root project (ví dụ: Picture/blobs/3f/a2/3fa2...e9.jpg)
     """
     # Validate file
     if not file or not file.filename:
@@ -1318,37 +2125,202 @@ def save_uploaded_file(
     if file_extension not in allowed_extensions:
         raise ValueError(f"File extension không được phép: {file_extension}")
     
-    # Tạo tên file mới: {entity}_{id}_{yyyyMMddHHmmss}.{ext}
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    # Sanitize entity_id để tránh ký tự đặc biệt trong tên file
-    safe_entity_id = re.sub(r'[^\w\-]', '_', str(entity_id))
-    new_filename = f"{entity_type}_{safe_entity_id}_{timestamp}{file_extension}"
-    
-    # Tạo đường dẫn thư mục
-    directory_path = os.path.join(PICTURE_BASE_DIR, category, subcategory)
-    ensure_directory_exists(directory_path)
+    # Băm nội dung trước (đọc từ file tạm của upload, giới hạn MAX_UPLOAD_SIZE)
+    await file.seek(0)
+    size, sha256 = await run_in_threadpool(hash_upload, file.file)
     
-    # Đường dẫn đầy đủ để lưu file
-    full_file_path = os.path.join(directory_path, new_filename)
+    stored_path = db.query(StoredFile.path).filter(StoredFile.sha256 == sha256).scalar()
+    full_file_path = stored_path or blob_file_path(sha256, file_extension)
     
-    # Lưu file (sử dụng absolute path để đảm bảo)
-    abs_file_path = os.path.abspath(full_file_path)
-    abs_dir_path = os.path.dirname(abs_file_path)
-    ensure_directory_exists(abs_dir_path)
+    # File giống hệt đã có trên đĩa: không ghi lại, chỉ tăng ref_count. Cập nhật mtime để gc_files.py
+    # không coi blob là mồ côi trong lúc stored_files của request này chưa commit.
+    if os.path.exists(full_file_path):
+        try:
+            os.utime(full_file_path)
+        except OSError:
+            pass
+    else:
+        try:
+            await stream_upload_to_disk(file, os.path.abspath(full_file_path))
+        except UploadTooLargeError:
+            raise
+        except Exception as e:
+            raise Exception(f"Lỗi khi lưu file: {str(e)}")
+        
+        # Sinh ảnh thu nhỏ để modal giấy tờ không phải tải ảnh gốc; lỗi ở đây không làm hỏng upload
+        try:
+            await run_in_threadpool(generate_thumbnails, full_file_path)
+        except Exception as e:
+            print(f"Lỗi khi tạo ảnh thu nhỏ cho {full_file_path}: {e}")
     
-    # Đọc và lưu file
-    # Note: file.file.read() sẽ đọc toàn bộ nội dung vào memory
-    # Đối với file lớn có thể cần stream, nhưng với ảnh thông thường thì OK
+    return acquire_stored_file(db, sha256, full_file_path, size)
+
+# ==================== ATTACHMENTS ====================
+# (entity_type, kind) -> (model, cột JSON tương thích)
+ATTACHMENT_JSON_COLUMNS = {
+    ("employee", "document"): (Employee, "documents"),
+    ("vehicle", "inspection"): (Vehicle, "inspection_documents"),
+    ("vehicle", "phu_hieu"): (Vehicle, "phu_hieu_files"),
+}
+
+def attachment_disk_path(file_path: str) -> str:
+    """Path trên đĩa: hỗ trợ cả path mới (Picture/...) và path cũ (tên file trong static/uploads/)"""
+    return file_path if file_path.startswith("Picture/") else f"static/uploads/{file_path}"
+
+def attachment_url(file_path: str) -> str:
+    return get_file_url(file_path) if file_path.startswith("Picture/") else f"/static/uploads/{file_path}"
+
+async def attach_uploaded_file(db: Session, file: UploadFile, entity_type: str, entity_id: int, kind: str) -> "Attachment":
+    """Lưu file upload (content-addressed) và thêm một dòng attachments_v2, chưa commit"""
+    file_path = await save_uploaded_file(
+        file=file,
+        category=f"{entity_type}s",
+        subcategory=kind,
+        entity_id=str(entity_id),
+        entity_type=entity_type,
+        db=db
+    )
+    sha256, size = db.query(StoredFile.sha256, StoredFile.size).filter(StoredFile.path == file_path).one()
+    attachment = Attachment(
+        entity_type=entity_type,
+        entity_id=entity_id,
+        file_type=kind,
+        file_path=file_path,
+        file_name=os.path.basename(file.filename),
+        file_size=size,
+        mime_type=file.content_type,
+        sha256=sha256,
+    )
+    db.add(attachment)
+    return attachment
+
+def list_attachments(db: Session, entity_type: str, entity_id: int, kind: str) -> List["Attachment"]:
+    return db.query(Attachment).filter(
+        Attachment.entity_type == entity_type,
+        Attachment.entity_id == entity_id,
+        Attachment.file_type == kind,
+    ).order_by(Attachment.id).all()
+
+def sync_attachment_json(db: Session, entity, entity_type: str, kind: str):
+    """
+    Ghi lại cột JSON cũ của entity từ attachments_v2 (chỉ để tương thích, app không đọc cột này).
+    File trong cột JSON cũ chưa có dòng trong bảng (DB chưa chạy migrate_attachments_table) được thêm
+    vào bảng trước, để lần upload/xóa đầu tiên không làm mất path cũ.
+    """
+    import json
+    _, column = ATTACHMENT_JSON_COLUMNS[(entity_type, kind)]
+    # File vừa bị xóa trong request này (chưa flush) không được thêm lại từ cột JSON cũ
+    removed_paths = {
+        obj.file_path for obj in db.deleted
+        if isinstance(obj, Attachment) and obj.entity_type == entity_type
+        and obj.entity_id == entity.id and obj.file_type == kind
+    }
+    db.flush()
+    paths = [path for (path,) in db.query(Attachment.file_path).filter(
+        Attachment.entity_type == entity_type,
+        Attachment.entity_id == entity.id,
+        Attachment.file_type == kind,
+    ).order_by(Attachment.id)]
+    
+    known_paths = set(paths) | removed_paths
+    legacy_paths = from_json(getattr(entity, column))
+    if isinstance(legacy_paths, str):
+        legacy_paths = [legacy_paths]
+    for legacy_path in legacy_paths if isinstance(legacy_paths, list) else []:
+        if not legacy_path or not isinstance(legacy_path, str) or legacy_path in known_paths:
+            continue
+        disk_path = attachment_disk_path(legacy_path)
+        db.add(Attachment(
+            entity_type=entity_type,
+            entity_id=entity.id,
+            file_type=kind,
+            file_path=legacy_path,
+            file_name=os.path.basename(legacy_path),
+            file_size=os.path.getsize(disk_path) if os.path.isfile(disk_path) else None,
+            sha256=db.query(StoredFile.sha256).filter(StoredFile.path == disk_path).scalar(),
+        ))
+        known_paths.add(legacy_path)
+        paths.append(legacy_path)
+    
+    setattr(entity, column, json.dumps(paths) if paths else None)
+
+def attachment_to_dict(attachment: "Attachment") -> dict:
+    """Dữ liệu một file cho API danh sách giấy tờ (giữ format cũ, thêm id/tên gốc/thumbnail)"""
+    file_path = attachment_disk_path(attachment.file_path)
+    file_url = attachment_url(attachment.file_path)
+    data = {
+        "id": attachment.id,
+        "filename": os.path.basename(attachment.file_path),
+        "original_name": attachment.file_name,
+        "url": file_url,
+    }
+    if not os.path.exists(file_path):
+        data.update({"exists": False, "error": "File không tồn tại trên server"})
+        return data
+    data.update(thumbnail_url_fields(file_path, file_url))
+    data.update({
+        "size": attachment.file_size if attachment.file_size is not None else os.path.getsize(file_path),
+        "extension": os.path.splitext(attachment.file_path)[1].lower(),
+        "exists": True,
+    })
+    return data
+
+def find_attachment(db: Session, entity_type: str, entity_id: int, kind: str,
+                    filename: Optional[str] = None, attachment_id: Optional[int] = None) -> Optional["Attachment"]:
+    """Tìm file theo id, hoặc theo tên (basename/path như cột JSON cũ) cho các client cũ"""
+    query = db.query(Attachment).filter(
+        Attachment.entity_type == entity_type,
+        Attachment.entity_id == entity_id,
+        Attachment.file_type == kind,
+    )
+    if attachment_id is not None:
+        return query.filter(Attachment.id == attachment_id).first()
+    if not filename:
+        return None
+    # Mỗi entity chỉ có vài file nên so khớp basename ngay trong Python
+    for attachment in query.order_by(Attachment.id).all():
+        if attachment.file_path == filename or os.path.basename(attachment.file_path) == filename:
+            return attachment
+    return None
+
+def attachment_list_response(db: Session, entity_type: str, entity_id: int, kind: str, empty_message: str):
+    attachments = list_attachments(db, entity_type, entity_id, kind)
+    if not attachments:
+        return JSONResponse(
+            status_code=200,
+            content={"success": True, "documents": [], "message": empty_message}
+        )
+    documents = [attachment_to_dict(attachment) for attachment in attachments]
+    return JSONResponse(
+        status_code=200,
+        content={"success": True, "documents": documents, "total": len(documents)}
+    )
+
+def delete_attachment_response(db: Session, entity, entity_type: str, kind: str,
+                               filename: Optional[str], attachment_id: Optional[int],
+                               not_found_error: str, success_message: str):
+    """Xóa một file đính kèm: xóa 1 dòng, bớt ref_count blob, đồng bộ cột JSON; file trên đĩa xóa sau commit"""
+    attachment = find_attachment(db, entity_type, entity.id, kind, filename, attachment_id)
+    if not attachment:
+        return JSONResponse(status_code=400, content={"success": False, "error": not_found_error})
     try:
-        with open(abs_file_path, "wb") as buffer:
-            content = file.file.read()
-            buffer.write(content)
-            file.file.seek(0)  # Reset file pointer để có thể đọc lại nếu cần
+        released_path = release_stored_file(db, attachment_disk_path(attachment.file_path))
+        db.delete(attachment)
+        sync_attachment_json(db, entity, entity_type, kind)
+        db.commit()
+        purge_released_files(db, [released_path])
     except Exception as e:
-        raise Exception(f"Lỗi khi lưu file: {str(e)}")
-    
-    # Trả về relative path từ root project
-    return full_file_path.replace("\\", "/")  # Normalize path separators
+        db.rollback()
+        return JSONResponse(status_code=500, content={"success": False, "error": f"Lỗi hệ thống: {str(e)}"})
+    remaining = db.query(func.count(Attachment.id)).filter(
+        Attachment.entity_type == entity_type,
+        Attachment.entity_id == entity.id,
+        Attachment.file_type == kind,
+    ).scalar()
+    return JSONResponse(
+        status_code=200,
+        content={"success": True, "message": success_message, "remaining_documents": remaining}
+    )
 
 def get_file_url(file_path: str) -> str:
     """
@@ -1368,6 +2340,88 @@ def get_file_url(file_path: str) -> str:
         normalized_path = "/" + normalized_path
     return normalized_path
 
+# ==================== THUMBNAILS ====================
+# Ảnh thu nhỏ nằm cạnh ảnh gốc: {thư mục gốc}/thumbs/{size}/{tên file gốc}.jpg
+# để được phục vụ bởi cùng mount (/Picture hoặc /static) và cùng quyền truy cập.
+THUMBNAIL_DIR_NAME = "thumbs"
+THUMBNAIL_SIZES = {"thumb": 320, "medium": 1280}
+THUMBNAIL_SOURCE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+def thumbnail_file_path(file_path: str, size_name: str) -> str:
+    """Path của ảnh thu nhỏ ứng với file gốc (relative path như trong DB)"""
+    file_path = file_path.replace("\\", "/")
+    directory, filename = os.path.split(file_path)
+    # Giữ cả đuôi gốc (a.png -> a.png.jpg) để a.png và a.jpg không dùng chung thumbnail
+    return "/".join(part for part in (directory, THUMBNAIL_DIR_NAME, size_name, filename + ".jpg") if part)
+
+def is_thumbnail_path(file_path: str) -> bool:
+    """True nếu path nằm trong thư mục thumbs (để batch job/GC bỏ qua)"""
+    parts = file_path.replace("\\", "/").split("/")
+    return len(parts) >= 3 and parts[-3] == THUMBNAIL_DIR_NAME and parts[-2] in THUMBNAIL_SIZES
+
+def generate_thumbnails(file_path: str, force: bool = False) -> dict:
+    """Sinh ảnh thu nhỏ cho file ảnh, trả về {size_name: path} các bản đã có.
+
+    Không làm gì với PDF/file không phải ảnh hoặc khi chưa cài Pillow.
+    Bản thu nhỏ mới hơn file gốc thì giữ nguyên (trừ khi force=True).
+    """
+    if os.path.splitext(file_path)[1].lower() not in THUMBNAIL_SOURCE_EXTENSIONS:
+        return {}
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return {}
+
+    source_mtime = os.path.getmtime(file_path)
+    pending = {}
+    result = {}
+    for size_name, max_px in THUMBNAIL_SIZES.items():
+        target = thumbnail_file_path(file_path, size_name)
+        if not force and os.path.exists(target) and os.path.getmtime(target) >= source_mtime:
+            result[size_name] = target
+        else:
+            pending[size_name] = (target, max_px)
+    if not pending:
+        return result
+
+    with Image.open(file_path) as image:
+        # JPEG: để decoder thu nhỏ luôn khi giải nén (DCT scaling), nhanh hơn nhiều với ảnh scan vài MB
+        largest = max(max_px for _, max_px in pending.values())
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        # Từ lớn đến nhỏ để bản nhỏ được resize từ bản lớn
+        for size_name, (target, max_px) in sorted(pending.items(), key=lambda item: -item[1][1]):
+            image.thumbnail((max_px, max_px), Image.LANCZOS)
+            ensure_directory_exists(os.path.dirname(os.path.abspath(target)))
+            image.save(target, "JPEG", quality=80, optimize=True, progressive=True)
+            result[size_name] = target
+    return result
+
+def delete_thumbnails(file_path: str):
+    """Xóa các ảnh thu nhỏ của file gốc (nếu có)"""
+    for size_name in THUMBNAIL_SIZES:
+        target = thumbnail_file_path(file_path, size_name)
+        if os.path.exists(target):
+            try:
+                os.remove(target)
+            except Exception as e:
+                print(f"Lỗi khi xóa ảnh thu nhỏ {target}: {e}")
+
+def thumbnail_url_fields(file_path: str, file_url: str) -> dict:
+    """URL ảnh thu nhỏ cho API danh sách giấy tờ; chưa có thumbnail thì dùng URL gốc"""
+    def url_for(size_name: str) -> str:
+        target = thumbnail_file_path(file_path, size_name)
+        return get_file_url(target) if os.path.exists(target) else file_url
+    return {"thumbnail_url": url_for("thumb"), "medium_url": url_for("medium")}
+
 def delete_file_if_exists(file_path: str):
     """Xóa file vật lý nếu tồn tại"""
     if file_path:
@@ -1382,6 +2436,129 @@ def delete_file_if_exists(file_path: str):
                 os.remove(abs_path)
             except Exception as e:
                 print(f"Lỗi khi xóa file {abs_path}: {e}")
+        delete_thumbnails(file_path)
+
+# ==================== STORAGE GC ====================
+# File chỉ bị xóa khi handler gọi delete_file_if_exists: transaction lỗi, sửa cột JSON, upload thay thế...
+# để lại file mồ côi. scan_storage đối chiếu các thư mục lưu trữ với mọi cột DB chứa path;
+# file mồ côi được chuyển vào thư mục cách ly trước, sau một thời gian mới xóa hẳn (scripts/gc_files.py).
+STORAGE_ROOTS = (PICTURE_BASE_DIR, "static/uploads", DOCUMENTS_UPLOAD_DIR)
+STORAGE_QUARANTINE_DIR = os.path.join(BASE_DIR, ".storage_quarantine")
+STORAGE_GC_GRACE_SECONDS = 3600  # File mới ghi có thể thuộc upload chưa commit: không coi là mồ côi
+
+def _storage_key(file_path: str) -> str:
+    """Path relative từ root project, dạng "/" và Unicode NFC (tên file tiếng Việt trên đĩa có thể là NFD)"""
+    file_path = unicodedata.normalize("NFC", file_path.replace("\\", "/"))
+    return file_path[2:] if file_path.startswith("./") else file_path
+
+def referenced_storage_paths(db: Session) -> set:
+    """Mọi path file đang được DB tham chiếu: attachments_v2, cột JSON cũ, stored_files, documents"""
+    import json
+    referenced = {_storage_key(attachment_disk_path(file_path)) for (file_path,) in db.query(Attachment.file_path)}
+    for model, column in ATTACHMENT_JSON_COLUMNS.values():
+        for (value,) in db.query(getattr(model, column)).filter(getattr(model, column).isnot(None)):
+            try:
+                file_paths = json.loads(value)
+            except (TypeError, ValueError):
+                continue
+            referenced.update(_storage_key(attachment_disk_path(p)) for p in file_paths if isinstance(p, str) and p)
+    referenced.update(_storage_key(file_path) for (file_path,) in db.query(StoredFile.path))
+    referenced.update(_storage_key(file_path) for (file_path,) in db.query(Document.file_path) if file_path)
+    return referenced
+
+def storage_category(file_path: str) -> str:
+    """Nhóm để báo cáo dung lượng: Picture/blobs, Picture/<loại>, static/uploads, uploads/documents/<loại>, thumbs"""
+    if is_thumbnail_path(file_path):
+        return THUMBNAIL_DIR_NAME
+    parts = file_path.split("/")
+    if file_path.startswith(DOCUMENTS_UPLOAD_DIR + "/"):
+        return "/".join(parts[:3]) if len(parts) > 3 else DOCUMENTS_UPLOAD_DIR
+    if parts[0] == PICTURE_BASE_DIR:
+        return "/".join(parts[:2]) if len(parts) > 2 else PICTURE_BASE_DIR
+    return "static/uploads"
+
+def _thumbnail_source_path(file_path: str) -> str:
+    """Ngược lại của thumbnail_file_path: dir/thumbs/<size>/<tên gốc>.jpg -> dir/<tên gốc>"""
+    parts = file_path.split("/")
+    return "/".join(parts[:-3] + [parts[-1][:-len(".jpg")]])
+
+def scan_storage(db: Session, grace_seconds: int = STORAGE_GC_GRACE_SECONDS) -> dict:
+    """
+    Duyệt STORAGE_ROOTS, trả về {"categories": {nhóm: {files, bytes, orphan_files, orphan_bytes}},
+    "orphans": [(path, size)], "files", "bytes"}. Ảnh thu nhỏ mồ côi khi file gốc không còn được tham chiếu.
+    """
+    referenced = referenced_storage_paths(db)
+    cutoff = datetime.now().timestamp() - grace_seconds
+    categories = {}
+    orphans = []
+    for root in STORAGE_ROOTS:
+        for directory, _, filenames in os.walk(os.path.join(BASE_DIR, root)):
+            for filename in filenames:
+                full_path = os.path.join(directory, filename)
+                try:
+                    stat_result = os.stat(full_path)
+                except OSError:
+                    continue
+                file_path = _storage_key(os.path.relpath(full_path, BASE_DIR))
+                stats = categories.setdefault(storage_category(file_path), {"files": 0, "bytes": 0, "orphan_files": 0, "orphan_bytes": 0})
+                stats["files"] += 1
+                stats["bytes"] += stat_result.st_size
+                
+                source = _thumbnail_source_path(file_path) if is_thumbnail_path(file_path) else file_path
+                if source in referenced or stat_result.st_mtime > cutoff:
+                    continue
+                stats["orphan_files"] += 1
+                stats["orphan_bytes"] += stat_result.st_size
+                orphans.append((os.path.relpath(full_path, BASE_DIR).replace("\\", "/"), stat_result.st_size))
+    return {
+        "categories": dict(sorted(categories.items())),
+        "orphans": sorted(orphans),
+        "files": sum(stats["files"] for stats in categories.values()),
+        "bytes": sum(stats["bytes"] for stats in categories.values()),
+    }
+
+def quarantine_orphans(db: Session, file_paths, quarantine_dir: str = STORAGE_QUARANTINE_DIR) -> Tuple[int, Optional[str]]:
+    """
+    Chuyển file mồ côi vào quarantine_dir/<timestamp>/<path gốc>, trả về (số file, thư mục lô).
+    Đọc lại tham chiếu ngay trước khi chuyển để không động tới file vừa được upload/gộp lại.
+    """
+    import shutil
+    referenced = referenced_storage_paths(db)
+    batch_dir = os.path.join(quarantine_dir, datetime.now().strftime("%Y%m%d_%H%M%S"))
+    moved = 0
+    for file_path in file_paths:
+        key = _storage_key(file_path)
+        source = _thumbnail_source_path(key) if is_thumbnail_path(key) else key
+        full_path = os.path.join(BASE_DIR, file_path)
+        if source in referenced or not os.path.isfile(full_path):
+            continue
+        target = os.path.join(batch_dir, file_path)
+        ensure_directory_exists(os.path.dirname(target))
+        shutil.move(full_path, target)
+        moved += 1
+    return moved, (batch_dir if moved else None)
+
+def purge_quarantine(older_than_days: int, quarantine_dir: str = STORAGE_QUARANTINE_DIR) -> Tuple[int, int]:
+    """Xóa hẳn các lô cách ly cũ hơn older_than_days ngày, trả về (số file, số byte) đã xóa"""
+    import shutil
+    if not os.path.isdir(quarantine_dir):
+        return 0, 0
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    removed_files = removed_bytes = 0
+    for batch in sorted(os.listdir(quarantine_dir)):
+        try:
+            batch_time = datetime.strptime(batch, "%Y%m%d_%H%M%S")
+        except ValueError:
+            continue
+        if batch_time > cutoff:
+            continue
+        batch_dir = os.path.join(quarantine_dir, batch)
+        for directory, _, filenames in os.walk(batch_dir):
+            for filename in filenames:
+                removed_files += 1
+                removed_bytes += os.path.getsize(os.path.join(directory, filename))
+        shutil.rmtree(batch_dir)
+    return removed_files, removed_bytes
 
 # Mount static files (use absolute paths so it works under WSGI/any working dir)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -1395,13 +2572,131 @@ ensure_directory_exists(STATIC_DIR)
 ensure_directory_exists(UPLOADS_DIR)
 ensure_directory_exists(PICTURE_DIR)
 
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+# ==================== STATIC ASSETS ====================
+# Các biến thể nén sẵn (.br/.gz) do scripts/build_static.py sinh ra cạnh file gốc.
+# Ảnh JPG/PNG/PDF đã nén sẵn nên không nằm trong danh sách này.
+PRECOMPRESSED_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+COMPRESSIBLE_STATIC_EXTENSIONS = {".css", ".js", ".mjs", ".json", ".svg", ".txt", ".html", ".map"}
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# full_path -> (mtime_ns, size, fingerprint); chỉ băm lại khi file thay đổi
+_static_fingerprints = {}
+
+def static_fingerprint(full_path: str, stat_result: Optional[os.stat_result] = None) -> Optional[str]:
+    """Trả về hash nội dung (12 ký tự hex) của file, None nếu file không tồn tại"""
+    import hashlib
+    try:
+        stat_result = stat_result or os.stat(full_path)
+    except OSError:
+        return None
+    cached = _static_fingerprints.get(full_path)
+    if cached and cached[0] == stat_result.st_mtime_ns and cached[1] == stat_result.st_size:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(full_path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    fingerprint = digest.hexdigest()[:12]
+    _static_fingerprints[full_path] = (stat_result.st_mtime_ns, stat_result.st_size, fingerprint)
+    return fingerprint
+
+def static_url(path: str) -> str:
+    """URL tới file trong /static kèm fingerprint nội dung
+    Usage trong template: <link rel="stylesheet" href="{{ static_url('style.css') }}">
+    """
+    path = path.lstrip("/")
+    fingerprint = static_fingerprint(os.path.join(STATIC_DIR, path))
+    url = "/static/" + quote(path)
+    return f"{url}?v={fingerprint}" if fingerprint else url
+
+def accepted_encodings(request_headers) -> set:
+    """Các content-coding client chấp nhận (bỏ qua những coding có q=0)"""
+    accepted = set()
+    for item in request_headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name)
+    return accepted
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles có Cache-Control và phục vụ biến thể nén sẵn.
+
+    - URL có ?v=<fingerprint> khớp nội dung hiện tại: cache immutable 1 năm.
+    - Còn lại dùng cache_control của mount; ETag/Last-Modified (và 304) do Starlette xử lý.
+    """
+
+    def __init__(self, *args, cache_control: str = "no-cache", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        import mimetypes
+        from urllib.parse import parse_qs
+        from starlette.datastructures import Headers
+        from starlette.staticfiles import NotModifiedResponse
+
+        full_path = str(full_path)
+        request_headers = Headers(scope=scope)
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        version = (query.get("v") or [None])[0]
+
+        cache_control = self.cache_control
+        if version and version == static_fingerprint(full_path, stat_result):
+            cache_control = IMMUTABLE_CACHE_CONTROL
+
+        compressible = os.path.splitext(full_path)[1].lower() in COMPRESSIBLE_STATIC_EXTENSIONS
+        response = None
+        if compressible:
+            accepted = accepted_encodings(request_headers)
+            media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+            for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+                if encoding not in accepted:
+                    continue
+                try:
+                    variant_stat = os.stat(full_path + suffix)
+                except OSError:
+                    continue
+                # Biến thể cũ hơn file gốc (quên build lại) thì bỏ qua
+                if variant_stat.st_mtime_ns < stat_result.st_mtime_ns:
+                    continue
+                response = FileResponse(
+                    full_path + suffix, status_code=status_code, stat_result=variant_stat,
+                    method=scope["method"], media_type=media_type,
+                    headers={"Content-Encoding": encoding},
+                )
+                break
+        if response is None:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, method=scope["method"])
+
+        response.headers["Cache-Control"] = cache_control
+        if compressible:
+            response.headers["Vary"] = "Accept-Encoding"
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+templates.env.globals["static_url"] = static_url
+
+# /static không cần đăng nhập; /Picture, /uploads và static/uploads (đường dẫn file đính kèm cũ: CCCD, GPLX,
+# đăng ký xe...) chứa giấy tờ cá nhân nên chỉ cache ở trình duyệt. Mount static/uploads phải đứng trước /static.
+os.makedirs(os.path.join(STATIC_DIR, "uploads"), exist_ok=True)
+app.mount("/static/uploads", CachedStaticFiles(directory=os.path.join(STATIC_DIR, "uploads"), cache_control="private, no-cache"), name="static_uploads")
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
 # Mount Picture directory để truy cập ảnh
-app.mount("/Picture", StaticFiles(directory=PICTURE_DIR), name="picture")
+app.mount("/Picture", CachedStaticFiles(directory=PICTURE_DIR, cache_control="private, no-cache"), name="picture")
 
 # Mount documents upload directory
 ensure_document_dirs()
-app.mount("/uploads", StaticFiles(directory=UPLOADS_DIR), name="uploads")
+app.mount("/uploads", CachedStaticFiles(directory=UPLOADS_DIR, cache_control="private, no-cache"), name="uploads")
 
 # Ensure administrative documents directory exists (function is defined later in file)
 
@@ -1608,100 +2903,25 @@ async def get_employee_documents(employee_id: int, db: Session = Depends(get_db)
             content={"success": False, "error": "Không tìm thấy nhân viên"}
         )
     
-    if not employee.documents:
-        return JSONResponse(
-            status_code=200,
-            content={"success": True, "documents": [], "message": "Nhân viên chưa upload giấy tờ"}
-        )
-    
-    try:
-        import json
-        documents = json.loads(employee.documents)
-        
-        # Kiểm tra file tồn tại
-        existing_documents = []
-        for doc in documents:
-            # Hỗ trợ cả path cũ (static/uploads/) và path mới (Picture/...)
-            if doc.startswith("Picture/"):
-                # Path mới - sử dụng trực tiếp
-                file_path = doc
-                file_url = get_file_url(doc)
-            else:
-                # Path cũ - giữ nguyên để backward compatibility
-                file_path = f"static/uploads/{doc}"
-                file_url = f"/static/uploads/{doc}"
-            
-            if os.path.exists(file_path):
-                file_size = os.path.getsize(file_path)
-                file_extension = os.path.splitext(doc)[1].lower()
-                filename = os.path.basename(doc) if "/" in doc else doc
-                existing_documents.append({
-                    "filename": filename,
-                    "url": file_url,
-                    "size": file_size,
-                    "extension": file_extension,
-                    "exists": True
-                })
-            else:
-                filename = os.path.basename(doc) if "/" in doc else doc
-                existing_documents.append({
-                    "filename": filename,
-                    "url": file_url,
-                    "exists": False,
-                    "error": "File không tồn tại trên server"
-                })
-        
-        return JSONResponse(
-            status_code=200,
-            content={
-                "success": True, 
-                "documents": existing_documents,
-                "total": len(existing_documents)
-            }
-        )
-        
-    except json.JSONDecodeError:
-        # Xử lý dữ liệu cũ (không phải JSON)
-        if isinstance(employee.documents, str) and employee.documents.strip():
-            file_path = f"static/uploads/{employee.documents}"
-            if os.path.exists(file_path):
-                return JSONResponse(
-                    status_code=200,
-                    content={
-                        "success": True,
-                        "documents": [{
-                            "filename": employee.documents,
-                            "url": f"/static/uploads/{employee.documents}",
-                            "size": os.path.getsize(file_path),
-                            "extension": os.path.splitext(employee.documents)[1].lower(),
-                            "exists": True
-                        }],
-                        "total": 1
-                    }
-                )
-        
-        return JSONResponse(
-            status_code=200,
-            content={"success": True, "documents": [], "message": "Dữ liệu giấy tờ không hợp lệ"}
-        )
-
-@app.post("/employees/add")
-async def add_employee(
-    name: str = Form(...),
-    birth_date: str = Form(""),
-    phone: str = Form(""),
-    cccd: str = Form(""),
-    cccd_issue_date: str = Form(""),
-    cccd_expiry: str = Form(""),
-    driving_license: str = Form(""),
-    license_expiry: str = Form(""),
-    employee_status: str = Form("Đang làm việc"),
-    position: str = Form(""),
-    social_insurance_salary: str = Form(""),
-    documents: list[UploadFile] = File(None),
-    db: Session = Depends(get_db)
-):
-    import json
+    return attachment_list_response(db, "employee", employee.id, "document", "Nhân viên chưa upload giấy tờ")
+
+@app.post("/employees/add")
+async def add_employee(
+    name: str = Form(...),
+    birth_date: str = Form(""),
+    phone: str = Form(""),
+    cccd: str = Form(""),
+    cccd_issue_date: str = Form(""),
+    cccd_expiry: str = Form(""),
+    driving_license: str = Form(""),
+    license_expiry: str = Form(""),
+    employee_status: str = Form("Đang làm việc"),
+    position: str = Form(""),
+    social_insurance_salary: str = Form(""),
+    documents: list[UploadFile] = File(None),
+    db: Session = Depends(get_db)
+):
+    import json
     
     # Convert date strings to date objects
     birth_date_obj = None
@@ -1748,27 +2968,15 @@ async def add_employee(
     db.flush()  # Lấy ID mà không commit
     
     # Handle multiple file uploads - sau khi có employee ID
-    documents_paths = []
     if documents:
         for document in documents:
             if document and document.filename:
                 try:
-                    # Sử dụng helper function để lưu file với cấu trúc mới
-                    file_path = save_uploaded_file(
-                        file=document,
-                        category="employees",
-                        subcategory="documents",
-                        entity_id=str(employee.id),
-                        entity_type="employee"
-                    )
-                    documents_paths.append(file_path)
+                    await attach_uploaded_file(db, document, "employee", employee.id, "document")
                 except Exception as e:
                     print(f"Lỗi khi lưu file giấy tờ nhân viên: {e}")
                     continue  # Skip file nếu có lỗi
-    
-    # Convert documents list to JSON string và cập nhật employee
-    documents_json = json.dumps(documents_paths) if documents_paths else None
-    employee.documents = documents_json
+        sync_attachment_json(db, employee, "employee", "document")
     
     db.commit()
     return RedirectResponse(url="/employees", status_code=303)
@@ -1826,37 +3034,16 @@ async def edit_employee(
     if license_expiry:
         license_expiry_date = datetime.strptime(license_expiry, "%Y-%m-%d").date()
     
-    # Handle multiple file uploads
+    # Handle multiple file uploads - thêm vào danh sách giấy tờ hiện có
     if documents:
-        documents_paths = []
         for document in documents:
             if document and document.filename:
                 try:
-                    # Sử dụng helper function để lưu file với cấu trúc mới
-                    file_path = save_uploaded_file(
-                        file=document,
-                        category="employees",
-                        subcategory="documents",
-                        entity_id=str(employee.id),
-                        entity_type="employee"
-                    )
-                    documents_paths.append(file_path)
+                    await attach_uploaded_file(db, document, "employee", employee.id, "document")
                 except Exception as e:
                     print(f"Lỗi khi lưu file giấy tờ nhân viên: {e}")
                     continue  # Skip file nếu có lỗi
-        
-        if documents_paths:
-            # Get existing documents and append new ones
-            existing_documents = []
-            if employee.documents:
-                try:
-                    existing_documents = json.loads(employee.documents)
-                except json.JSONDecodeError:
-                    existing_documents = []
-            
-            # Combine existing and new documents
-            all_documents = existing_documents + documents_paths
-            employee.documents = json.dumps(all_documents)
+        sync_attachment_json(db, employee, "employee", "document")
     
     # Update employee data
     employee.name = name
@@ -1891,10 +3078,11 @@ async def edit_employee(
 @app.delete("/employees/documents/{employee_id}")
 async def delete_employee_document(
     employee_id: int, 
-    filename: str,
+    filename: Optional[str] = None,
+    attachment_id: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    """API để xóa giấy tờ của nhân viên"""
+    """API để xóa giấy tờ của nhân viên (theo attachment_id, hoặc filename cho client cũ)"""
     employee = db.query(Employee).filter(Employee.id == employee_id, Employee.status == 1).first()
     if not employee:
         return JSONResponse(
@@ -1902,72 +3090,11 @@ async def delete_employee_document(
             content={"success": False, "error": "Không tìm thấy nhân viên"}
         )
     
-    if not employee.documents:
-        return JSONResponse(
-            status_code=400,
-            content={"success": False, "error": "Nhân viên chưa có giấy tờ nào"}
-        )
-    
-    try:
-        import json
-        documents = json.loads(employee.documents)
-        
-        # Tìm file trong danh sách (có thể là filename hoặc full path)
-        file_to_remove = None
-        for doc in documents:
-            # So sánh với filename hoặc basename của path
-            doc_basename = os.path.basename(doc) if "/" in doc else doc
-            if doc == filename or doc_basename == filename:
-                file_to_remove = doc
-                break
-        
-        if not file_to_remove:
-            return JSONResponse(
-                status_code=400,
-                content={"success": False, "error": "File không tồn tại trong danh sách giấy tờ"}
-            )
-        
-        # Xóa file khỏi thư mục lưu trữ
-        # Hỗ trợ cả path cũ và mới
-        if file_to_remove.startswith("Picture/"):
-            file_path = file_to_remove
-        else:
-            file_path = f"static/uploads/{file_to_remove}"
-        
-        delete_file_if_exists(file_path)
-        
-        # Xóa file khỏi danh sách trong DB
-        documents.remove(file_to_remove)
-        
-        if documents:
-            # Còn giấy tờ khác, cập nhật danh sách
-            employee.documents = json.dumps(documents)
-        else:
-            # Không còn giấy tờ nào, set null
-            employee.documents = None
-        
-        db.commit()
-        
-        return JSONResponse(
-            status_code=200,
-            content={
-                "success": True, 
-                "message": "Xóa giấy tờ thành công",
-                "remaining_documents": len(documents) if documents else 0
-            }
-        )
-        
-    except json.JSONDecodeError:
-        return JSONResponse(
-            status_code=500,
-            content={"success": False, "error": "Lỗi định dạng dữ liệu giấy tờ"}
-        )
-    except Exception as e:
-        db.rollback()
-        return JSONResponse(
-            status_code=500,
-            content={"success": False, "error": f"Lỗi hệ thống: {str(e)}"}
-        )
+    return delete_attachment_response(
+        db, employee, "employee", "document", filename, attachment_id,
+        not_found_error="File không tồn tại trong danh sách giấy tờ",
+        success_message="Xóa giấy tờ thành công",
+    )
 
 @app.get("/vehicles", response_class=HTMLResponse)
 async def vehicles_page(request: Request, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
@@ -2018,8 +3145,6 @@ async def add_vehicle(
     phu_hieu_files: list[UploadFile] = File(None),
     db: Session = Depends(get_db)
 ):
-    import json
-    
     # Convert date string to date object
     inspection_expiry_date = None
     if inspection_expiry:
@@ -2028,69 +3153,47 @@ async def add_vehicle(
         except ValueError:
             pass
     
+    # Handle phù hiệu vận tải date
+    phu_hieu_expired_date_obj = None
+    if phu_hieu_expired_date:
+        try:
+            phu_hieu_expired_date_obj = datetime.strptime(phu_hieu_expired_date, "%Y-%m-%d").date()
+        except ValueError:
+            pass
+    
+    vehicle = Vehicle(
+        license_plate=license_plate,
+        vehicle_type=vehicle_type,
+        capacity=capacity,
+        fuel_consumption=fuel_consumption,
+        inspection_expiry=inspection_expiry_date,
+        phu_hieu_expired_date=phu_hieu_expired_date_obj
+    )
+    db.add(vehicle)
+    db.flush()  # Lấy ID để gắn file đính kèm
+    
     # Handle multiple file uploads - Sổ đăng kiểm
-    documents_paths = []
     if inspection_documents:
         for document in inspection_documents:
             if document and document.filename:
                 try:
-                    # Sử dụng helper function để lưu file với cấu trúc mới
-                    file_path = save_uploaded_file(
-                        file=document,
-                        category="vehicles",
-                        subcategory="registration",
-                        entity_id=license_plate,
-                        entity_type="vehicle"
-                    )
-                    documents_paths.append(file_path)
+                    await attach_uploaded_file(db, document, "vehicle", vehicle.id, "inspection")
                 except Exception as e:
                     print(f"Lỗi khi lưu file sổ đăng kiểm: {e}")
                     continue  # Skip file nếu có lỗi
-    
-    # Convert documents list to JSON string
-    documents_json = json.dumps(documents_paths) if documents_paths else None
-    
-    # Handle phù hiệu vận tải date
-    phu_hieu_expired_date_obj = None
-    if phu_hieu_expired_date:
-        try:
-            phu_hieu_expired_date_obj = datetime.strptime(phu_hieu_expired_date, "%Y-%m-%d").date()
-        except ValueError:
-            pass
+        sync_attachment_json(db, vehicle, "vehicle", "inspection")
     
     # Handle phù hiệu vận tải file uploads
-    phu_hieu_paths = []
     if phu_hieu_files:
         for document in phu_hieu_files:
             if document and document.filename:
                 try:
-                    # Sử dụng helper function để lưu file với cấu trúc mới
-                    file_path = save_uploaded_file(
-                        file=document,
-                        category="vehicles",
-                        subcategory="insurance",
-                        entity_id=license_plate,
-                        entity_type="vehicle"
-                    )
-                    phu_hieu_paths.append(file_path)
+                    await attach_uploaded_file(db, document, "vehicle", vehicle.id, "phu_hieu")
                 except Exception as e:
                     print(f"Lỗi khi lưu file phù hiệu vận tải: {e}")
                     continue  # Skip file nếu có lỗi
+        sync_attachment_json(db, vehicle, "vehicle", "phu_hieu")
     
-    # Convert phù hiệu files list to JSON string
-    phu_hieu_json = json.dumps(phu_hieu_paths) if phu_hieu_paths else None
-    
-    vehicle = Vehicle(
-        license_plate=license_plate,
-        vehicle_type=vehicle_type,
-        capacity=capacity,
-        fuel_consumption=fuel_consumption,
-        inspection_expiry=inspection_expiry_date,
-        inspection_documents=documents_json,
-        phu_hieu_expired_date=phu_hieu_expired_date_obj,
-        phu_hieu_files=phu_hieu_json
-    )
-    db.add(vehicle)
     db.commit()
     return RedirectResponse(url="/vehicles", status_code=303)
 
@@ -2122,8 +3225,6 @@ async def edit_vehicle(
     phu_hieu_files: list[UploadFile] = File(None),
     db: Session = Depends(get_db)
 ):
-    import json
-    
     vehicle = db.query(Vehicle).filter(Vehicle.id == vehicle_id, Vehicle.status == 1).first()
     if not vehicle:
         return RedirectResponse(url="/vehicles", status_code=303)
@@ -2138,35 +3239,14 @@ async def edit_vehicle(
     
     # Handle multiple file uploads - append to existing documents
     if inspection_documents:
-        documents_paths = []
         for document in inspection_documents:
             if document and document.filename:
                 try:
-                    # Sử dụng helper function để lưu file với cấu trúc mới
-                    file_path = save_uploaded_file(
-                        file=document,
-                        category="vehicles",
-                        subcategory="registration",
-                        entity_id=vehicle.license_plate,
-                        entity_type="vehicle"
-                    )
-                    documents_paths.append(file_path)
+                    await attach_uploaded_file(db, document, "vehicle", vehicle.id, "inspection")
                 except Exception as e:
                     print(f"Lỗi khi lưu file sổ đăng kiểm: {e}")
                     continue  # Skip file nếu có lỗi
-        
-        if documents_paths:
-            # Get existing documents and append new ones
-            existing_documents = []
-            if vehicle.inspection_documents:
-                try:
-                    existing_documents = json.loads(vehicle.inspection_documents)
-                except json.JSONDecodeError:
-                    existing_documents = []
-            
-            # Combine existing and new documents
-            all_documents = existing_documents + documents_paths
-            vehicle.inspection_documents = json.dumps(all_documents)
+        sync_attachment_json(db, vehicle, "vehicle", "inspection")
     
     # Handle phù hiệu vận tải date
     phu_hieu_expired_date_obj = None
@@ -2178,35 +3258,14 @@ async def edit_vehicle(
     
     # Handle phù hiệu vận tải file uploads - append to existing files
     if phu_hieu_files:
-        phu_hieu_paths = []
         for document in phu_hieu_files:
             if document and document.filename:
                 try:
-                    # Sử dụng helper function để lưu file với cấu trúc mới
-                    file_path = save_uploaded_file(
-                        file=document,
-                        category="vehicles",
-                        subcategory="insurance",
-                        entity_id=vehicle.license_plate,
-                        entity_type="vehicle"
-                    )
-                    phu_hieu_paths.append(file_path)
+                    await attach_uploaded_file(db, document, "vehicle", vehicle.id, "phu_hieu")
                 except Exception as e:
                     print(f"Lỗi khi lưu file phù hiệu vận tải: {e}")
                     continue  # Skip file nếu có lỗi
-        
-        if phu_hieu_paths:
-            # Get existing phù hiệu files and append new ones
-            existing_phu_hieu = []
-            if vehicle.phu_hieu_files:
-                try:
-                    existing_phu_hieu = json.loads(vehicle.phu_hieu_files)
-                except json.JSONDecodeError:
-                    existing_phu_hieu = []
-            
-            # Combine existing and new phù hiệu files
-            all_phu_hieu = existing_phu_hieu + phu_hieu_paths
-            vehicle.phu_hieu_files = json.dumps(all_phu_hieu)
+        sync_attachment_json(db, vehicle, "vehicle", "phu_hieu")
     
     # Update vehicle data
     vehicle.license_plate = license_plate
@@ -2229,103 +3288,16 @@ async def get_vehicle_documents(vehicle_id: int, db: Session = Depends(get_db)):
             content={"success": False, "error": "Không tìm thấy xe"}
         )
     
-    # Log thông tin xe để debug
-    print(f"DEBUG: Vehicle ID: {vehicle_id}, License Plate: {vehicle.license_plate}")
-    print(f"DEBUG: inspection_documents value: {vehicle.inspection_documents}")
-    
-    if not vehicle.inspection_documents:
-        return JSONResponse(
-            status_code=200,
-            content={"success": True, "documents": [], "message": "Xe chưa upload sổ đăng kiểm"}
-        )
-    
-    try:
-        import json
-        documents = json.loads(vehicle.inspection_documents)
-        print(f"DEBUG: Parsed documents: {documents}")
-        
-        # Kiểm tra file tồn tại
-        existing_documents = []
-        for doc in documents:
-            # Hỗ trợ cả path cũ (static/uploads/) và path mới (Picture/...)
-            if doc.startswith("Picture/"):
-                # Path mới - sử dụng trực tiếp
-                file_path = doc
-                file_url = get_file_url(doc)
-            else:
-                # Path cũ - giữ nguyên để backward compatibility
-                file_path = f"static/uploads/{doc}"
-                file_url = f"/static/uploads/{doc}"
-            
-            file_exists = os.path.exists(file_path)
-            print(f"DEBUG: Checking file: {file_path}, exists: {file_exists}")
-            
-            if file_exists:
-                try:
-                    file_size = os.path.getsize(file_path)
-                    file_extension = os.path.splitext(doc)[1].lower()
-                    # Lấy tên file từ path
-                    filename = os.path.basename(doc) if "/" in doc else doc
-                    existing_documents.append({
-                        "filename": filename,
-                        "url": file_url,
-                        "size": file_size,
-                        "extension": file_extension,
-                        "exists": True
-                    })
-                    print(f"DEBUG: Added document: {doc}, size: {file_size} bytes")
-                except Exception as e:
-                    print(f"DEBUG: Error getting file size for {doc}: {e}")
-                    filename = os.path.basename(doc) if "/" in doc else doc
-                    existing_documents.append({
-                        "filename": filename,
-                        "url": file_url,
-                        "exists": False,
-                        "error": f"Lỗi khi đọc file: {str(e)}"
-                    })
-            else:
-                filename = os.path.basename(doc) if "/" in doc else doc
-                existing_documents.append({
-                    "filename": filename,
-                    "url": file_url,
-                    "exists": False,
-                    "error": "File không tồn tại trên server"
-                })
-                print(f"DEBUG: File not found: {file_path}")
-        
-        print(f"DEBUG: Returning {len(existing_documents)} documents")
-        return JSONResponse(
-            status_code=200,
-            content={
-                "success": True, 
-                "documents": existing_documents,
-                "total": len(existing_documents)
-            }
-        )
-        
-    except json.JSONDecodeError as e:
-        print(f"DEBUG: JSON decode error: {e}")
-        print(f"DEBUG: Raw inspection_documents: {vehicle.inspection_documents}")
-        return JSONResponse(
-            status_code=200,
-            content={"success": True, "documents": [], "message": f"Dữ liệu sổ đăng kiểm không hợp lệ: {str(e)}"}
-        )
-    except Exception as e:
-        print(f"DEBUG: Unexpected error: {e}")
-        import traceback
-        traceback.print_exc()
-        return JSONResponse(
-            status_code=500,
-            content={"success": False, "error": f"Lỗi hệ thống: {str(e)}"}
-        )
+    return attachment_list_response(db, "vehicle", vehicle.id, "inspection", "Xe chưa upload sổ đăng kiểm")
 
 @app.delete("/vehicles/documents/{vehicle_id}")
 async def delete_vehicle_document(
     vehicle_id: int, 
-    filename: str,
+    filename: Optional[str] = None,
+    attachment_id: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    """API để xóa sổ đăng kiểm của xe"""
+    """API để xóa sổ đăng kiểm của xe (theo attachment_id, hoặc filename cho client cũ)"""
     vehicle = db.query(Vehicle).filter(Vehicle.id == vehicle_id, Vehicle.status == 1).first()
     if not vehicle:
         return JSONResponse(
@@ -2333,72 +3305,11 @@ async def delete_vehicle_document(
             content={"success": False, "error": "Không tìm thấy xe"}
         )
     
-    if not vehicle.inspection_documents:
-        return JSONResponse(
-            status_code=400,
-            content={"success": False, "error": "Xe chưa có sổ đăng kiểm nào"}
-        )
-    
-    try:
-        import json
-        documents = json.loads(vehicle.inspection_documents)
-        
-        # Tìm file trong danh sách (có thể là filename hoặc full path)
-        file_to_remove = None
-        for doc in documents:
-            # So sánh với filename hoặc basename của path
-            doc_basename = os.path.basename(doc) if "/" in doc else doc
-            if doc == filename or doc_basename == filename:
-                file_to_remove = doc
-                break
-        
-        if not file_to_remove:
-            return JSONResponse(
-                status_code=400,
-                content={"success": False, "error": "File không tồn tại trong danh sách sổ đăng kiểm"}
-            )
-        
-        # Xóa file khỏi thư mục lưu trữ
-        # Hỗ trợ cả path cũ và mới
-        if file_to_remove.startswith("Picture/"):
-            file_path = file_to_remove
-        else:
-            file_path = f"static/uploads/{file_to_remove}"
-        
-        delete_file_if_exists(file_path)
-        
-        # Xóa file khỏi danh sách trong DB
-        documents.remove(file_to_remove)
-        
-        if documents:
-            # Còn sổ đăng kiểm khác, cập nhật danh sách
-            vehicle.inspection_documents = json.dumps(documents)
-        else:
-            # Không còn sổ đăng kiểm nào, set null
-            vehicle.inspection_documents = None
-        
-        db.commit()
-        
-        return JSONResponse(
-            status_code=200,
-            content={
-                "success": True, 
-                "message": "Xóa sổ đăng kiểm thành công",
-                "remaining_documents": len(documents) if documents else 0
-            }
-        )
-        
-    except json.JSONDecodeError:
-        return JSONResponse(
-            status_code=500,
-            content={"success": False, "error": "Lỗi định dạng dữ liệu sổ đăng kiểm"}
-        )
-    except Exception as e:
-        db.rollback()
-        return JSONResponse(
-            status_code=500,
-            content={"success": False, "error": f"Lỗi hệ thống: {str(e)}"}
-        )
+    return delete_attachment_response(
+        db, vehicle, "vehicle", "inspection", filename, attachment_id,
+        not_found_error="File không tồn tại trong danh sách sổ đăng kiểm",
+        success_message="Xóa sổ đăng kiểm thành công",
+    )
 
 @app.get("/vehicles/phu-hieu-documents/{vehicle_id}")
 async def get_vehicle_phu_hieu_documents(vehicle_id: int, db: Session = Depends(get_db)):
@@ -2410,71 +3321,16 @@ async def get_vehicle_phu_hieu_documents(vehicle_id: int, db: Session = Depends(
             content={"success": False, "error": "Không tìm thấy xe"}
         )
     
-    if not vehicle.phu_hieu_files:
-        return JSONResponse(
-            status_code=200,
-            content={"success": True, "documents": [], "message": "Xe chưa upload phù hiệu vận tải"}
-        )
-    
-    try:
-        import json
-        documents = json.loads(vehicle.phu_hieu_files)
-        
-        # Kiểm tra file tồn tại
-        existing_documents = []
-        for doc in documents:
-            # Hỗ trợ cả path cũ (static/uploads/) và path mới (Picture/...)
-            if doc.startswith("Picture/"):
-                # Path mới - sử dụng trực tiếp
-                file_path = doc
-                file_url = get_file_url(doc)
-            else:
-                # Path cũ - giữ nguyên để backward compatibility
-                file_path = f"static/uploads/{doc}"
-                file_url = f"/static/uploads/{doc}"
-            
-            if os.path.exists(file_path):
-                file_size = os.path.getsize(file_path)
-                file_extension = os.path.splitext(doc)[1].lower()
-                filename = os.path.basename(doc) if "/" in doc else doc
-                existing_documents.append({
-                    "filename": filename,
-                    "url": file_url,
-                    "size": file_size,
-                    "extension": file_extension,
-                    "exists": True
-                })
-            else:
-                filename = os.path.basename(doc) if "/" in doc else doc
-                existing_documents.append({
-                    "filename": filename,
-                    "url": file_url,
-                    "exists": False,
-                    "error": "File không tồn tại trên server"
-                })
-        
-        return JSONResponse(
-            status_code=200,
-            content={
-                "success": True, 
-                "documents": existing_documents,
-                "total": len(existing_documents)
-            }
-        )
-        
-    except json.JSONDecodeError:
-        return JSONResponse(
-            status_code=200,
-            content={"success": True, "documents": [], "message": "Dữ liệu phù hiệu vận tải không hợp lệ"}
-        )
+    return attachment_list_response(db, "vehicle", vehicle.id, "phu_hieu", "Xe chưa upload phù hiệu vận tải")
 
 @app.delete("/vehicles/phu-hieu-documents/{vehicle_id}")
 async def delete_vehicle_phu_hieu_document(
     vehicle_id: int, 
-    filename: str,
+    filename: Optional[str] = None,
+    attachment_id: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    """API để xóa phù hiệu vận tải của xe"""
+    """API để xóa phù hiệu vận tải của xe (theo attachment_id, hoặc filename cho client cũ)"""
     vehicle = db.query(Vehicle).filter(Vehicle.id == vehicle_id, Vehicle.status == 1).first()
     if not vehicle:
         return JSONResponse(
@@ -2482,74 +3338,11 @@ async def delete_vehicle_phu_hieu_document(
             content={"success": False, "error": "Không tìm thấy xe"}
         )
     
-    if not vehicle.phu_hieu_files:
-        return JSONResponse(
-            status_code=400,
-            content={"success": False, "error": "Xe chưa có phù hiệu vận tải nào"}
-        )
-    
-    try:
-        import json
-        documents = json.loads(vehicle.phu_hieu_files)
-        
-        # Tìm file trong danh sách (có thể là filename hoặc full path)
-        file_to_remove = None
-        for doc in documents:
-            # So sánh với filename hoặc basename của path
-            doc_basename = os.path.basename(doc) if "/" in doc else doc
-            if doc == filename or doc_basename == filename:
-                file_to_remove = doc
-                break
-        
-        if not file_to_remove:
-            return JSONResponse(
-                status_code=400,
-                content={"success": False, "error": "File không tồn tại trong danh sách phù hiệu vận tải"}
-            )
-        
-        # Xóa file khỏi thư mục lưu trữ
-        # Hỗ trợ cả path cũ và mới
-        if file_to_remove.startswith("Picture/"):
-            file_path = file_to_remove
-        else:
-            file_path = f"static/uploads/{file_to_remove}"
-        
-        delete_file_if_exists(file_path)
-        
-        # Xóa file khỏi danh sách trong DB
-        documents.remove(file_to_remove)
-        
-        if documents:
-            # Còn phù hiệu vận tải khác, cập nhật danh sách
-            vehicle.phu_hieu_files = json.dumps(documents)
-        else:
-            # Không còn phù hiệu vận tải nào, set null
-            vehicle.phu_hieu_files = None
-        
-        db.commit()
-        
-        return JSONResponse(
-            status_code=200,
-            content={
-                "success": True, 
-                "message": "Xóa phù hiệu vận tải thành công",
-                "remaining_documents": len(documents) if documents else 0
-            }
-        )
-        
-    except json.JSONDecodeError:
-        return JSONResponse(
-            status_code=500,
-            content={"success": False, "error": "Lỗi định dạng dữ liệu phù hiệu vận tải"}
-        )
-    except Exception as e:
-        db.rollback()
-        return JSONResponse(
-            status_code=500,
-            content={"success": False, "error": f"Lỗi hệ thống: {str(e)}"}
-        )
-
-# ===== VEHICLE ASSIGNMENT ROUTES =====
+    return delete_attachment_response(
+        db, vehicle, "vehicle", "phu_hieu", filename, attachment_id,
+        not_found_error="File không tồn tại trong danh sách phù hiệu vận tải",
+        success_message="Xóa phù hiệu vận tải thành công",
+    )
 
 @app.post("/vehicles/assignments/add")
 async def add_vehicle_assignment(
@@ -2628,6 +3421,7 @@ async def add_vehicle_assignment(
 
 @app.get("/api/vehicles/assignments")
 async def get_vehicle_assignments(
+    request: Request,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
@@ -2638,6 +3432,10 @@ async def get_vehicle_assignments(
             "message": "Không có quyền truy cập"
         }, status_code=403)
     
+    etag = versioned_etag(request, db, "vehicle_assignments", "vehicles", "employees")
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    
     assignments = db.query(VehicleAssignment).order_by(
         VehicleAssignment.assignment_date.desc()
     ).all()
@@ -2656,10 +3454,10 @@ async def get_vehicle_assignments(
             "is_active": assignment.end_date is None
         })
     
-    return JSONResponse({
+    return with_etag(JSONResponse({
         "success": True,
         "data": result
-    })
+    }), etag)
 
 @app.get("/api/vehicles/available")
 async def get_available_vehicles(
@@ -3243,10 +4041,10 @@ async def routes_page(request: Request, db: Session = Depends(get_db), current_u
     # Sắp xếp routes: A-Z bình thường, nhưng "Tăng Cường" đẩy xuống cuối
     def sort_routes_with_tang_cuong_at_bottom(routes):
         # Lọc ra routes không phải "Tăng Cường"
-        normal_routes = [route for route in routes if route.route_code and route.route_code.strip() != "Tăng Cường"]
+        normal_routes = [route for route in routes if not route.is_tang_cuong]
         
         # Lọc ra routes "Tăng Cường"
-        tang_cuong_routes = [route for route in routes if route.route_code and route.route_code.strip() == "Tăng Cường"]
+        tang_cuong_routes = [route for route in routes if route.is_tang_cuong]
         
         # Sắp xếp routes bình thường theo A-Z
         normal_routes_sorted = sorted(normal_routes, key=lambda route: route.route_code.lower() if route.route_code else "")
@@ -3411,7 +4209,7 @@ async def update_route_price(
                 if not route:
                     continue
                 
-                if route.route_code and route.route_code.strip() == "Tăng Cường":
+                if route.is_tang_cuong:
                     continue
                 
                 # Tạo bản ghi giá tuyến mới
@@ -3545,39 +4343,25 @@ async def edit_price_update(
 
 # ===== REVENUE MANAGEMENT ROUTES =====
 
-@app.get("/revenue", response_class=HTMLResponse)
-async def revenue_page(request: Request, db: Session = Depends(get_db), selected_date: Optional[str] = None, deleted_all: Optional[str] = None, current_user = Depends(get_current_user)):
-    """Trang quản lý doanh thu - Tự động tính từ dữ liệu chấm công"""
-    # Nếu chưa đăng nhập, redirect về login
-    if current_user is None:
-        return RedirectResponse(url="/login", status_code=303)
-    
-    # Kiểm tra quyền truy cập (User hoặc Admin)
-    redirect_response = check_and_redirect_access(current_user["role"], "/revenue", current_user["id"], db)
-    if redirect_response:
-        return redirect_response
-    
-    today = date.today()
-    
-    # Xử lý ngày được chọn
-    if selected_date:
-        try:
-            filter_date = datetime.strptime(selected_date, "%Y-%m-%d").date()
-        except ValueError:
-            filter_date = today
-    else:
-        filter_date = today
+# Đơn giá mặc định cho tuyến Nội thành (doanh thu)
+NOI_THANH_UNIT_PRICE = 227273
+
+def plan_daily_revenue(db: Session, filter_date: date) -> Tuple[list, set]:
+    """
+    Tính toán (không ghi DB) các RevenueRecord cần tạo/cập nhật cho một ngày từ dữ liệu chấm công.
     
-    # Lấy dữ liệu chấm công (DailyRoute) cho ngày được chọn
-    daily_routes = db.query(DailyRoute).filter(DailyRoute.date == filter_date).all()
+    Returns:
+        Tuple (changes, routes_with_attendance):
+        - changes: list dict {"id": id RevenueRecord hiện có hoặc None, "values": {...}}
+        - routes_with_attendance: set route_id có chấm công trong ngày
+    """
+    # Lấy dữ liệu chấm công (DailyRoute) cho ngày được chọn, kèm Route trong cùng một query
+    daily_routes = db.query(DailyRoute).options(joinedload(DailyRoute.route)).filter(
+        DailyRoute.date == filter_date
+    ).order_by(DailyRoute.id).all()
     
-    # Tự động tính toán và tạo/cập nhật doanh thu từ dữ liệu chấm công
-    revenue_dict = {}
     routes_with_attendance = set()
     
-    # Đơn giá mặc định cho tuyến Nội thành
-    NOI_THANH_UNIT_PRICE = 227273
-    
     # Nhóm DailyRoute theo route_id để xử lý
     daily_routes_by_route = {}
     for daily_route in daily_routes:
@@ -3589,13 +4373,25 @@ async def revenue_page(request: Request, db: Session = Depends(get_db), selected
         routes_with_attendance.add(route_id)
         
         # Bỏ qua tuyến Tăng cường - sẽ xử lý riêng (nhập thủ công)
-        if route.route_code and route.route_code.strip() == "Tăng Cường":
+        if route.is_tang_cuong:
             continue
         
         if route_id not in daily_routes_by_route:
             daily_routes_by_route[route_id] = []
         daily_routes_by_route[route_id].append(daily_route)
     
+    # Lấy các RevenueRecord đã có trong ngày một lần (thay vì một query cho mỗi tuyến)
+    existing_by_route = {}
+    if daily_routes_by_route:
+        existing_records = db.query(RevenueRecord).filter(
+            RevenueRecord.date == filter_date,
+            RevenueRecord.route_id.in_(list(daily_routes_by_route.keys()))
+        ).order_by(RevenueRecord.id).all()
+        for record in existing_records:
+            existing_by_route.setdefault(record.route_id, record)
+    
+    changes = []
+    
     # Xử lý từng route
     for route_id, route_daily_routes in daily_routes_by_route.items():
         # Lấy thông tin route
@@ -3611,10 +4407,7 @@ async def revenue_page(request: Request, db: Session = Depends(get_db), selected
         ]
         
         # Kiểm tra xem đã có RevenueRecord chưa
-        existing_revenue = db.query(RevenueRecord).filter(
-            RevenueRecord.route_id == route_id,
-            RevenueRecord.date == filter_date
-        ).first()
+        existing_revenue = existing_by_route.get(route_id)
         
         # Xác định status: Nếu có ít nhất 1 chuyến ON thì status = "Online", ngược lại = "OFF"
         if online_daily_routes:
@@ -3688,54 +4481,109 @@ async def revenue_page(request: Request, db: Session = Depends(get_db), selected
                     # Chưa chỉnh sửa: cập nhật bằng số km mặc định
                     distance_km_to_use = distance_km
                 
-                existing_revenue.distance_km = distance_km_to_use
-                existing_revenue.unit_price = unit_price
-                existing_revenue.bridge_fee = bridge_fee
-                existing_revenue.loading_fee = loading_fee
-                existing_revenue.late_penalty = 0
-                
                 # Tính lại total_amount với số km thực tế (có thể là số km đã chỉnh sửa)
                 if route.route_type == "Nội thành":
                     # Nội thành: Đơn giá cố định
-                    existing_revenue.total_amount = NOI_THANH_UNIT_PRICE * len(online_daily_routes)
+                    new_total_amount = NOI_THANH_UNIT_PRICE * len(online_daily_routes)
                 else:
                     # Nội Tỉnh hoặc Liên Tỉnh: Đơn giá × Số km thực tế
                     base_revenue = distance_km_to_use * unit_price
-                    existing_revenue.total_amount = int(base_revenue + bridge_fee + loading_fee)
+                    new_total_amount = int(base_revenue + bridge_fee + loading_fee)
                 
-                existing_revenue.status = status
+                values = {
+                    "distance_km": distance_km_to_use,
+                    "unit_price": unit_price,
+                    "bridge_fee": bridge_fee,
+                    "loading_fee": loading_fee,
+                    "late_penalty": 0,
+                    "total_amount": new_total_amount,
+                    "status": status,
+                    "updated_at": datetime.utcnow()
+                }
                 # Cập nhật license_plate và driver_name nếu chưa có hoặc từ DailyRoute
                 if license_plate:
-                    existing_revenue.license_plate = license_plate
+                    values["license_plate"] = license_plate
                 if driver_name:
-                    existing_revenue.driver_name = driver_name
+                    values["driver_name"] = driver_name
                 if notes:
-                    existing_revenue.notes = notes
-                existing_revenue.updated_at = datetime.utcnow()
-                revenue_record = existing_revenue
+                    values["notes"] = notes
+                changes.append({"id": existing_revenue.id, "values": values})
         else:
             # Tạo mới
-            revenue_record = RevenueRecord(
-                date=filter_date,
-                route_id=route_id,
-                route_type=route.route_type or "Nội Tỉnh",  # Lấy từ route
-                distance_km=distance_km,
-                unit_price=unit_price,
-                bridge_fee=bridge_fee,
-                loading_fee=loading_fee,
-                late_penalty=0,
-                status=status,
-                total_amount=total_amount,
-                manual_total=0,
-                route_name="",
-                license_plate=license_plate,
-                driver_name=driver_name,
-                notes=notes
-            )
-            db.add(revenue_record)
+            changes.append({"id": None, "values": {
+                "date": filter_date,
+                "route_id": route_id,
+                "route_type": route.route_type or "Nội Tỉnh",  # Lấy từ route
+                "distance_km": distance_km,
+                "unit_price": unit_price,
+                "bridge_fee": bridge_fee,
+                "loading_fee": loading_fee,
+                "late_penalty": 0,
+                "status": status,
+                "total_amount": total_amount,
+                "manual_total": 0,
+                "route_name": "",
+                "license_plate": license_plate,
+                "driver_name": driver_name,
+                "notes": notes
+            }})
+    
+    return changes, routes_with_attendance
+
+def apply_daily_revenue_plan(db: Session, changes: list) -> Tuple[int, int]:
+    """
+    Ghi kết quả của plan_daily_revenue vào session (không commit).
+    Trả về (số bản ghi tạo mới, số bản ghi cập nhật).
+    """
+    now = datetime.utcnow()
+    inserts = []
+    updates = []
+    for change in changes:
+        if change["id"] is None:
+            values = dict(change["values"])
+            values.setdefault("created_at", now)
+            values.setdefault("updated_at", now)
+            inserts.append(with_normalized_keys(RevenueRecord, values))
+        else:
+            updates.append(with_normalized_keys(RevenueRecord, {"id": change["id"], **change["values"]}))
     
-    # Commit các thay đổi tự động
+    if inserts:
+        db.bulk_insert_mappings(RevenueRecord, inserts)
+    if updates:
+        db.bulk_update_mappings(RevenueRecord, updates)
+    return len(inserts), len(updates)
+
+
+@app.get("/revenue", response_class=HTMLResponse)
+async def revenue_page(request: Request, db: Session = Depends(get_db), selected_date: Optional[str] = None, deleted_all: Optional[str] = None, current_user = Depends(get_current_user)):
+    """Trang quản lý doanh thu - Tự động tính từ dữ liệu chấm công"""
+    # Nếu chưa đăng nhập, redirect về login
+    if current_user is None:
+        return RedirectResponse(url="/login", status_code=303)
+    
+    # Kiểm tra quyền truy cập (User hoặc Admin)
+    redirect_response = check_and_redirect_access(current_user["role"], "/revenue", current_user["id"], db)
+    if redirect_response:
+        return redirect_response
+    
+    today = date.today()
+    
+    # Xử lý ngày được chọn
+    if selected_date:
+        try:
+            filter_date = datetime.strptime(selected_date, "%Y-%m-%d").date()
+        except ValueError:
+            filter_date = today
+    else:
+        filter_date = today
+    
+    # Tự động tính toán và tạo/cập nhật doanh thu từ dữ liệu chấm công
+    revenue_dict = {}
+    changes, routes_with_attendance = plan_daily_revenue(db, filter_date)
+    
+    # Ghi và commit các thay đổi tự động
     try:
+        apply_daily_revenue_plan(db, changes)
         db.commit()
         # Tự động cập nhật bản ghi thu nhập trong finance-report sau khi tính doanh thu
         await create_daily_revenue_finance_record(filter_date, db)
@@ -3754,7 +4602,7 @@ async def revenue_page(request: Request, db: Session = Depends(get_db), selected
         
         route_id = record.route_id
         # Với "Tăng cường", lưu tất cả records (sẽ được xử lý riêng trong template)
-        if route.route_code and route.route_code.strip() == "Tăng Cường":
+        if route.is_tang_cuong:
             if route_id not in revenue_dict:
                 revenue_dict[route_id] = []
             revenue_dict[route_id].append(record)
@@ -3764,14 +4612,14 @@ async def revenue_page(request: Request, db: Session = Depends(get_db), selected
                 revenue_dict[route_id] = record
     
     # Lấy tất cả routes
-    all_routes = db.query(Route).filter(Route.is_active == 1, Route.status == 1).all()
+    all_routes = get_active_routes(db)
     
     # Lọc routes để hiển thị:
     # - Tuyến có chấm công: hiển thị doanh thu đã tự động tính
     # - Tuyến Tăng cường: LUÔN hiển thị trong all_routes (để form có thể lấy được)
     routes_for_display = []
     for route in all_routes:
-        if route.route_code and route.route_code.strip() == "Tăng Cường":
+        if route.is_tang_cuong:
             # Tăng cường: luôn hiển thị để nhập thủ công (ngay cả khi chưa có chấm công)
             routes_for_display.append(route)
         elif route.id in routes_with_attendance:
@@ -3780,8 +4628,8 @@ async def revenue_page(request: Request, db: Session = Depends(get_db), selected
     
     # Sắp xếp routes: A-Z bình thường, nhưng "Tăng Cường" đẩy xuống cuối
     def sort_routes_with_tang_cuong_at_bottom(routes):
-        normal_routes = [route for route in routes if route.route_code and route.route_code.strip() != "Tăng Cường"]
-        tang_cuong_routes = [route for route in routes if route.route_code and route.route_code.strip() == "Tăng Cường"]
+        normal_routes = [route for route in routes if not route.is_tang_cuong]
+        tang_cuong_routes = [route for route in routes if route.is_tang_cuong]
         normal_routes_sorted = sorted(normal_routes, key=lambda route: route.route_code.lower() if route.route_code else "")
         return normal_routes_sorted + tang_cuong_routes
     
@@ -3789,12 +4637,9 @@ async def revenue_page(request: Request, db: Session = Depends(get_db), selected
     all_routes = sort_routes_with_tang_cuong_at_bottom(all_routes)
     
     # Lấy danh sách xe và nhân viên
-    vehicles = db.query(Vehicle).filter(Vehicle.status == 1).order_by(Vehicle.license_plate).all()
+    vehicles = get_active_vehicles(db, order_by_plate=True)
     # Chỉ lấy nhân viên có trạng thái "Đang làm việc"
-    employees = db.query(Employee).filter(
-        Employee.status == 1,
-        Employee.employee_status == "Đang làm việc"
-    ).order_by(Employee.name).all()
+    employees = get_active_employees(db, working_only=True, order_by_name=True)
     
     # Chuyển đổi thành dictionaries để JavaScript có thể sử dụng
     vehicles_list = [{"license_plate": v.license_plate or ""} for v in vehicles]
@@ -4241,9 +5086,9 @@ async def daily_new_page(
     if redirect_response:
         return redirect_response
     
-    routes = db.query(Route).filter(Route.is_active == 1, Route.status == 1).all()
-    employees = db.query(Employee).filter(Employee.status == 1).all()
-    vehicles = db.query(Vehicle).filter(Vehicle.status == 1).all()
+    routes = get_active_routes(db)
+    employees = get_active_employees(db)
+    vehicles = get_active_vehicles(db)
     today = date.today()
     
     # Xử lý mode: by-date hoặc by-route
@@ -4277,8 +5122,20 @@ async def daily_new_page(
         # Lấy tất cả tuyến (không lọc)
         all_routes = sorted(routes, key=lambda r: r.route_code.lower() if r.route_code else "")
         
-        # Lấy tất cả chuyến trong tháng (lọc theo tuyến nếu có)
-        monthly_daily_routes_query = db.query(DailyRoute).filter(
+        # Lấy tất cả chuyến trong tháng (lọc theo tuyến nếu có): chỉ các cột cần hiển thị, join Route một lần
+        # và sắp xếp trong SQL: Mã tuyến A-Z rồi ngày, tuyến "Tăng Cường" luôn ở cuối (theo ngày)
+        is_tang_cuong_route = func.coalesce(Route.is_tang_cuong, 0)
+        monthly_daily_routes_query = db.query(
+            DailyRoute.id,
+            DailyRoute.route_id,
+            Route.route_code,
+            DailyRoute.date,
+            DailyRoute.distance_km,
+            DailyRoute.driver_name,
+            DailyRoute.license_plate,
+            DailyRoute.status,
+            DailyRoute.notes
+        ).outerjoin(Route, DailyRoute.route_id == Route.id).filter(
             DailyRoute.date >= filter_month_start,
             DailyRoute.date <= filter_month_end
         )
@@ -4286,40 +5143,27 @@ async def daily_new_page(
         if selected_route_id:
             monthly_daily_routes_query = monthly_daily_routes_query.filter(DailyRoute.route_id == selected_route_id)
         
-        monthly_daily_routes = monthly_daily_routes_query.all()
-        
-        # Sắp xếp monthly_daily_routes: Mã tuyến A-Z, tuyến "Tăng Cường" luôn ở cuối
-        def sort_monthly_daily_routes_by_route_code(monthly_daily_routes):
-            # Tách ra các chuyến không phải "Tăng Cường" và các chuyến "Tăng Cường"
-            normal_daily_routes = []
-            tang_cuong_daily_routes = []
-            
-            for dr in monthly_daily_routes:
-                if dr.route and dr.route.route_code and dr.route.route_code.strip() == "Tăng Cường":
-                    tang_cuong_daily_routes.append(dr)
-                else:
-                    normal_daily_routes.append(dr)
-            
-            # Sắp xếp các chuyến bình thường: theo mã tuyến A-Z, sau đó theo ngày
-            normal_daily_routes_sorted = sorted(
-                normal_daily_routes, 
-                key=lambda dr: (
-                    dr.route.route_code.lower() if dr.route and dr.route.route_code else "",
-                    dr.date,
-                    dr.created_at
-                )
-            )
-            
-            # Sắp xếp các chuyến "Tăng Cường": theo ngày
-            tang_cuong_daily_routes_sorted = sorted(
-                tang_cuong_daily_routes,
-                key=lambda dr: (dr.date, dr.created_at)
-            )
-            
-            # Ghép lại: chuyến bình thường (A-Z) + chuyến "Tăng Cường"
-            return normal_daily_routes_sorted + tang_cuong_daily_routes_sorted
+        monthly_daily_routes_query = monthly_daily_routes_query.order_by(
+            is_tang_cuong_route,
+            case((is_tang_cuong_route == 1, ""), else_=func.lower(func.coalesce(Route.route_code, ""))),
+            DailyRoute.date,
+            DailyRoute.created_at
+        )
         
-        monthly_daily_routes = sort_monthly_daily_routes_by_route_code(monthly_daily_routes)
+        # Một payload duy nhất cho cả bảng HTML lẫn JavaScript
+        monthly_daily_routes = [
+            {
+                "id": row.id,
+                "route_id": row.route_id,
+                "route_code": row.route_code or "",
+                "date": row.date.strftime("%Y-%m-%d"),
+                "distance_km": row.distance_km or 0,
+                "driver_name": row.driver_name or "",
+                "license_plate": row.license_plate or "",
+                "status": row.status or "Online",
+                "notes": row.notes or ""
+            } for row in monthly_daily_routes_query
+        ]
         
         # Format tháng để hiển thị
         selected_month_display = datetime.strptime(selected_month, "%Y-%m").strftime("%m/%Y")
@@ -4338,18 +5182,6 @@ async def daily_new_page(
         routes_json = json.dumps([{"id": r.id, "route_code": r.route_code or "", "route_name": r.route_name or ""} for r in all_routes])
         employees_json = json.dumps([{"name": e.name or ""} for e in sorted(employees, key=lambda emp: emp.name.lower() if emp.name else "")])
         vehicles_json = json.dumps([{"license_plate": v.license_plate or ""} for v in vehicles])
-        monthly_daily_routes_json = json.dumps([
-            {
-                "id": dr.id,
-                "route_id": dr.route_id,
-                "date": dr.date.strftime("%Y-%m-%d"),
-                "distance_km": dr.distance_km or 0,
-                "driver_name": dr.driver_name or "",
-                "license_plate": dr.license_plate or "",
-                "status": dr.status or "Online",
-                "notes": dr.notes or ""
-            } for dr in monthly_daily_routes
-        ])
         
         return templates.TemplateResponse("daily_new.html", {
             "request": request,
@@ -4359,7 +5191,7 @@ async def daily_new_page(
             "employees": employees,
             "vehicles": vehicles,
             "daily_routes": [],  # Không dùng cho mode by-route
-            "monthly_daily_routes": monthly_daily_routes,  # Chuyến trong tháng
+            "monthly_daily_routes": monthly_daily_routes,  # Chuyến trong tháng (list dict, dùng chung cho bảng và JS)
             "selected_date": today.strftime('%Y-%m-%d'),
             "selected_date_display": today.strftime('%d/%m/%Y'),
             "selected_month": selected_month,
@@ -4372,8 +5204,7 @@ async def daily_new_page(
             "previous_assignments": {},
             "routes_json": routes_json,
             "employees_json": employees_json,
-            "vehicles_json": vehicles_json,
-            "monthly_daily_routes_json": monthly_daily_routes_json
+            "vehicles_json": vehicles_json
         })
     else:
         # Chế độ chấm công theo ngày (mặc định)
@@ -4389,10 +5220,10 @@ async def daily_new_page(
         # Sắp xếp routes: A-Z bình thường, nhưng "Tăng Cường" đẩy xuống cuối
         def sort_routes_with_tang_cuong_at_bottom(routes):
             # Lọc ra routes không phải "Tăng Cường"
-            normal_routes = [route for route in routes if route.route_code and route.route_code.strip() != "Tăng Cường"]
+            normal_routes = [route for route in routes if not route.is_tang_cuong]
             
             # Lọc ra routes "Tăng Cường"
-            tang_cuong_routes = [route for route in routes if route.route_code and route.route_code.strip() == "Tăng Cường"]
+            tang_cuong_routes = [route for route in routes if route.is_tang_cuong]
             
             # Sắp xếp routes bình thường theo A-Z
             normal_routes_sorted = sorted(normal_routes, key=lambda route: route.route_code.lower())
@@ -4415,7 +5246,7 @@ async def daily_new_page(
             tang_cuong_daily_routes = []
             
             for dr in daily_routes:
-                if dr.route and dr.route.route_code and dr.route.route_code.strip() == "Tăng Cường":
+                if dr.route and dr.route.is_tang_cuong:
                     tang_cuong_daily_routes.append(dr)
                 else:
                     normal_daily_routes.append(dr)
@@ -4445,7 +5276,7 @@ async def daily_new_page(
         available_routes = []
         for route in routes:
             # Tuyến "Tăng Cường" luôn hiển thị
-            if route.route_code and route.route_code.strip() == "Tăng Cường":
+            if route.is_tang_cuong:
                 available_routes.append(route)
             # Các tuyến khác chỉ hiển thị nếu chưa được chấm công
             elif route.id not in completed_route_ids:
@@ -4489,8 +5320,7 @@ async def daily_new_page(
             "previous_assignments": previous_assignments,  # Dữ liệu để tự động điền
             "routes_json": "[]",
             "employees_json": "[]",
-            "vehicles_json": "[]",
-            "monthly_daily_routes_json": "[]"
+            "vehicles_json": "[]"
         })
 
 @app.post("/daily-new/add")
@@ -4513,10 +5343,10 @@ async def add_daily_new_route(request: Request, db: Session = Depends(get_db)):
     # Sắp xếp routes: A-Z bình thường, nhưng "Tăng Cường" đẩy xuống cuối
     def sort_routes_with_tang_cuong_at_bottom(routes):
         # Lọc ra routes không phải "Tăng Cường"
-        normal_routes = [route for route in routes if route.route_code and route.route_code.strip() != "Tăng Cường"]
+        normal_routes = [route for route in routes if not route.is_tang_cuong]
         
         # Lọc ra routes "Tăng Cường"
-        tang_cuong_routes = [route for route in routes if route.route_code and route.route_code.strip() == "Tăng Cường"]
+        tang_cuong_routes = [route for route in routes if route.is_tang_cuong]
         
         # Sắp xếp routes bình thường theo A-Z
         normal_routes_sorted = sorted(normal_routes, key=lambda route: route.route_code.lower())
@@ -4718,13 +5548,321 @@ async def add_daily_new_route_by_route(request: Request, db: Session = Depends(g
             # Nếu không có dữ liệu nào được điền và có record cũ, xóa record
             db.delete(existing_record)
     
-    db.commit()
+    db.commit()
+    
+    # Redirect về trang daily-new với mode by-route, tháng và tuyến đã chọn
+    redirect_url = f"/daily-new?mode=by-route&selected_month={selected_month_str}"
+    if selected_route_id_str:
+        redirect_url += f"&selected_route_id={selected_route_id_str}"
+    return RedirectResponse(url=redirect_url, status_code=303)
+
+def recompute_revenue_for_dates(db: Session, dates):
+    """Tính lại doanh thu + bản ghi thu nhập finance cho các ngày (trong transaction hiện tại, chưa commit)"""
+    for day in sorted(set(dates)):
+        changes, _ = plan_daily_revenue(db, day)
+        apply_daily_revenue_plan(db, changes)
+        db.flush()
+        sync_daily_revenue_finance_record(day, db, commit=False)
+        db.flush()
+
+def copy_daily_routes(
+    db: Session,
+    source_from: date,
+    source_to: date,
+    target_from: date,
+    target_to: date,
+    reset_status: bool = False,
+    include_tang_cuong: bool = False,
+    route_id: Optional[int] = None
+) -> int:
+    """
+    Sao chép chấm công của khoảng ngày nguồn sang khoảng ngày đích bằng một câu INSERT ... SELECT (chưa commit).
+    
+    Khoảng đích dài hơn thì lặp lại mẫu nguồn (VD: một tuần -> cả tháng). Bỏ qua tuyến đã có chuyến trong
+    ngày đích và tuyến đã ngừng hoạt động; tuyến "Tăng Cường" chỉ được chép khi include_tang_cuong.
+    Ghi chú không được chép (thường gắn với ngày cụ thể); reset_status đặt lại trạng thái Online.
+    Trả về số chuyến đã tạo. Dùng hàm date() của SQLite.
+    """
+    if source_from > source_to or target_from > target_to:
+        raise ValueError("Ngày bắt đầu phải nhỏ hơn hoặc bằng ngày kết thúc")
+    period = (source_to - source_from).days + 1
+    base_offset = (target_from - source_from).days
+    cycles = ((target_to - target_from).days // period) + 1
+    offsets = [base_offset + cycle * period for cycle in range(cycles)]
+    if any(-period < offset < period for offset in offsets):
+        raise ValueError("Khoảng ngày nguồn và đích không được chồng lên nhau")
+    
+    params = {f"offset_{i}": f"{offset:+d} days" for i, offset in enumerate(offsets)}
+    params.update({
+        "source_from": source_from, "source_to": source_to,
+        "target_from": target_from, "target_to": target_to,
+        "created_at": datetime.utcnow()
+    })
+    conditions = ["s.date BETWEEN :source_from AND :source_to"]
+    if not include_tang_cuong:
+        conditions.append("coalesce(r.is_tang_cuong, 0) = 0")
+    if route_id is not None:
+        conditions.append("s.route_id = :route_id")
+        params["route_id"] = route_id
+    
+    # CTE đặt sau INSERT INTO để sqlite3 vẫn trả rowcount
+    result = db.execute(text(f"""
+        INSERT INTO daily_routes (
+            route_id, date, distance_km, cargo_weight, driver_name, license_plate,
+            driver_name_key, license_plate_key, employee_name, status, notes, created_at
+        )
+        WITH offsets(shift) AS (VALUES {", ".join(f"(:offset_{i})" for i in range(len(offsets)))}),
+        copies AS (
+            SELECT s.*, date(s.date, o.shift) AS target_date
+            FROM daily_routes s
+            CROSS JOIN offsets o
+            JOIN routes r ON r.id = s.route_id AND r.is_active = 1 AND r.status = 1
+            WHERE {" AND ".join(conditions)}
+        )
+        SELECT c.route_id, c.target_date, c.distance_km, c.cargo_weight, c.driver_name, c.license_plate,
+               c.driver_name_key, c.license_plate_key, c.employee_name,
+               {"'Online'" if reset_status else "coalesce(c.status, 'Online')"}, '', :created_at
+        FROM copies c
+        WHERE c.target_date BETWEEN :target_from AND :target_to
+          AND NOT EXISTS (
+              SELECT 1 FROM daily_routes t WHERE t.route_id = c.route_id AND t.date = c.target_date
+          )
+        ORDER BY c.target_date, c.id
+    """), params)
+    return result.rowcount
+
+@app.post("/api/daily-new/copy-forward", response_class=JSONResponse)
+async def copy_forward_daily_routes_api(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    API: Sao chép chấm công một ngày/tuần sang ngày/khoảng ngày khác.
+    
+    Body: {"source_from", "source_to", "target_from", "target_to" (mặc định cùng độ dài nguồn),
+           "reset_status": false, "include_tang_cuong": false, "route_id": null, "recompute_revenue": true}
+    """
+    if current_user is None:
+        return JSONResponse({"success": False, "message": "Bạn cần đăng nhập"}, status_code=401)
+    if not check_page_access(current_user["role"], "/daily-new", current_user["id"], db):
+        return JSONResponse({"success": False, "message": "Không có quyền truy cập"}, status_code=403)
+    
+    try:
+        payload = await request.json()
+        source_from = datetime.strptime(payload.get("source_from") or "", "%Y-%m-%d").date()
+        source_to = datetime.strptime(payload.get("source_to") or payload.get("source_from"), "%Y-%m-%d").date()
+        target_from = datetime.strptime(payload.get("target_from") or "", "%Y-%m-%d").date()
+        target_to = (
+            datetime.strptime(payload["target_to"], "%Y-%m-%d").date() if payload.get("target_to")
+            else target_from + (source_to - source_from)
+        )
+        route_id = int(payload["route_id"]) if payload.get("route_id") else None
+    except Exception:
+        return JSONResponse({"success": False, "message": "Payload không hợp lệ (ngày dạng YYYY-MM-DD)"}, status_code=400)
+    if (target_to - target_from).days > 366:
+        return JSONResponse({"success": False, "message": "Khoảng ngày đích tối đa 1 năm"}, status_code=400)
+    
+    try:
+        created = copy_daily_routes(
+            db, source_from, source_to, target_from, target_to,
+            reset_status=bool(payload.get("reset_status")),
+            include_tang_cuong=bool(payload.get("include_tang_cuong")),
+            route_id=route_id
+        )
+        revenue_dates = []
+        if created and payload.get("recompute_revenue", True) is not False:
+            revenue_dates = [
+                day for (day,) in db.query(DailyRoute.date).filter(
+                    DailyRoute.date >= target_from, DailyRoute.date <= target_to
+                ).distinct()
+            ]
+            recompute_revenue_for_dates(db, revenue_dates)
+        db.commit()
+    except ValueError as e:
+        db.rollback()
+        return JSONResponse({"success": False, "message": str(e)}, status_code=400)
+    except Exception as e:
+        db.rollback()
+        return JSONResponse({"success": False, "message": f"Lỗi khi sao chép chấm công: {e}"}, status_code=500)
+    
+    return JSONResponse({
+        "success": True,
+        "created": created,
+        "target_from": target_from.isoformat(),
+        "target_to": target_to.isoformat(),
+        "revenue_dates": [day.isoformat() for day in sorted(revenue_dates)]
+    })
+
+DAILY_ROUTE_BULK_MAX_ENTRIES = 2000
+DAILY_ROUTE_STATUSES = ("Online", "OFF")
+
+def validate_daily_route_bulk_entries(db: Session, entries: list) -> Tuple[list, list]:
+    """
+    Kiểm tra các ô chấm công của API bulk với dữ liệu tham chiếu (cache tuyến/nhân viên/xe).
+    Trả về (rows hợp lệ đã chuẩn hóa, errors [{"index", "message"}]); ô không có dữ liệu bị bỏ qua.
+    """
+    import math
+    routes = {route.id: route for route in get_active_routes(db)}
+    drivers = {normalize_key(employee.name): employee.name for employee in get_active_employees(db) if employee.name}
+    plates = {normalize_key(vehicle.license_plate): vehicle.license_plate for vehicle in get_active_vehicles(db) if vehicle.license_plate}
+    
+    rows, errors = [], []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            errors.append({"index": index, "message": "Dữ liệu không hợp lệ"})
+            continue
+        driver_name = str(entry.get("driver_name") or "").strip()
+        license_plate = str(entry.get("license_plate") or "").strip()
+        notes = str(entry.get("notes") or "").strip()
+        status = str(entry.get("status") or "").strip()
+        distance_km = entry.get("distance_km")
+        if not (distance_km or driver_name or license_plate or notes or status):
+            continue
+        
+        try:
+            route_id = int(entry.get("route_id"))
+            entry_date = datetime.strptime(str(entry.get("date")), "%Y-%m-%d").date()
+        except (TypeError, ValueError):
+            errors.append({"index": index, "message": "Thiếu hoặc sai route_id/date (YYYY-MM-DD)"})
+            continue
+        route = routes.get(route_id)
+        if route is None:
+            errors.append({"index": index, "message": f"Tuyến {route_id} không tồn tại hoặc đã ngừng hoạt động"})
+            continue
+        try:
+            distance_km = float(distance_km) if distance_km not in (None, "") else 0
+        except (TypeError, ValueError):
+            distance_km = -1
+        # request.json() chấp nhận NaN/Infinity: không được ghi vào daily_routes
+        if not math.isfinite(distance_km) or distance_km < 0:
+            errors.append({"index": index, "message": "Số km không hợp lệ"})
+            continue
+        status = status or "Online"
+        if status not in DAILY_ROUTE_STATUSES:
+            errors.append({"index": index, "message": f"Trạng thái phải là {' hoặc '.join(DAILY_ROUTE_STATUSES)}"})
+            continue
+        if driver_name:
+            if normalize_key(driver_name) not in drivers:
+                errors.append({"index": index, "message": f"Lái xe '{driver_name}' không có trong danh sách nhân viên"})
+                continue
+            driver_name = drivers[normalize_key(driver_name)]
+        if license_plate:
+            if normalize_key(license_plate) not in plates:
+                errors.append({"index": index, "message": f"Biển số '{license_plate}' không có trong danh sách xe"})
+                continue
+            license_plate = plates[normalize_key(license_plate)]
+        
+        rows.append({
+            "index": index,
+            "is_tang_cuong": bool(route.is_tang_cuong),
+            "values": {
+                "route_id": route_id,
+                "date": entry_date,
+                "distance_km": distance_km,
+                "cargo_weight": 0,
+                "driver_name": driver_name,
+                "license_plate": license_plate,
+                "employee_name": "",
+                "status": status,
+                "notes": notes
+            }
+        })
+    return rows, errors
+
+@app.post("/api/daily-new/bulk", response_class=JSONResponse)
+async def add_daily_new_routes_bulk(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    API: Ghi chấm công nhiều tuyến × nhiều ngày trong một request.
+    
+    Body: {"entries": [{"route_id", "date", "distance_km", "driver_name", "license_plate", "status", "notes"}, ...],
+           "on_duplicate": "error" | "update" | "skip", "recompute_revenue": true}
+    Tuyến đã có chuyến trong ngày là trùng (trừ tuyến "Tăng Cường" được nhiều chuyến/ngày).
+    Ghi toàn bộ trong một transaction rồi tính lại doanh thu một lần cho các ngày bị ảnh hưởng.
+    """
+    if current_user is None:
+        return JSONResponse({"success": False, "message": "Bạn cần đăng nhập"}, status_code=401)
+    if not check_page_access(current_user["role"], "/daily-new", current_user["id"], db):
+        return JSONResponse({"success": False, "message": "Không có quyền truy cập"}, status_code=403)
     
-    # Redirect về trang daily-new với mode by-route, tháng và tuyến đã chọn
-    redirect_url = f"/daily-new?mode=by-route&selected_month={selected_month_str}"
-    if selected_route_id_str:
-        redirect_url += f"&selected_route_id={selected_route_id_str}"
-    return RedirectResponse(url=redirect_url, status_code=303)
+    try:
+        payload = await request.json()
+        entries = payload.get("entries")
+        on_duplicate = payload.get("on_duplicate") or "error"
+        recompute_revenue = payload.get("recompute_revenue", True) is not False
+    except Exception:
+        return JSONResponse({"success": False, "message": "Payload JSON không hợp lệ"}, status_code=400)
+    if not isinstance(entries, list) or not entries:
+        return JSONResponse({"success": False, "message": "entries phải là danh sách không rỗng"}, status_code=400)
+    if len(entries) > DAILY_ROUTE_BULK_MAX_ENTRIES:
+        return JSONResponse({"success": False, "message": f"Tối đa {DAILY_ROUTE_BULK_MAX_ENTRIES} ô mỗi request"}, status_code=400)
+    if on_duplicate not in ("error", "update", "skip"):
+        return JSONResponse({"success": False, "message": "on_duplicate phải là error, update hoặc skip"}, status_code=400)
+    
+    rows, errors = validate_daily_route_bulk_entries(db, entries)
+    
+    # Trùng lặp: trong payload và với dữ liệu đã có (một query cho toàn bộ cặp tuyến/ngày)
+    seen = {}
+    for row in rows:
+        key = (row["values"]["route_id"], row["values"]["date"])
+        if not row["is_tang_cuong"] and key in seen:
+            errors.append({"index": row["index"], "message": f"Trùng tuyến/ngày với ô {seen[key]}"})
+        seen.setdefault(key, row["index"])
+    if errors:
+        return JSONResponse({"success": False, "message": "Dữ liệu không hợp lệ", "errors": sorted(errors, key=lambda e: e["index"])}, status_code=400)
+    
+    pairs = list({(row["values"]["route_id"], row["values"]["date"]) for row in rows if not row["is_tang_cuong"]})
+    existing = {}
+    if pairs:
+        existing = {
+            (route_id, day): daily_route_id
+            for daily_route_id, route_id, day in db.query(DailyRoute.id, DailyRoute.route_id, DailyRoute.date).filter(
+                tuple_(DailyRoute.route_id, DailyRoute.date).in_(pairs)
+            ).order_by(DailyRoute.id.desc())
+        }
+    
+    inserts, updates, duplicates = [], [], []
+    for row in rows:
+        values = row["values"]
+        existing_id = None if row["is_tang_cuong"] else existing.get((values["route_id"], values["date"]))
+        if existing_id is None:
+            inserts.append(with_normalized_keys(DailyRoute, dict(values)))
+        else:
+            duplicates.append({"index": row["index"], "route_id": values["route_id"], "date": values["date"].isoformat(), "id": existing_id})
+            if on_duplicate == "update":
+                update_values = {key: values[key] for key in ("distance_km", "driver_name", "license_plate", "status", "notes")}
+                updates.append(with_normalized_keys(DailyRoute, {"id": existing_id, **update_values}))
+    if duplicates and on_duplicate == "error":
+        return JSONResponse({
+            "success": False,
+            "message": f"{len(duplicates)} ô đã có chuyến (gửi on_duplicate=update để ghi đè hoặc skip để bỏ qua)",
+            "duplicates": duplicates
+        }, status_code=409)
+    
+    affected_dates = sorted({row["values"]["date"] for row in rows})
+    try:
+        if inserts:
+            db.bulk_insert_mappings(DailyRoute, inserts)
+        if updates:
+            db.bulk_update_mappings(DailyRoute, updates)
+        if recompute_revenue and (inserts or updates):
+            recompute_revenue_for_dates(db, affected_dates)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        return JSONResponse({"success": False, "message": f"Lỗi khi lưu chấm công: {e}"}, status_code=500)
+    
+    return JSONResponse({
+        "success": True,
+        "created": len(inserts),
+        "updated": len(updates),
+        "skipped": len(duplicates) - len(updates),
+        "revenue_dates": [day.isoformat() for day in affected_dates] if recompute_revenue and (inserts or updates) else []
+    })
 
 @app.get("/salary/driver-details/{driver_name}")
 async def get_driver_details(
@@ -4840,6 +5978,59 @@ async def salary_simple_page(request: Request):
     from fastapi.responses import RedirectResponse
     return RedirectResponse(url="/report", status_code=302)
 
+# ==================== GENERAL REPORT ====================
+GENERAL_REPORT_MAX_DAYS = 366
+GENERAL_REPORT_PAGE_SIZE = 100
+
+def general_report_date_range(from_date: Optional[str], to_date: Optional[str]) -> Tuple[date, date]:
+    """Khoảng ngày của báo cáo: mặc định tháng hiện tại, tối đa GENERAL_REPORT_MAX_DAYS ngày tính ngược từ to_date"""
+    today = date.today()
+    try:
+        from_date_obj = datetime.strptime(from_date, "%Y-%m-%d").date() if from_date else None
+        to_date_obj = datetime.strptime(to_date, "%Y-%m-%d").date() if to_date else None
+    except ValueError:
+        from_date_obj = to_date_obj = None
+    if not from_date_obj or not to_date_obj or from_date_obj > to_date_obj:
+        month_start = date(today.year, today.month, 1)
+        next_month = date(today.year + 1, 1, 1) if today.month == 12 else date(today.year, today.month + 1, 1)
+        return month_start, next_month - timedelta(days=1)
+    return max(from_date_obj, to_date_obj - timedelta(days=GENERAL_REPORT_MAX_DAYS - 1)), to_date_obj
+
+def general_report_conditions(
+    from_date: date,
+    to_date: date,
+    driver_name: Optional[str] = None,
+    license_plate: Optional[str] = None,
+    route_code: Optional[str] = None
+) -> list:
+    """Điều kiện WHERE dùng chung cho trang general-report và xuất Excel (query phải outer join Route)"""
+    conditions = [DailyRoute.date >= from_date, DailyRoute.date <= to_date]
+    # So khớp trên cột *_key: không phân biệt dấu, hoa thường
+    if driver_name:
+        conditions.append(DailyRoute.driver_name_key.contains(normalize_key(driver_name), autoescape=True))
+    if license_plate:
+        conditions.append(DailyRoute.license_plate_key.contains(normalize_key(license_plate), autoescape=True))
+    if route_code:
+        conditions.append(Route.route_code_key.contains(normalize_key(route_code), autoescape=True))
+    return conditions
+
+def general_report_trip_query(db: Session, conditions: list):
+    """Chi tiết từng chuyến có lái xe (projection, join Route một lần), sắp xếp theo lái xe rồi ngày"""
+    return db.query(
+        DailyRoute.driver_name,
+        DailyRoute.license_plate,
+        DailyRoute.date,
+        Route.route_code,
+        Route.route_name,
+        DailyRoute.distance_km,
+        DailyRoute.cargo_weight,
+        DailyRoute.notes
+    ).outerjoin(Route, DailyRoute.route_id == Route.id).filter(
+        *conditions,
+        DailyRoute.driver_name.isnot(None),
+        DailyRoute.driver_name != ""
+    ).order_by(DailyRoute.driver_name, DailyRoute.date, DailyRoute.id)
+
 @app.get("/general-report", response_class=HTMLResponse)
 async def general_report_page(
     request: Request, 
@@ -4849,96 +6040,72 @@ async def general_report_page(
     to_date: Optional[str] = None,
     driver_name: Optional[str] = None,
     license_plate: Optional[str] = None,
-    route_code: Optional[str] = None
+    route_code: Optional[str] = None,
+    page: int = 1
 ):
     """Trang thống kê tổng hợp - báo cáo chi tiết hoạt động vận chuyển"""
     # Nếu chưa đăng nhập, redirect về trang login
     if current_user is None:
         return RedirectResponse(url="/login", status_code=303)
     
-    # Khởi tạo query cơ bản
-    daily_routes_query = db.query(DailyRoute)
-    
-    # Áp dụng bộ lọc thời gian
-    if from_date and to_date:
-        try:
-            from_date_obj = datetime.strptime(from_date, "%Y-%m-%d").date()
-            to_date_obj = datetime.strptime(to_date, "%Y-%m-%d").date()
-            daily_routes_query = daily_routes_query.filter(
-                DailyRoute.date >= from_date_obj,
-                DailyRoute.date <= to_date_obj
-            )
-        except ValueError:
-            pass
-    
-    # Áp dụng các bộ lọc khác
-    if driver_name:
-        daily_routes_query = daily_routes_query.filter(DailyRoute.driver_name.ilike(f"%{driver_name}%"))
-    if license_plate:
-        daily_routes_query = daily_routes_query.filter(DailyRoute.license_plate.ilike(f"%{license_plate}%"))
-    if route_code:
-        daily_routes_query = daily_routes_query.join(Route).filter(Route.route_code.ilike(f"%{route_code}%"))
-    
-    daily_routes = daily_routes_query.all()
-    
-    # Tính thống kê theo lái xe
-    driver_stats = {}
-    for daily_route in daily_routes:
-        driver_name_key = daily_route.driver_name
-        license_plate_key = daily_route.license_plate
-        if driver_name_key and driver_name_key not in driver_stats:
-            driver_stats[driver_name_key] = {
-                'driver_name': driver_name_key,
-                'license_plate': license_plate_key or 'N/A',
-                'trip_count': 0,
-                'total_distance': 0,
-                'total_cargo': 0,
-                'routes': set()
-            }
-        
-        if driver_name_key:
-            driver_stats[driver_name_key]['trip_count'] += 1
-            driver_stats[driver_name_key]['total_distance'] += daily_route.distance_km
-            driver_stats[driver_name_key]['total_cargo'] += daily_route.cargo_weight
-            driver_stats[driver_name_key]['routes'].add(daily_route.route.route_code)
-            if license_plate_key:
-                driver_stats[driver_name_key]['license_plate'] = license_plate_key
-    
-    # Convert to list
-    salary_data = []
-    for driver_name_key, stats in driver_stats.items():
-        salary_data.append({
-            'driver_name': driver_name_key,
-            'license_plate': stats['license_plate'],
-            'trip_count': stats['trip_count'],
-            'total_distance': stats['total_distance'],
-            'total_cargo': stats['total_cargo'],
-            'routes': list(stats['routes'])
-        })
-    
-    salary_data.sort(key=lambda x: x['trip_count'], reverse=True)
+    from_date_obj, to_date_obj = general_report_date_range(from_date, to_date)
+    conditions = general_report_conditions(from_date_obj, to_date_obj, driver_name, license_plate, route_code)
+    
+    # Tổng toàn bộ chuyến (kể cả chuyến chưa có lái xe)
+    total_routes, total_distance, total_cargo = db.query(
+        func.count(DailyRoute.id),
+        func.coalesce(func.sum(DailyRoute.distance_km), 0),
+        func.coalesce(func.sum(DailyRoute.cargo_weight), 0)
+    ).outerjoin(Route, DailyRoute.route_id == Route.id).filter(*conditions).one()
+    
+    # Thống kê theo lái xe: GROUP BY trong SQL
+    driver_rows = db.query(
+        DailyRoute.driver_name,
+        func.max(DailyRoute.license_plate),
+        func.count(DailyRoute.id),
+        func.coalesce(func.sum(DailyRoute.distance_km), 0),
+        func.coalesce(func.sum(DailyRoute.cargo_weight), 0),
+        func.group_concat(Route.route_code.distinct())
+    ).outerjoin(Route, DailyRoute.route_id == Route.id).filter(
+        *conditions,
+        DailyRoute.driver_name.isnot(None),
+        DailyRoute.driver_name != ""
+    ).group_by(DailyRoute.driver_name).order_by(func.count(DailyRoute.id).desc(), DailyRoute.driver_name).all()
     
-    # Tạo dữ liệu chi tiết từng chuyến
-    trip_details = []
-    for daily_route in daily_routes:
-        if daily_route.driver_name:
-            trip_details.append({
-                'driver_name': daily_route.driver_name,
-                'license_plate': daily_route.license_plate or 'N/A',
-                'date': daily_route.date,
-                'route_code': daily_route.route.route_code,
-                'route_name': daily_route.route.route_name,
-                'distance_km': daily_route.distance_km,
-                'cargo_weight': daily_route.cargo_weight,
-                'notes': daily_route.notes or ''
-            })
+    salary_data = [
+        {
+            'driver_name': name,
+            'license_plate': plate or 'N/A',
+            'trip_count': trip_count,
+            'total_distance': distance,
+            'total_cargo': cargo,
+            'routes': route_codes.split(",") if route_codes else []
+        }
+        for name, plate, trip_count, distance, cargo, route_codes in driver_rows
+    ]
     
-    trip_details.sort(key=lambda x: (x['driver_name'], x['date']))
+    # Chi tiết từng chuyến: phân trang
+    trip_total = sum(row['trip_count'] for row in salary_data)
+    trip_pages = max(1, (trip_total + GENERAL_REPORT_PAGE_SIZE - 1) // GENERAL_REPORT_PAGE_SIZE)
+    page = min(max(page, 1), trip_pages)
+    trip_details = [
+        {
+            'driver_name': row.driver_name,
+            'license_plate': row.license_plate or 'N/A',
+            'date': row.date,
+            'route_code': row.route_code,
+            'route_name': row.route_name,
+            'distance_km': row.distance_km,
+            'cargo_weight': row.cargo_weight,
+            'notes': row.notes or ''
+        }
+        for row in general_report_trip_query(db, conditions).offset((page - 1) * GENERAL_REPORT_PAGE_SIZE).limit(GENERAL_REPORT_PAGE_SIZE)
+    ]
     
-    # Lấy danh sách cho dropdown
-    routes = db.query(Route).all()
-    employees = db.query(Employee).all()
-    vehicles = db.query(Vehicle).all()
+    # Lấy danh sách cho dropdown (cache dữ liệu tham chiếu)
+    routes = list(get_reference_records(db, "routes"))
+    employees = list(get_reference_records(db, "employees"))
+    vehicles = list(get_reference_records(db, "vehicles"))
     
     # Template data - CHỈ TRUYỀN KHI CÓ GIÁ TRỊ
     template_data = {
@@ -4946,19 +6113,21 @@ async def general_report_page(
         "current_user": current_user,
         "salary_data": salary_data,
         "trip_details": trip_details,
+        "trip_total": trip_total,
+        "page": page,
+        "total_pages": trip_pages,
         "employees": employees,
         "vehicles": vehicles,
         "routes": routes,
-        "total_routes": len(daily_routes),
-        "total_distance": sum(dr.distance_km for dr in daily_routes),
-        "total_cargo": sum(dr.cargo_weight for dr in daily_routes)
+        "total_routes": total_routes,
+        "total_distance": total_distance,
+        "total_cargo": total_cargo,
+        # Khoảng ngày thực tế đã áp dụng (mặc định tháng hiện tại)
+        "from_date": from_date_obj.strftime("%Y-%m-%d"),
+        "to_date": to_date_obj.strftime("%Y-%m-%d")
     }
     
     # Chỉ thêm khi có giá trị
-    if from_date:
-        template_data["from_date"] = from_date
-    if to_date:
-        template_data["to_date"] = to_date
     if driver_name:
         template_data["driver_name"] = driver_name
     if license_plate:
@@ -5007,71 +6176,44 @@ async def export_general_report_excel(
     route_code: Optional[str] = None
 ):
     """Xuất Excel danh sách chi tiết từng chuyến cho general-report"""
-    # Sử dụng lại logic lọc từ salary_simple_page
-    daily_routes_query = db.query(DailyRoute)
-    
-    # Áp dụng bộ lọc thời gian
-    if from_date and to_date:
-        try:
-            from_date_obj = datetime.strptime(from_date, "%Y-%m-%d").date()
-            to_date_obj = datetime.strptime(to_date, "%Y-%m-%d").date()
-            daily_routes_query = daily_routes_query.filter(
-                DailyRoute.date >= from_date_obj,
-                DailyRoute.date <= to_date_obj
-            )
-        except ValueError:
-            pass
-    
-    # Áp dụng các bộ lọc khác
-    if driver_name:
-        daily_routes_query = daily_routes_query.filter(DailyRoute.driver_name.ilike(f"%{driver_name}%"))
-    if license_plate:
-        daily_routes_query = daily_routes_query.filter(DailyRoute.license_plate.ilike(f"%{license_plate}%"))
-    if route_code:
-        daily_routes_query = daily_routes_query.join(Route).filter(Route.route_code.ilike(f"%{route_code}%"))
-    
-    daily_routes = daily_routes_query.all()
+    # Dùng chung điều kiện lọc và khoảng ngày mặc định với trang general-report
+    from_date_obj, to_date_obj = general_report_date_range(from_date, to_date)
+    conditions = general_report_conditions(from_date_obj, to_date_obj, driver_name, license_plate, route_code)
     
     # Tạo dữ liệu chi tiết từng chuyến
     trip_details = []
-    for daily_route in daily_routes:
-        if daily_route.driver_name:
-            trip_details.append({
-                'stt': len(trip_details) + 1,
-                'ngay_chay': daily_route.date.strftime('%d/%m/%Y'),
-                'ten_lai_xe': daily_route.driver_name,
-                'bien_so_xe': daily_route.license_plate or 'N/A',
-                'ma_tuyen': daily_route.route.route_code,
-                'ten_tuyen': daily_route.route.route_name,
-                'km': daily_route.distance_km,
-                'tai_trong': daily_route.cargo_weight,
-                'ghi_chu': daily_route.notes or ''
-            })
+    for row in general_report_trip_query(db, conditions):
+        trip_details.append({
+            'stt': len(trip_details) + 1,
+            'ngay_chay': row.date.strftime('%d/%m/%Y'),
+            'ten_lai_xe': row.driver_name,
+            'bien_so_xe': row.license_plate or 'N/A',
+            'ma_tuyen': row.route_code,
+            'ten_tuyen': row.route_name,
+            'km': row.distance_km,
+            'tai_trong': row.cargo_weight,
+            'ghi_chu': row.notes or ''
+        })
     
     # Tạo CSV content với UTF-8 BOM để Excel hiển thị đúng tiếng Việt
-    csv_content = "\ufeff"  # UTF-8 BOM
-    csv_content += "STT,Ngày chạy,Tên lái xe,Biển số xe,Mã tuyến,Tên tuyến,Km,Tải trọng,Ghi chú\n"
-    
+    # Escape các ký tự đặc biệt trong CSV
+    def escape_csv_field(field):
+        if field is None:
+            return ""
+        field_str = str(field)
+        # Nếu chứa dấu phẩy, dấu ngoặc kép hoặc xuống dòng thì bọc trong dấu ngoặc kép
+        if ',' in field_str or '"' in field_str or '\n' in field_str:
+            field_str = field_str.replace('"', '""')  # Escape dấu ngoặc kép
+            field_str = f'"{field_str}"'
+        return field_str
+    
+    lines = ["STT,Ngày chạy,Tên lái xe,Biển số xe,Mã tuyến,Tên tuyến,Km,Tải trọng,Ghi chú"]
     for trip in trip_details:
-        # Escape các ký tự đặc biệt trong CSV
-        def escape_csv_field(field):
-            if field is None:
-                return ""
-            field_str = str(field)
-            # Nếu chứa dấu phẩy, dấu ngoặc kép hoặc xuống dòng thì bọc trong dấu ngoặc kép
-            if ',' in field_str or '"' in field_str or '\n' in field_str:
-                field_str = field_str.replace('"', '""')  # Escape dấu ngoặc kép
-                field_str = f'"{field_str}"'
-            return field_str
-        
-        csv_content += f"{trip['stt']},{escape_csv_field(trip['ngay_chay'])},{escape_csv_field(trip['ten_lai_xe'])},{escape_csv_field(trip['bien_so_xe'])},{escape_csv_field(trip['ma_tuyen'])},{escape_csv_field(trip['ten_tuyen'])},{trip['km']},{trip['tai_trong']},{escape_csv_field(trip['ghi_chu'])}\n"
+        lines.append(f"{trip['stt']},{escape_csv_field(trip['ngay_chay'])},{escape_csv_field(trip['ten_lai_xe'])},{escape_csv_field(trip['bien_so_xe'])},{escape_csv_field(trip['ma_tuyen'])},{escape_csv_field(trip['ten_tuyen'])},{trip['km']},{trip['tai_trong']},{escape_csv_field(trip['ghi_chu'])}")
+    csv_content = "\n".join(lines) + "\n"  # BOM được thêm khi encode utf-8-sig
     
-    # Tạo tên file
-    if from_date and to_date:
-        filename = f"chi_tiet_chuyen_{from_date}_den_{to_date}.csv"
-    else:
-        today = date.today()
-        filename = f"chi_tiet_chuyen_{today.month}_{today.year}.csv"
+    # Tạo tên file theo khoảng ngày thực tế đã xuất
+    filename = f"chi_tiet_chuyen_{from_date_obj.isoformat()}_den_{to_date_obj.isoformat()}.csv"
     
     # Trả về file CSV với encoding UTF-8
     return Response(
@@ -5373,12 +6515,186 @@ async def download_fuel_template(db: Session = Depends(get_db)):
         headers={"Content-Disposition": f"attachment; filename*=UTF-8''{filename}"}
     )
 
+# Dòng dữ liệu đầu tiên trong file mẫu (dòng 1-4 là tiêu đề) và số bản ghi ghi xuống DB mỗi lần flush
+FUEL_IMPORT_FIRST_ROW = 5
+FUEL_IMPORT_BATCH_SIZE = 500
+
+def read_fuel_import_rows(file_obj) -> list:
+    """
+    Đọc file Excel đổ dầu ở chế độ read-only (stream từng dòng, không dựng cả workbook trong RAM).
+    Trả về [(số dòng, (stt, ngày, biển số, số lít, đơn giá, thành tiền)), ...], bỏ các dòng trống.
+    """
+    wb = load_workbook(file_obj, read_only=True, data_only=True)
+    try:
+        rows = []
+        for row_num, values in enumerate(
+            wb.active.iter_rows(min_row=FUEL_IMPORT_FIRST_ROW, max_col=6, values_only=True),
+            FUEL_IMPORT_FIRST_ROW
+        ):
+            values = tuple(values) + (None,) * (6 - len(values))
+            # Bỏ qua dòng trống
+            if not values[1] or not values[2]:
+                continue
+            rows.append((row_num, values))
+        return rows
+    finally:
+        wb.close()
+
+def validate_fuel_import_rows(db: Session, rows: list) -> Tuple[list, list]:
+    """
+    Kiểm tra các dòng đọc từ file Excel đổ dầu.
+    Trả về (danh sách dict FuelRecord hợp lệ, danh sách lỗi theo dòng). Biển số kiểm tra theo cache xe
+    đang hoạt động; trùng lặp (ngày, biển số, số lít) kiểm tra với DB bằng một query duy nhất và với
+    các dòng phía trên trong cùng file.
+    """
+    valid_license_plates = {vehicle.license_plate for vehicle in get_active_vehicles(db)}
+    plate_suggestion = f"Biển số xe hợp lệ: {', '.join(list(valid_license_plates)[:5])}{'...' if len(valid_license_plates) > 5 else ''}"
+    
+    records = []
+    errors = []
+    for row_num, (stt, date_value, license_plate, liters_pumped, fuel_price_per_liter, cost_pumped) in rows:
+        try:
+            validation_errors = []
+            fuel_date = None
+            
+            # Kiểm tra ngày (cột B)
+            if isinstance(date_value, datetime):
+                fuel_date = date_value.date()
+            elif isinstance(date_value, date):
+                fuel_date = date_value
+            elif isinstance(date_value, str):
+                try:
+                    fuel_date = datetime.strptime(date_value.strip(), "%d/%m/%Y").date()
+                except ValueError:
+                    validation_errors.append({
+                        "column": "B (Ngày đổ)",
+                        "error": "Định dạng ngày không đúng",
+                        "value": str(date_value),
+                        "suggestion": "Định dạng đúng: dd/mm/yyyy (ví dụ: 25/09/2025)"
+                    })
+            else:
+                validation_errors.append({
+                    "column": "B (Ngày đổ)",
+                    "error": "Ngày không hợp lệ",
+                    "value": str(date_value),
+                    "suggestion": "Vui lòng nhập ngày theo định dạng dd/mm/yyyy"
+                })
+            
+            # Kiểm tra biển số xe (cột C)
+            license_plate = str(license_plate).strip()
+            if license_plate not in valid_license_plates:
+                validation_errors.append({
+                    "column": "C (Biển số xe)",
+                    "error": "Biển số xe không tồn tại trong hệ thống",
+                    "value": license_plate,
+                    "suggestion": plate_suggestion
+                })
+            
+            # Kiểm tra số lít dầu (cột D)
+            try:
+                liters_pumped = float(liters_pumped) if liters_pumped is not None else 0
+                if liters_pumped <= 0:
+                    validation_errors.append({
+                        "column": "D (Số lít đã đổ)",
+                        "error": "Số lít dầu phải lớn hơn 0",
+                        "value": str(liters_pumped),
+                        "suggestion": "Vui lòng nhập số lít dầu lớn hơn 0 (ví dụ: 50.5)"
+                    })
+            except (ValueError, TypeError):
+                validation_errors.append({
+                    "column": "D (Số lít đã đổ)",
+                    "error": "Số lít dầu không hợp lệ",
+                    "value": str(liters_pumped),
+                    "suggestion": "Vui lòng nhập số lít dầu là số (ví dụ: 50.5, 100)"
+                })
+            
+            # Kiểm tra đơn giá (cột E)
+            try:
+                fuel_price_per_liter = float(fuel_price_per_liter) if fuel_price_per_liter is not None else 0
+                if fuel_price_per_liter <= 0:
+                    validation_errors.append({
+                        "column": "E (Giá xăng dầu)",
+                        "error": "Đơn giá phải lớn hơn 0",
+                        "value": str(fuel_price_per_liter),
+                        "suggestion": "Vui lòng nhập đơn giá lớn hơn 0 (ví dụ: 25000)"
+                    })
+            except (ValueError, TypeError):
+                validation_errors.append({
+                    "column": "E (Giá xăng dầu)",
+                    "error": "Đơn giá không hợp lệ",
+                    "value": str(fuel_price_per_liter),
+                    "suggestion": "Vui lòng nhập đơn giá là số (ví dụ: 25000, 25000.5)"
+                })
+            
+            # Nếu có lỗi validation, bỏ qua dòng này
+            if validation_errors:
+                errors.append({"row": row_num, "errors": validation_errors})
+                continue
+            
+            # Tính thành tiền nếu không có
+            try:
+                cost_pumped = float(cost_pumped) if cost_pumped not in (None, "") else round(fuel_price_per_liter * liters_pumped)
+            except (ValueError, TypeError):
+                cost_pumped = round(fuel_price_per_liter * liters_pumped)
+            
+            records.append({
+                "date": fuel_date,
+                "fuel_type": "Dầu DO 0,05S-II",  # Mặc định
+                "license_plate": license_plate,
+                "fuel_price_per_liter": fuel_price_per_liter,
+                "liters_pumped": liters_pumped,
+                "cost_pumped": cost_pumped,
+                "notes": f"Import từ Excel - dòng {row_num}",
+                "_row": row_num
+            })
+        except Exception as e:
+            errors.append({
+                "row": row_num,
+                "errors": [{
+                    "column": "Tổng hợp",
+                    "error": "Lỗi xử lý dữ liệu",
+                    "value": f"Lỗi kỹ thuật: {str(e)}",
+                    "suggestion": "Vui lòng kiểm tra định dạng dữ liệu trong dòng này"
+                }]
+            })
+    
+    if not records:
+        return records, errors
+    
+    # Kiểm tra trùng lặp (cùng ngày, cùng xe, cùng số lít): một query theo index (date, license_plate)
+    existing_keys = {
+        (row.date, row.license_plate, round(row.liters_pumped or 0, 3))
+        for row in db.query(FuelRecord.date, FuelRecord.license_plate, FuelRecord.liters_pumped).filter(
+            FuelRecord.date.between(min(r["date"] for r in records), max(r["date"] for r in records)),
+            FuelRecord.license_plate.in_({r["license_plate"] for r in records})
+        )
+    }
+    unique_records = []
+    for record in records:
+        key = (record["date"], record["license_plate"], round(record["liters_pumped"], 3))
+        if key in existing_keys:
+            errors.append({
+                "row": record["_row"],
+                "errors": [{
+                    "column": "Tổng hợp",
+                    "error": "Bản ghi trùng lặp",
+                    "value": f"Xe {record['license_plate']} - Ngày {record['date'].strftime('%d/%m/%Y')} - {record['liters_pumped']:g} lít",
+                    "suggestion": "Đã tồn tại bản ghi đổ dầu cho xe này vào ngày này với cùng số lít. Vui lòng kiểm tra lại dữ liệu."
+                }]
+            })
+            continue
+        existing_keys.add(key)  # Trùng với dòng phía trên trong cùng file
+        unique_records.append(record)
+    errors.sort(key=lambda error: error["row"])
+    return unique_records, errors
+
 @app.post("/fuel/import-excel")
 async def import_fuel_excel(
     file: UploadFile = File(...),
+    dry_run: bool = Form(False),
     db: Session = Depends(get_db)
 ):
-    """Import dữ liệu đổ dầu từ file Excel"""
+    """Import dữ liệu đổ dầu từ file Excel (dry_run: chỉ kiểm tra và trả báo cáo lỗi, không ghi DB)"""
     try:
         # Kiểm tra định dạng file
         if not file.filename.lower().endswith(('.xlsx', '.xls')):
@@ -5393,212 +6709,75 @@ async def import_fuel_excel(
                 }
             )
         
-        # Đọc file Excel
-        content = await file.read()
-        if len(content) == 0:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "success": False,
-                    "error": "File rỗng",
-                    "error_type": "empty_file",
-                    "details": "File Excel không chứa dữ liệu",
-                    "suggestion": "Vui lòng kiểm tra lại file Excel có chứa dữ liệu"
-                }
-            )
-        
-        try:
-            wb = load_workbook(io.BytesIO(content))
-            ws = wb.active
-        except Exception as e:
+        # Đọc file Excel trực tiếp từ file tạm của upload, không chép cả file vào RAM
+        file_size = upload_file_size(file)
+        if file_size > MAX_UPLOAD_SIZE:
             return JSONResponse(
                 status_code=400,
                 content={
                     "success": False,
-                    "error": "Không thể đọc file Excel",
-                    "error_type": "file_corrupted",
-                    "details": f"Lỗi kỹ thuật: {str(e)}",
-                    "suggestion": "Vui lòng kiểm tra file Excel không bị hỏng và có định dạng đúng"
-                }
-            )
-        
-        # Lấy danh sách xe hợp lệ
-        vehicles = db.query(Vehicle).filter(Vehicle.status == 1).all()
-        valid_license_plates = {v.license_plate for v in vehicles}
-        
-        imported_count = 0
-        skipped_count = 0
-        errors = []
-        
-        # Bỏ qua header (dòng 1-4)
-        for row_num in range(5, ws.max_row + 1):
-            try:
-                # Đọc dữ liệu từ Excel
-                stt = ws.cell(row=row_num, column=1).value
-                date_str = ws.cell(row=row_num, column=2).value
-                license_plate = ws.cell(row=row_num, column=3).value
-                liters_pumped = ws.cell(row=row_num, column=4).value
-                fuel_price_per_liter = ws.cell(row=row_num, column=5).value
-                cost_pumped = ws.cell(row=row_num, column=6).value
-                
-                # Bỏ qua dòng trống
-                if not date_str or not license_plate:
-                    continue
-                
-                # Validation dữ liệu với thông báo chi tiết
-                validation_errors = []
-                
-                # Kiểm tra ngày (cột B)
-                if isinstance(date_str, str):
-                    try:
-                        fuel_date = datetime.strptime(date_str, "%d/%m/%Y").date()
-                    except ValueError:
-                        validation_errors.append({
-                            "column": "B (Ngày đổ)",
-                            "error": "Định dạng ngày không đúng",
-                            "value": str(date_str),
-                            "suggestion": "Định dạng đúng: dd/mm/yyyy (ví dụ: 25/09/2025)"
-                        })
-                elif isinstance(date_str, datetime):
-                    fuel_date = date_str.date()
-                else:
-                    validation_errors.append({
-                        "column": "B (Ngày đổ)",
-                        "error": "Ngày không hợp lệ",
-                        "value": str(date_str),
-                        "suggestion": "Vui lòng nhập ngày theo định dạng dd/mm/yyyy"
-                    })
-                
-                # Kiểm tra biển số xe (cột C)
-                if not license_plate:
-                    validation_errors.append({
-                        "column": "C (Biển số xe)",
-                        "error": "Biển số xe không được để trống",
-                        "value": "",
-                        "suggestion": "Vui lòng nhập biển số xe"
-                    })
-                elif str(license_plate).strip() not in valid_license_plates:
-                    validation_errors.append({
-                        "column": "C (Biển số xe)",
-                        "error": "Biển số xe không tồn tại trong hệ thống",
-                        "value": str(license_plate),
-                        "suggestion": f"Biển số xe hợp lệ: {', '.join(list(valid_license_plates)[:5])}{'...' if len(valid_license_plates) > 5 else ''}"
-                    })
-                
-                # Kiểm tra số lít dầu (cột D)
-                try:
-                    liters_pumped = float(liters_pumped) if liters_pumped is not None else 0
-                    if liters_pumped <= 0:
-                        validation_errors.append({
-                            "column": "D (Số lít đã đổ)",
-                            "error": "Số lít dầu phải lớn hơn 0",
-                            "value": str(liters_pumped),
-                            "suggestion": "Vui lòng nhập số lít dầu lớn hơn 0 (ví dụ: 50.5)"
-                        })
-                except (ValueError, TypeError):
-                    validation_errors.append({
-                        "column": "D (Số lít đã đổ)",
-                        "error": "Số lít dầu không hợp lệ",
-                        "value": str(liters_pumped),
-                        "suggestion": "Vui lòng nhập số lít dầu là số (ví dụ: 50.5, 100)"
-                    })
-                
-                # Kiểm tra đơn giá (cột E)
-                try:
-                    fuel_price_per_liter = float(fuel_price_per_liter) if fuel_price_per_liter is not None else 0
-                    if fuel_price_per_liter <= 0:
-                        validation_errors.append({
-                            "column": "E (Giá xăng dầu)",
-                            "error": "Đơn giá phải lớn hơn 0",
-                            "value": str(fuel_price_per_liter),
-                            "suggestion": "Vui lòng nhập đơn giá lớn hơn 0 (ví dụ: 25000)"
-                        })
-                except (ValueError, TypeError):
-                    validation_errors.append({
-                        "column": "E (Giá xăng dầu)",
-                        "error": "Đơn giá không hợp lệ",
-                        "value": str(fuel_price_per_liter),
-                        "suggestion": "Vui lòng nhập đơn giá là số (ví dụ: 25000, 25000.5)"
-                    })
-                
-                # Tính thành tiền nếu không có
-                if cost_pumped is None or cost_pumped == "":
-                    cost_pumped = round(fuel_price_per_liter * liters_pumped)
-                else:
-                    try:
-                        cost_pumped = float(cost_pumped)
-                    except (ValueError, TypeError):
-                        cost_pumped = round(fuel_price_per_liter * liters_pumped)
-                
-                # Nếu có lỗi validation, bỏ qua dòng này
-                if validation_errors:
-                    errors.append({
-                        "row": row_num,
-                        "errors": validation_errors
-                    })
-                    skipped_count += 1
-                    continue
-                
-                # Kiểm tra trùng lặp (cùng ngày, cùng xe)
-                existing_record = db.query(FuelRecord).filter(
-                    FuelRecord.date == fuel_date,
-                    FuelRecord.license_plate == str(license_plate).strip()
-                ).first()
-                
-                if existing_record:
-                    errors.append({
-                        "row": row_num,
-                        "errors": [{
-                            "column": "Tổng hợp",
-                            "error": "Bản ghi trùng lặp",
-                            "value": f"Xe {license_plate} - Ngày {fuel_date.strftime('%d/%m/%Y')}",
-                            "suggestion": "Đã tồn tại bản ghi đổ dầu cho xe này vào ngày này. Vui lòng kiểm tra lại dữ liệu."
-                        }]
-                    })
-                    skipped_count += 1
-                    continue
-                
-                # Tạo bản ghi mới
-                fuel_record = FuelRecord(
-                    date=fuel_date,
-                    fuel_type="Dầu DO 0,05S-II",  # Mặc định
-                    license_plate=str(license_plate).strip(),
-                    fuel_price_per_liter=fuel_price_per_liter,
-                    liters_pumped=liters_pumped,
-                    cost_pumped=cost_pumped,
-                    notes=f"Import từ Excel - dòng {row_num}"
-                )
-                
-                db.add(fuel_record)
-                imported_count += 1
-                
-            except Exception as e:
-                errors.append({
-                    "row": row_num,
-                    "errors": [{
-                        "column": "Tổng hợp",
-                        "error": "Lỗi xử lý dữ liệu",
-                        "value": f"Lỗi kỹ thuật: {str(e)}",
-                        "suggestion": "Vui lòng kiểm tra định dạng dữ liệu trong dòng này"
-                    }]
-                })
-                skipped_count += 1
-                continue
+                    "error": "File quá lớn",
+                    "error_type": "file_too_large",
+                    "details": f"Dung lượng file {file_size / 1024 / 1024:.1f}MB vượt giới hạn {MAX_UPLOAD_SIZE / 1024 / 1024:.0f}MB",
+                    "suggestion": "Vui lòng chia nhỏ file Excel trước khi import"
+                }
+            )
+        if file_size == 0:
+            return JSONResponse(
+                status_code=400,
+                content={
+                    "success": False,
+                    "error": "File rỗng",
+                    "error_type": "empty_file",
+                    "details": "File Excel không chứa dữ liệu",
+                    "suggestion": "Vui lòng kiểm tra lại file Excel có chứa dữ liệu"
+                }
+            )
         
-        # Commit tất cả thay đổi
-        db.commit()
+        try:
+            await file.seek(0)
+            rows = await run_in_threadpool(read_fuel_import_rows, file.file)
+        except Exception as e:
+            return JSONResponse(
+                status_code=400,
+                content={
+                    "success": False,
+                    "error": "Không thể đọc file Excel",
+                    "error_type": "file_corrupted",
+                    "details": f"Lỗi kỹ thuật: {str(e)}",
+                    "suggestion": "Vui lòng kiểm tra file Excel không bị hỏng và có định dạng đúng"
+                }
+            )
+        
+        records, errors = validate_fuel_import_rows(db, rows)
+        
+        # Ghi theo lô: mỗi lô là một executemany, không tạo object ORM cho từng dòng
+        if not dry_run and records:
+            for start in range(0, len(records), FUEL_IMPORT_BATCH_SIZE):
+                db.bulk_insert_mappings(FuelRecord, [
+                    {key: value for key, value in record.items() if key != "_row"}
+                    for record in records[start:start + FUEL_IMPORT_BATCH_SIZE]
+                ])
+            mark_cache_versions_changed(db, "fuel_records")
+            db.commit()
+        
+        imported_count = 0 if dry_run else len(records)
+        skipped_count = len(errors)
+        total_rows = len(rows)
         
         # Tạo response chi tiết
         response_data = {
             "success": True,
+            "dry_run": dry_run,
+            "valid_count": len(records),
             "imported_count": imported_count,
             "skipped_count": skipped_count,
             "total_errors": len(errors),
             "summary": {
-                "total_rows_processed": ws.max_row - 4,  # Trừ header
+                "total_rows_processed": total_rows,
                 "successful_imports": imported_count,
                 "failed_imports": skipped_count,
-                "success_rate": f"{(imported_count / max(1, ws.max_row - 4)) * 100:.1f}%" if ws.max_row > 4 else "0%"
+                "success_rate": f"{(len(records) / total_rows) * 100:.1f}%" if total_rows else "0%"
             }
         }
         
@@ -6030,6 +7209,10 @@ async def get_all_fuel_records(
     if current_user is None:
         return JSONResponse({"error": "Unauthorized"}, status_code=401)
     
+    etag = versioned_etag(request, db, "fuel_records")
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    
     try:
         # Lấy tất cả bản ghi đổ dầu, sắp xếp theo ngày giảm dần
         fuel_records = db.query(FuelRecord).order_by(FuelRecord.date.desc(), FuelRecord.id.desc()).all()
@@ -6046,10 +7229,10 @@ async def get_all_fuel_records(
                 'person': record.notes or ''  # Sử dụng notes cho "Người đổ"
             })
         
-        return JSONResponse({
+        return with_etag(JSONResponse({
             "success": True,
             "records": records_data
-        })
+        }), etag)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
@@ -6064,6 +7247,11 @@ async def get_fuel_records_by_month(
     if current_user is None:
         return JSONResponse({"error": "Unauthorized"}, status_code=401)
     
+    # Không truyền month_year → tháng hiện tại, nên ETag phải đổi khi sang tháng mới
+    etag = versioned_etag(request, db, "fuel_records", extra=date.today().strftime("%Y-%m"))
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    
     try:
         # Xác định tháng/năm để lọc (mặc định là tháng hiện tại)
         today = date.today()
@@ -6117,14 +7305,14 @@ async def get_fuel_records_by_month(
                 'notes': record.notes or ''
             })
         
-        return JSONResponse({
+        return with_etag(JSONResponse({
             "success": True,
             "records": records_data,
             "selected_month": month,
             "selected_year": year,
             "total_liters": total_liters,
             "total_cost": total_cost
-        })
+        }), etag)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
@@ -6206,21 +7394,13 @@ async def compare_fuel_quota_with_actual(
     license_plate: Optional[str] = None,
     current_user = Depends(get_current_user)
 ):
-    def _normalize_text_no_accents(text: str) -> str:
-        """Normalize Vietnamese text for stable sorting/comparison (remove accents, uppercase, trim)."""
-        if text is None:
-            return ""
-        s = unicodedata.normalize("NFKD", str(text))
-        s = "".join(c for c in s if unicodedata.category(c) != "Mn")
-        return " ".join(s.strip().upper().split())
-
     def _is_tang_cuong_route(route_code: str) -> bool:
         """
         Identify 'Tăng cường' routes.
         We treat any route that contains 'TANG CUONG' (accent-insensitive) as reinforcement.
         """
-        norm = _normalize_text_no_accents(route_code)
-        return "TANG CUONG" in norm
+        norm = normalize_key(route_code)
+        return TANG_CUONG_KEY in norm
 
     def _sort_fuel_quota_trips(trips: list[dict]) -> list[dict]:
         """
@@ -6246,9 +7426,9 @@ async def compare_fuel_quota_with_actual(
             route = (x.get("route_code") or "").strip()
             is_tc = _is_tang_cuong_route(route)
             # Force all reinforcement routes to the same group key, so they cluster at the end.
-            group = "ZZZ_TANG_CUONG" if is_tc else _normalize_text_no_accents(route)
+            group = "ZZZ_TANG_CUONG" if is_tc else normalize_key(route)
             d = _to_date_obj(x.get("date"))
-            return (is_tc, group, d, _normalize_text_no_accents(route))
+            return (is_tc, group, d, normalize_key(route))
 
         return sorted(trips, key=_key)
 
@@ -6403,17 +7583,9 @@ async def export_fuel_quota_excel(
     license_plate: Optional[str] = None,
     current_user = Depends(get_current_user)
 ):
-    def _normalize_text_no_accents(text: str) -> str:
-        """Normalize Vietnamese text for stable sorting/comparison (remove accents, uppercase, trim)."""
-        if text is None:
-            return ""
-        s = unicodedata.normalize("NFKD", str(text))
-        s = "".join(c for c in s if unicodedata.category(c) != "Mn")
-        return " ".join(s.strip().upper().split())
-
     def _is_tang_cuong_route(route_code: str) -> bool:
-        norm = _normalize_text_no_accents(route_code)
-        return "TANG CUONG" in norm
+        norm = normalize_key(route_code)
+        return TANG_CUONG_KEY in norm
 
     def _sort_fuel_quota_trips(trips: list[dict]) -> list[dict]:
         def _to_date_obj(v):
@@ -6431,9 +7603,9 @@ async def export_fuel_quota_excel(
         def _key(x: dict):
             route = (x.get("route_code") or "").strip()
             is_tc = _is_tang_cuong_route(route)
-            group = "ZZZ_TANG_CUONG" if is_tc else _normalize_text_no_accents(route)
+            group = "ZZZ_TANG_CUONG" if is_tc else normalize_key(route)
             d = _to_date_obj(x.get("date"))
-            return (is_tc, group, d, _normalize_text_no_accents(route))
+            return (is_tc, group, d, normalize_key(route))
 
         return sorted(trips, key=_key)
 
@@ -6708,6 +7880,7 @@ async def export_fuel_quota_excel(
 
 @app.get("/api/diesel-price/all")
 async def get_all_diesel_prices(
+    request: Request,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
@@ -6715,6 +7888,10 @@ async def get_all_diesel_prices(
     if current_user is None:
         return JSONResponse({"error": "Unauthorized"}, status_code=401)
     
+    etag = versioned_etag(request, db, "diesel_prices")
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    
     try:
         prices = db.query(DieselPriceHistory).order_by(DieselPriceHistory.application_date.desc()).all()
         prices_list = [
@@ -6727,10 +7904,10 @@ async def get_all_diesel_prices(
             }
             for p in prices
         ]
-        return JSONResponse({
+        return with_etag(JSONResponse({
             "success": True,
             "prices": prices_list
-        })
+        }), etag)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
@@ -6956,16 +8133,20 @@ async def edit_diesel_price(
 # ===== SALARY CALCULATION ROUTES =====
 
 @app.get("/api/employees")
-async def get_employees_api(db: Session = Depends(get_db)):
+async def get_employees_api(request: Request, db: Session = Depends(get_db)):
     """API để lấy danh sách nhân viên cho dropdown"""
-    employees = db.query(Employee).filter(Employee.status == 1).all()
-    return [
+    etag = versioned_etag(request, db, "employees")
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    
+    employees = get_active_employees(db)
+    return with_etag(JSONResponse([
         {
             "id": emp.id,
             "name": emp.name
         }
         for emp in employees
-    ]
+    ]), etag)
 
 @app.get("/salary-calculation", response_class=HTMLResponse)
 async def salary_calculation_page(
@@ -7046,7 +8227,7 @@ async def salary_calculation_page(
         salary_type = "standard"  # Mặc định là tuyến chuẩn
         
         # Kiểm tra nếu là tuyến "Tăng Cường"
-        if daily_route.route.route_code and daily_route.route.route_code.strip() == "Tăng Cường":
+        if daily_route.route.is_tang_cuong:
             salary_type = "tang_cuong"  # Luôn đánh dấu là tuyến Tăng Cường
             # Công thức cho tuyến "Tăng Cường":
             # - Nếu km < 25km: Áp dụng mức lương tuyến nội thành cố định 66.667 VNĐ
@@ -7117,17 +8298,17 @@ async def salary_calculation_page(
             })
     
     # Lấy danh sách lái xe, tuyến và xe để hiển thị
-    employees = db.query(Employee).filter(Employee.status == 1).all()
-    routes = db.query(Route).filter(Route.is_active == 1, Route.status == 1).all()
-    vehicles = db.query(Vehicle).filter(Vehicle.status == 1).all()
+    employees = get_active_employees(db)
+    routes = get_active_routes(db)
+    vehicles = get_active_vehicles(db)
     
     # Sắp xếp routes: A-Z bình thường, nhưng "Tăng Cường" đẩy xuống cuối
     def sort_routes_with_tang_cuong_at_bottom(routes):
         # Lọc ra routes không phải "Tăng Cường"
-        normal_routes = [route for route in routes if route.route_code and route.route_code.strip() != "Tăng Cường"]
+        normal_routes = [route for route in routes if not route.is_tang_cuong]
         
         # Lọc ra routes "Tăng Cường"
-        tang_cuong_routes = [route for route in routes if route.route_code and route.route_code.strip() == "Tăng Cường"]
+        tang_cuong_routes = [route for route in routes if route.is_tang_cuong]
         
         # Sắp xếp routes bình thường theo A-Z
         normal_routes_sorted = sorted(normal_routes, key=lambda route: route.route_code.lower())
@@ -7419,10 +8600,7 @@ def calculate_monthly_salary_summary(db: Session, month: str) -> list:
             end_date = date(year, month_num + 1, 1) - timedelta(days=1)
         
         # Lấy tất cả nhân viên đang làm việc (lái xe)
-        employees = db.query(Employee).filter(
-            Employee.status == 1,
-            Employee.employee_status == "Đang làm việc"
-        ).all()
+        employees = get_active_employees(db, working_only=True)
         
         results = []
         
@@ -8801,7 +9979,7 @@ async def export_salary_calculation_excel(
         salary_type = "standard"  # Mặc định là tuyến chuẩn
         
         # Kiểm tra nếu là tuyến "Tăng Cường"
-        if daily_route.route.route_code and daily_route.route.route_code.strip() == "Tăng Cường":
+        if daily_route.route.is_tang_cuong:
             salary_type = "tang_cuong"  # Luôn đánh dấu là tuyến Tăng Cường
             # Công thức cho tuyến "Tăng Cường":
             # - Nếu km < 25km: Áp dụng mức lương tuyến nội thành cố định 66.667 VNĐ
@@ -8966,13 +10144,19 @@ async def export_salary_calculation_excel(
         headers={"Content-Disposition": f"attachment; filename*=UTF-8''{filename}"}
     )
 
-async def create_daily_revenue_finance_record(selected_date: date, db: Session):
-    """Tự động tạo/cập nhật bản ghi thu nhập trong finance-report từ doanh thu hàng ngày"""
+def sync_daily_revenue_finance_record(selected_date: date, db: Session, commit: bool = True):
+    """
+    Tạo/cập nhật/xóa bản ghi thu nhập trong finance-report từ doanh thu hàng ngày.
+    
+    Khi commit=False, chỉ ghi vào session (dùng cho backfill gộp nhiều ngày trong một transaction)
+    và để lỗi được raise lên cho caller rollback.
+    """
     try:
         # Lấy tổng doanh thu của ngày
         revenue_records = db.query(RevenueRecord).filter(RevenueRecord.date == selected_date).all()
         
-        print(f"Processing date {selected_date}: Found {len(revenue_records)} revenue records")
+        if commit:
+            print(f"Processing date {selected_date}: Found {len(revenue_records)} revenue records")
         
         # Kiểm tra xem đã có bản ghi finance cho ngày này chưa
         # Tìm bản ghi doanh thu tự động: transaction_type = "Thu" và category = "Doanh thu vận chuyển"
@@ -8986,8 +10170,9 @@ async def create_daily_revenue_finance_record(selected_date: date, db: Session):
         if not revenue_records:
             if existing_finance_record:
                 db.delete(existing_finance_record)
-                db.commit()
-                print(f"Deleted finance record for date {selected_date} (no revenue records)")
+                if commit:
+                    db.commit()
+                    print(f"Deleted finance record for date {selected_date} (no revenue records)")
             return
         
         # Tính tổng doanh thu - chỉ tính cho các chuyến có trạng thái ON (Online)
@@ -9006,7 +10191,8 @@ async def create_daily_revenue_finance_record(selected_date: date, db: Session):
             else:
                 offline_count += 1
         
-        print(f"Date {selected_date}: Online={online_count}, Offline={offline_count}, Total revenue={total_revenue}")
+        if commit:
+            print(f"Date {selected_date}: Online={online_count}, Offline={offline_count}, Total revenue={total_revenue}")
         
         if existing_finance_record:
             # Cập nhật bản ghi hiện có - luôn cập nhật kể cả khi total_revenue = 0
@@ -9014,8 +10200,9 @@ async def create_daily_revenue_finance_record(selected_date: date, db: Session):
             existing_finance_record.total = total_revenue
             existing_finance_record.note = f"Tự động cập nhật từ {len(revenue_records)} tuyến doanh thu (Online: {online_count}, Offline: {offline_count})"
             existing_finance_record.updated_at = datetime.utcnow()
-            db.commit()
-            print(f"Updated finance record for date {selected_date} with total: {total_revenue}")
+            if commit:
+                db.commit()
+                print(f"Updated finance record for date {selected_date} with total: {total_revenue}")
         else:
             # Tạo bản ghi mới - luôn tạo nếu có revenue records, kể cả khi total_revenue = 0
             finance_record = FinanceTransaction(
@@ -9033,15 +10220,247 @@ async def create_daily_revenue_finance_record(selected_date: date, db: Session):
             )
             
             db.add(finance_record)
-            db.commit()
-            print(f"Created finance record for date {selected_date} with total: {total_revenue} (from {len(revenue_records)} revenue records)")
+            if commit:
+                db.commit()
+                print(f"Created finance record for date {selected_date} with total: {total_revenue} (from {len(revenue_records)} revenue records)")
             
     except Exception as e:
+        if not commit:
+            raise
         print(f"Error creating/updating daily revenue finance record for {selected_date}: {e}")
         import traceback
         traceback.print_exc()
         db.rollback()
 
+async def create_daily_revenue_finance_record(selected_date: date, db: Session):
+    """Tự động tạo/cập nhật bản ghi thu nhập trong finance-report từ doanh thu hàng ngày"""
+    sync_daily_revenue_finance_record(selected_date, db)
+
+# ==================== BULK RECOMPUTE / BACKFILL ====================
+# Tính lại doanh thu (RevenueRecord), bản ghi thu nhập tự động (FinanceTransaction) và
+# đơn giá/thành tiền chấm công (TimekeepingDetail) cho cả một khoảng ngày, ví dụ sau khi
+# sửa lùi giá tuyến hoặc giá dầu. Khoảng ngày được chia thành các chunk, mỗi chunk được
+# tính (chỉ đọc DB) trong một process riêng; process chính ghi kết quả, mỗi chunk một transaction
+# (không giữ khóa ghi SQLite suốt cả khoảng ngày).
+RECOMPUTE_MAX_WORKERS = os.cpu_count() or 1
+RECOMPUTE_API_MAX_DAYS = 366  # API chạy trong web worker; khoảng dài hơn dùng scripts/recompute_range.py
+
+def calculate_timekeeping_total_amount(status: Optional[str], route_type: Optional[str], distance_km, unit_price, bridge_fee, loading_fee) -> float:
+    """
+    Thành tiền của một dòng chấm công V1 - cùng công thức với calculateTotal() trong timekeeping_v1_detail.html:
+    - OFF: 0
+    - Nội thành: 227.273 đ / chuyến
+    - Còn lại: Km × Đơn giá + Phí cầu đường + Phí chờ tải
+    """
+    if (status or "Onl") == "OFF":
+        return 0
+    if (route_type or "") == "Nội thành":
+        return NOI_THANH_UNIT_PRICE
+    return (distance_km or 0) * (unit_price or 0) + (bridge_fee or 0) + (loading_fee or 0)
+
+def plan_timekeeping_pricing(db: Session, from_date: date, to_date: date) -> list:
+    """
+    Tính lại đơn giá/thành tiền cho TimekeepingDetail trong khoảng ngày theo RoutePrice áp dụng tại ngày chuyến.
+    
+    Chỉ thay đơn giá khi đơn giá đang lưu là một giá "chuẩn" của tuyến (Route.unit_price hoặc một RoutePrice),
+    để không ghi đè đơn giá đã nhập tay. Tuyến Tăng Cường được giữ nguyên đơn giá.
+    Trả về list dict {"id", "unit_price", "total_amount"} cho các dòng có thay đổi.
+    """
+    import bisect
+    
+    routes = db.query(Route.id, Route.route_code, Route.unit_price).filter(Route.status == 1).all()
+    routes_by_code = {}
+    for route_id, route_code, route_unit_price in routes:
+        if route_code and route_code.strip() not in routes_by_code:
+            routes_by_code[route_code.strip()] = (route_id, route_unit_price)
+    
+    # Lịch sử giá theo tuyến: {route_id: ([application_date...], [unit_price...])}, đã sắp xếp tăng dần
+    price_history = {}
+    for route_id, application_date, price in db.query(
+        RoutePrice.route_id, RoutePrice.application_date, RoutePrice.unit_price
+    ).filter(RoutePrice.application_date <= to_date).order_by(
+        RoutePrice.route_id, RoutePrice.application_date
+    ).all():
+        dates, prices = price_history.setdefault(route_id, ([], []))
+        dates.append(application_date)
+        prices.append(price)
+    
+    details = db.query(
+        TimekeepingDetail.id, TimekeepingDetail.route_code, TimekeepingDetail.route_type,
+        TimekeepingDetail.date, TimekeepingDetail.status, TimekeepingDetail.distance_km,
+        TimekeepingDetail.unit_price, TimekeepingDetail.bridge_fee, TimekeepingDetail.loading_fee,
+        TimekeepingDetail.total_amount
+    ).filter(
+        TimekeepingDetail.date >= from_date,
+        TimekeepingDetail.date <= to_date
+    ).all()
+    
+    updates = []
+    for d in details:
+        unit_price = d.unit_price or 0
+        route_code = (d.route_code or "").strip()
+        route_info = routes_by_code.get(route_code)
+        if route_info and route_code.upper() != "TĂNG CƯỜNG":
+            route_id, route_unit_price = route_info
+            dates, prices = price_history.get(route_id, ([], []))
+            idx = bisect.bisect_right(dates, d.date) - 1
+            if idx >= 0:
+                known_prices = set(prices)
+                # Route chưa có đơn giá: không coi 0 là giá chuẩn (đơn giá 0 có thể được nhập tay)
+                if route_unit_price:
+                    known_prices.add(route_unit_price)
+                if unit_price in known_prices:
+                    unit_price = prices[idx]
+        
+        total_amount = calculate_timekeeping_total_amount(
+            d.status, d.route_type, d.distance_km, unit_price, d.bridge_fee, d.loading_fee
+        )
+        if abs(unit_price - (d.unit_price or 0)) > 1e-6 or abs(total_amount - (d.total_amount or 0)) > 1e-6:
+            updates.append({"id": d.id, "unit_price": unit_price, "total_amount": total_amount})
+    
+    return updates
+
+def _backfill_worker_init():
+    """Khởi tạo process con: bỏ các connection SQLite kế thừa từ process cha (fork)"""
+    engine.dispose(close=False)
+
+def _backfill_plan_chunk(chunk: Tuple[date, date]) -> dict:
+    """Tính (chỉ đọc) kế hoạch recompute cho một chunk ngày. Chạy trong process con."""
+    chunk_from, chunk_to = chunk
+    db = SessionLocal()
+    try:
+        revenue_plans = {}
+        current = chunk_from
+        while current <= chunk_to:
+            changes, _ = plan_daily_revenue(db, current)
+            revenue_plans[current] = changes
+            current += timedelta(days=1)
+        return {
+            "revenue": revenue_plans,
+            "timekeeping": plan_timekeeping_pricing(db, chunk_from, chunk_to)
+        }
+    finally:
+        db.close()
+
+def split_date_range(from_date: date, to_date: date, chunk_days: int) -> list:
+    """Chia khoảng ngày [from_date, to_date] thành các chunk liên tiếp dài tối đa chunk_days ngày"""
+    chunk_days = max(1, int(chunk_days))
+    chunks = []
+    current = from_date
+    while current <= to_date:
+        chunk_end = min(current + timedelta(days=chunk_days - 1), to_date)
+        chunks.append((current, chunk_end))
+        current = chunk_end + timedelta(days=1)
+    return chunks
+
+def recompute_date_range(from_date: date, to_date: date, workers: int = 1, chunk_days: int = 7, dry_run: bool = False) -> dict:
+    """
+    Tính lại doanh thu, finance sync và đơn giá chấm công cho khoảng ngày.
+    
+    - Phase 1 (song song): mỗi chunk ngày được tính trong một process của ProcessPoolExecutor
+      (workers <= 1 thì tính tuần tự trong process hiện tại; tối đa RECOMPUTE_MAX_WORKERS process).
+    - Phase 2 (merge & commit): process hiện tại ghi kết quả, commit sau mỗi chunk.
+    
+    Returns:
+        dict thống kê: số ngày, số chunk, số RevenueRecord tạo/cập nhật, số dòng chấm công cập nhật, thời gian.
+    """
+    import time
+    
+    if from_date > to_date:
+        raise ValueError("Ngày bắt đầu phải nhỏ hơn hoặc bằng ngày kết thúc")
+    
+    started = time.perf_counter()
+    chunks = split_date_range(from_date, to_date, chunk_days)
+    workers = max(1, min(workers or 1, RECOMPUTE_MAX_WORKERS, len(chunks)))
+    
+    # Phase 1: tính kế hoạch
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers, initializer=_backfill_worker_init) as executor:
+            chunk_results = list(executor.map(_backfill_plan_chunk, chunks))
+    else:
+        chunk_results = [_backfill_plan_chunk(chunk) for chunk in chunks]
+    plan_seconds = time.perf_counter() - started
+    
+    revenue_plans = {}
+    timekeeping_updates = []
+    for result in chunk_results:
+        revenue_plans.update(result["revenue"])
+        timekeeping_updates.extend(result["timekeeping"])
+    
+    stats = {
+        "from_date": from_date.isoformat(),
+        "to_date": to_date.isoformat(),
+        "days": (to_date - from_date).days + 1,
+        "chunks": len(chunks),
+        "workers": workers,
+        "revenue_created": sum(1 for changes in revenue_plans.values() for c in changes if c["id"] is None),
+        "revenue_updated": sum(1 for changes in revenue_plans.values() for c in changes if c["id"] is not None),
+        "timekeeping_updated": len(timekeeping_updates),
+        "dry_run": dry_run,
+        "plan_seconds": round(plan_seconds, 2)
+    }
+    if dry_run:
+        stats["total_seconds"] = round(time.perf_counter() - started, 2)
+        return stats
+    
+    # Phase 2: ghi từng chunk trong một transaction riêng (chunk đã commit được giữ nếu chunk sau lỗi)
+    db = SessionLocal()
+    try:
+        for result in chunk_results:
+            for day in sorted(result["revenue"].keys()):
+                apply_daily_revenue_plan(db, result["revenue"][day])
+                db.flush()
+                sync_daily_revenue_finance_record(day, db, commit=False)
+                db.flush()
+            if result["timekeeping"]:
+                db.bulk_update_mappings(TimekeepingDetail, [
+                    with_normalized_keys(TimekeepingDetail, {**u, "updated_at": datetime.utcnow()}) for u in result["timekeeping"]
+                ])
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    
+    stats["total_seconds"] = round(time.perf_counter() - started, 2)
+    return stats
+
+@app.post("/api/admin/recompute")
+async def recompute_range_api(
+    request: Request,
+    current_user = Depends(get_current_user)
+):
+    """API (Admin) tính lại doanh thu / finance / đơn giá chấm công cho một khoảng ngày"""
+    if current_user is None or current_user["role"] != "Admin":
+        return JSONResponse({"success": False, "message": "Không có quyền truy cập"}, status_code=403)
+    
+    try:
+        payload = await request.json()
+        from_date = datetime.strptime(payload.get("from_date") or "", "%Y-%m-%d").date()
+        to_date = datetime.strptime(payload.get("to_date") or "", "%Y-%m-%d").date()
+        workers = int(payload.get("workers") or 1)
+        chunk_days = int(payload.get("chunk_days") or 7)
+        dry_run = bool(payload.get("dry_run"))
+    except Exception:
+        return JSONResponse({"success": False, "message": "Payload không hợp lệ (from_date/to_date dạng YYYY-MM-DD)"}, status_code=400)
+    
+    if (to_date - from_date).days + 1 > RECOMPUTE_API_MAX_DAYS:
+        return JSONResponse({
+            "success": False,
+            "message": f"Khoảng ngày tối đa {RECOMPUTE_API_MAX_DAYS} ngày; khoảng dài hơn hãy chạy scripts/recompute_range.py"
+        }, status_code=400)
+    
+    try:
+        stats = await run_in_threadpool(recompute_date_range, from_date, to_date, workers, chunk_days, dry_run)
+    except ValueError as e:
+        return JSONResponse({"success": False, "message": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"success": False, "message": f"Lỗi khi tính lại dữ liệu: {e}"}, status_code=500)
+    
+    return JSONResponse({"success": True, "data": stats})
+
 @app.get("/finance-report", response_class=HTMLResponse)
 async def finance_report_page(
     request: Request, 
@@ -9758,8 +11177,8 @@ async def financial_statistics_page(
                 # Tính doanh thu: ưu tiên manual_total, nếu không có thì dùng total_amount
                 revenue_amount = record.manual_total if record.manual_total > 0 else record.total_amount
                 
-                # Xử lý riêng cho tuyến "Tăng Cường" (so sánh không phân biệt hoa thường)
-                if route_code and route_code.strip().upper().replace(" ", "") == "TĂNGCƯỜNG":
+                # Xử lý riêng cho tuyến "Tăng Cường" (cờ is_tang_cuong tính sẵn từ route_code)
+                if route and route.is_tang_cuong:
                     tang_cuong_revenue += revenue_amount
                     if record.notes:
                         tang_cuong_notes.append(record.notes)
@@ -9875,18 +11294,9 @@ async def financial_statistics_details(
         
         # Lọc theo route_code được chọn (từ button Chi tiết)
         # Xử lý đặc biệt cho tuyến "Tăng Cường"
-        route_code_normalized = route_code.strip().upper().replace(" ", "")
-        if route_code_normalized == "TĂNGCƯỜNG" or route_code_normalized == "TANGCUONG":
-            # Lấy tất cả các record có route_code là "Tăng Cường"
-            # Tìm route có route_code là "Tăng Cường" (không phân biệt hoa thường, bỏ dấu cách)
-            all_routes = db.query(Route).all()
-            tang_cuong_route = None
-            for r in all_routes:
-                if r.route_code:
-                    r_code_normalized = r.route_code.strip().upper().replace(" ", "")
-                    if r_code_normalized == "TĂNGCƯỜNG" or r_code_normalized == "TANGCUONG":
-                        tang_cuong_route = r
-                        break
+        if is_tang_cuong_code(route_code):
+            # Lấy tất cả các record của tuyến "Tăng Cường" (tra theo cột is_tang_cuong đã index)
+            tang_cuong_route = find_tang_cuong_route(db)
             
             if tang_cuong_route:
                 query = query.filter(RevenueRecord.route_id == tang_cuong_route.id)
@@ -9896,8 +11306,8 @@ async def financial_statistics_details(
                     content={"success": True, "details": []}
                 )
         else:
-            # Lấy record theo route_code cụ thể
-            route = db.query(Route).filter(Route.route_code == route_code.strip()).first()
+            # Lấy record theo route_code cụ thể (so khớp theo route_code_key: không phân biệt dấu, hoa thường)
+            route = db.query(Route).filter(Route.route_code_key == normalize_key(route_code)).first()
             if route:
                 query = query.filter(RevenueRecord.route_id == route.id)
             else:
@@ -10110,16 +11520,8 @@ async def timekeeping_v1_detail_page(
     if not timekeeping_table:
         return RedirectResponse(url="/timekeeping-v1", status_code=303)
     
-    # Lấy dữ liệu từ các bảng hiện có
-    # Lấy tất cả employees để có thể bao gồm các lái xe đã gán (cho dữ liệu lịch sử)
-    all_employees = db.query(Employee).filter(Employee.status == 1).all()
-    vehicles = db.query(Vehicle).filter(Vehicle.status == 1).all()
     # Chỉ lấy routes có route_status = "ONL" khi tạo bảng chấm công mới
-    routes = db.query(Route).filter(
-        Route.is_active == 1, 
-        Route.status == 1,
-        Route.route_status == "ONL"
-    ).all()
+    routes = get_active_routes(db, route_status="ONL")
 
     # Tính dải ngày theo khoảng đã chọn
     date_range = []
@@ -10131,23 +11533,23 @@ async def timekeeping_v1_detail_page(
     # Ngày hiệu lực giá mới: 18/12/2025
     new_price_effective_date = date(2025, 12, 18)
     
+    # Lấy giá mới nhất có application_date >= 18/12/2025 cho tất cả tuyến trong 1 query
+    latest_route_prices = {}
+    route_ids = [route.id for route in routes]
+    if route_ids:
+        for route_price in db.query(RoutePrice).filter(
+            RoutePrice.route_id.in_(route_ids),
+            RoutePrice.application_date >= new_price_effective_date
+        ).order_by(RoutePrice.application_date.asc(), RoutePrice.id.asc()).all():
+            latest_route_prices[route_price.route_id] = route_price.unit_price
+    
     # Chuyển routes sang dict + thêm sheet Tăng Cường nếu chưa có
     routes_data = []
-    route_prices_by_date = {}  # Dictionary để lưu giá theo route_id và ngày
-    
     for route in routes:
-        # Lấy giá từ RoutePrice theo ngày hiệu lực (từ 18/12/2025)
-        # Lấy giá mới nhất có application_date >= 18/12/2025
-        route_price = db.query(RoutePrice).filter(
-            RoutePrice.route_id == route.id,
-            RoutePrice.application_date >= new_price_effective_date
-        ).order_by(RoutePrice.application_date.desc()).first()
-        
         # Nếu có giá trong RoutePrice, sử dụng giá đó; nếu không, fallback về giá từ Route
-        unit_price = route_price.unit_price if route_price else (route.unit_price or 0)
-        
-        # Lưu giá theo route_id để frontend có thể sử dụng
-        route_prices_by_date[route.id] = unit_price
+        unit_price = latest_route_prices.get(route.id)
+        if unit_price is None:
+            unit_price = route.unit_price or 0
         
         routes_data.append({
             "route_code": route.route_code or "",
@@ -10181,100 +11583,348 @@ async def timekeeping_v1_detail_page(
         key=lambda r: (r.get("route_code") or r.get("route_name") or "").lower()
     )
 
-    # Dữ liệu đã lưu - cần lấy trước để biết các lái xe đã gán
-    saved_details = db.query(TimekeepingDetail).filter(TimekeepingDetail.table_id == table_id).all()
-    
-    # Lấy danh sách tên lái xe đã được gán trong dữ liệu đã lưu (để giữ lại trong dropdown)
-    assigned_driver_names = set()
-    for detail in saved_details:
-        if detail.driver_name:
-            assigned_driver_names.add(detail.driver_name.strip())
-    
-    # Dropdown data - chỉ lấy employees có trạng thái "Đang làm việc"
-    # Nhưng cũng bao gồm các employees đã được gán (để giữ dữ liệu lịch sử)
-    employees_data = []
-    matched_driver_names = set()  # Track which assigned names have been matched to employees
-    
-    for emp in all_employees:
-        if emp.status == 1:
-            # Chỉ thêm vào dropdown nếu:
-            # 1. employee_status == "Đang làm việc" (cho phép chọn mới)
-            # 2. HOẶC tên đã được gán trong dữ liệu đã lưu (giữ dữ liệu lịch sử)
-            emp_name = emp.name or ""
-            is_active = (emp.employee_status or "Đang làm việc") == "Đang làm việc"
-            is_assigned = emp_name.strip() in assigned_driver_names
-            
-            if is_active or is_assigned:
-                if is_assigned:
-                    matched_driver_names.add(emp_name.strip())
-                employees_data.append({
-                    "id": emp.id, 
-                    "name": emp_name,
-                    "employee_status": emp.employee_status or "Đang làm việc",
-                    "is_active": is_active  # Flag để frontend biết có thể chọn hay không
-                })
-    
-    # Thêm các tên lái xe đã gán nhưng không khớp với employee nào (fallback cho dữ liệu lịch sử)
-    for driver_name in assigned_driver_names:
-        if driver_name not in matched_driver_names:
-            # Tên này không khớp với employee nào, thêm vào như một option disabled
-            employees_data.append({
-                "id": None,
-                "name": driver_name,
-                "employee_status": "Không còn trong hệ thống",
-                "is_active": False  # Không cho phép chọn mới
-            })
-    vehicles_data = [{"id": veh.id, "license_plate": veh.license_plate or ""} for veh in vehicles if veh.status == 1]
-
-    # Dữ liệu đã lưu (đã lấy ở trên)
-    details_by_sheet = {}
-    for detail in saved_details:
-        sheet_key = detail.sheet_name or detail.route_code or detail.route_name or "TĂNG CƯỜNG"
-        if sheet_key not in details_by_sheet:
-            details_by_sheet[sheet_key] = []
-        details_by_sheet[sheet_key].append({
-            "id": detail.id,
-            "sheet_name": sheet_key,
-            "route_code": detail.route_code or "",
-            "route_name": detail.route_name or "",
-            "route_type": detail.route_type or "",
-            "itinerary": detail.itinerary or "",
-            "date": detail.date.isoformat() if detail.date else "",
-            "license_plate": detail.license_plate or "",
-            "driver_name": detail.driver_name or "",
-            "trip_code": detail.trip_code or "",
-            "notes": detail.notes or "",
-            "status": detail.status or "Onl",
-            "distance_km": detail.distance_km or 0,
-            "unit_price": detail.unit_price or 0,
-            "bridge_fee": detail.bridge_fee or 0,
-            "loading_fee": detail.loading_fee or 0,
-            "total_amount": detail.total_amount or 0
-        })
-
-    for sheet_key, items in details_by_sheet.items():
-        details_by_sheet[sheet_key] = sorted(items, key=lambda x: x.get("date") or "")
+    # Chỉ lấy tên các sheet đã lưu để dựng tab; dữ liệu từng sheet tải qua API khi mở tab
+    saved_sheet_names = sorted({
+        sheet_name for (sheet_name,) in db.query(
+            func.coalesce(TimekeepingDetail.sheet_name, TimekeepingDetail.route_code, TimekeepingDetail.route_name)
+        ).filter(TimekeepingDetail.table_id == table_id).distinct().all()
+        if sheet_name
+    })
 
     return templates.TemplateResponse("timekeeping_v1_detail.html", {
         "request": request,
         "current_user": current_user,
         "timekeeping_table": timekeeping_table,
-        "employees": employees_data,
-        "vehicles": vehicles_data,
         "routes": routes_data,
         "date_range": date_range,
-        "timekeeping_details": details_by_sheet
+        "saved_sheet_names": saved_sheet_names
     })
 
 
-@app.post("/api/timekeeping-v1/{table_id}/save")
-async def save_timekeeping_detail(
+@app.get("/api/timekeeping-v1/{table_id}/rows")
+async def get_timekeeping_sheet_rows(
+    table_id: int,
+    sheet_name: Optional[List[str]] = Query(None),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Dữ liệu đã lưu của các sheet trong bảng chấm công, nhóm theo sheet.
+    Trang chi tiết gọi API này khi mở một tab (hoặc không truyền sheet_name để lấy toàn bộ, dùng cho Total/Lưu tất cả).
+    """
+    if current_user is None:
+        return JSONResponse({"success": False, "message": "Bạn cần đăng nhập"}, status_code=401)
+    if not check_page_access(current_user["role"], "/timekeeping-v1", current_user["id"], db):
+        return JSONResponse({"success": False, "message": "Không có quyền truy cập"}, status_code=403)
+    
+    table = db.query(TimekeepingTable).filter(TimekeepingTable.id == table_id).first()
+    if not table:
+        return JSONResponse({"success": False, "message": "Không tìm thấy bảng chấm công"}, status_code=404)
+    
+    sheet_key_column = func.coalesce(TimekeepingDetail.sheet_name, TimekeepingDetail.route_code, TimekeepingDetail.route_name)
+    query = db.query(TimekeepingDetail).filter(TimekeepingDetail.table_id == table_id)
+    if sheet_name:
+        query = query.filter(sheet_key_column.in_(sheet_name))
+    
+    details_by_sheet = {key: [] for key in (sheet_name or [])}
+    for detail in query.order_by(TimekeepingDetail.date, TimekeepingDetail.id).all():
+        sheet_key = detail.sheet_name or detail.route_code or detail.route_name or "TĂNG CƯỜNG"
+        item = timekeeping_detail_to_dict(detail)
+        item["sheet_name"] = sheet_key
+        details_by_sheet.setdefault(sheet_key, []).append(item)
+    
+    return JSONResponse({"success": True, "data": details_by_sheet})
+
+
+@app.get("/api/timekeeping-v1/reference-data")
+async def get_timekeeping_reference_data(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Dữ liệu dropdown (lái xe, xe) cho trang chấm công, không phụ thuộc bảng nên trình duyệt cache được (ETag).
+    Lái xe đã nghỉ vẫn trả về với is_active = False để giữ hiển thị dữ liệu lịch sử (không cho chọn mới).
+    """
+    if current_user is None:
+        return JSONResponse({"success": False, "message": "Bạn cần đăng nhập"}, status_code=401)
+    if not check_page_access(current_user["role"], "/timekeeping-v1", current_user["id"], db):
+        return JSONResponse({"success": False, "message": "Không có quyền truy cập"}, status_code=403)
+    
+    etag = versioned_etag(request, db, "employees", "vehicles")
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    
+    employees_data = []
+    for emp in get_active_employees(db, order_by_name=True):
+        employee_status = emp.employee_status or "Đang làm việc"
+        employees_data.append({
+            "id": emp.id,
+            "name": emp.name or "",
+            "employee_status": employee_status,
+            "is_active": employee_status == "Đang làm việc"  # Flag để frontend biết có thể chọn hay không
+        })
+    vehicles_data = [
+        {"id": veh.id, "license_plate": veh.license_plate or ""}
+        for veh in get_active_vehicles(db)
+    ]
+    
+    return with_etag(JSONResponse({"success": True, "employees": employees_data, "vehicles": vehicles_data}), etag)
+
+
+# ==================== TIMEKEEPING V1 - DIFF SAVE ====================
+# Các cột dữ liệu của một dòng chấm công (ngoài khóa table_id/sheet_name/date)
+TIMEKEEPING_DETAIL_FIELDS = [
+    "route_code", "route_name", "route_type", "itinerary", "license_plate", "driver_name",
+    "trip_code", "notes", "status", "distance_km", "unit_price", "bridge_fee", "loading_fee", "total_amount"
+]
+TIMEKEEPING_NUMERIC_FIELDS = {"distance_km", "unit_price", "bridge_fee", "loading_fee", "total_amount"}
+
+def timekeeping_row_key(sheet_name: str, row_date: date, trip_code: Optional[str], occurrence: int) -> tuple:
+    """
+    Khóa ổn định của một dòng chấm công trong bảng: (sheet_name, date, trip_code, thứ tự).
+    Sheet tuyến thường có 1 dòng/ngày → thứ tự luôn = 0; sheet Tăng Cường có thể có nhiều chuyến/ngày,
+    phân biệt bằng mã chuyến, nếu trống thì bằng thứ tự xuất hiện trong ngày.
+    """
+    return ((sheet_name or "").strip(), row_date, (trip_code or "").strip(), occurrence)
+
+def build_timekeeping_row_values(entry: dict, sheet_name: str) -> dict:
+    """Chuẩn hóa dữ liệu một dòng client gửi lên thành giá trị cột TimekeepingDetail"""
+    entry_status = entry.get("status") or "Onl"
+    
+    # Nếu status là OFF, đảm bảo total_amount = 0
+    entry_total = float(entry.get("total_amount") or 0)
+    if entry_status == "OFF":
+        entry_total = 0
+    
+    return {
+        "sheet_name": entry.get("sheet_name") or sheet_name or entry.get("route_code") or entry.get("route_name") or "",
+        "route_code": entry.get("route_code") or "",
+        "route_name": entry.get("route_name") or "",
+        "route_type": entry.get("route_type") or "",
+        "itinerary": entry.get("itinerary") or "",
+        "license_plate": entry.get("license_plate") or "",
+        "driver_name": entry.get("driver_name") or "",
+        "trip_code": entry.get("trip_code") or "",
+        "notes": entry.get("notes") or "",
+        "status": entry_status,
+        "distance_km": float(entry.get("distance_km") or 0),
+        "unit_price": float(entry.get("unit_price") or 0),
+        "bridge_fee": float(entry.get("bridge_fee") or 0),
+        "loading_fee": float(entry.get("loading_fee") or 0),
+        "total_amount": entry_total
+    }
+
+def timekeeping_values_differ(existing, values: dict) -> bool:
+    """So sánh dòng đang lưu với giá trị mới (số thực so sánh theo sai số nhỏ)"""
+    for field in TIMEKEEPING_DETAIL_FIELDS:
+        old_value = getattr(existing, field)
+        new_value = values[field]
+        if field in TIMEKEEPING_NUMERIC_FIELDS:
+            if abs((old_value or 0) - (new_value or 0)) > 1e-9:
+                return True
+        elif (old_value or "") != (new_value or ""):
+            return True
+    return False
+
+def upsert_timekeeping_entries(db: Session, table: TimekeepingTable, scope: str, sheet_name: str, entries: list) -> dict:
+    """
+    Đồng bộ dữ liệu chấm công client gửi lên với DB theo kiểu diff: chỉ INSERT dòng mới,
+    UPDATE dòng thay đổi và DELETE dòng không còn trong payload (trong phạm vi scope).
+    Không commit - caller commit/rollback để toàn bộ thao tác nằm trong một transaction.
+    
+    Returns:
+        dict {"inserted", "updated", "deleted", "unchanged", "rows"}; "rows" cùng thứ tự với entries:
+        {"id", "revision"} của dòng sau khi lưu, None với entry bị bỏ qua (ngày không hợp lệ/ngoài khoảng)
+    """
+    def parse_date_safe(date_str: str):
+        try:
+            return datetime.strptime(date_str, "%Y-%m-%d").date()
+        except Exception:
+            return None
+    
+    # Dòng hiện có trong phạm vi lưu (chỉ lấy các cột cần so sánh)
+    existing_query = db.query(
+        TimekeepingDetail.id, TimekeepingDetail.sheet_name, TimekeepingDetail.date, TimekeepingDetail.updated_at,
+        *[getattr(TimekeepingDetail, field) for field in TIMEKEEPING_DETAIL_FIELDS]
+    ).filter(TimekeepingDetail.table_id == table.id)
+    if scope != "all":
+        existing_query = existing_query.filter(TimekeepingDetail.sheet_name == sheet_name)
+    existing_rows = existing_query.order_by(TimekeepingDetail.id).all()
+    
+    existing_by_id = {}
+    existing_by_key = {}
+    occurrences = {}
+    for row in existing_rows:
+        existing_by_id[row.id] = row
+        base = ((row.sheet_name or "").strip(), row.date, (row.trip_code or "").strip())
+        occurrence = occurrences.get(base, 0)
+        occurrences[base] = occurrence + 1
+        existing_by_key[timekeeping_row_key(row.sheet_name, row.date, row.trip_code, occurrence)] = row
+    
+    matched_ids = set()
+    inserts = []
+    updates = []
+    unchanged = 0
+    occurrences = {}
+    now = datetime.utcnow()
+    saved_rows = []
+    insert_positions = []  # vị trí trong saved_rows của từng dòng insert
+    
+    for entry in entries:
+        entry_date = parse_date_safe(entry.get("date"))
+        if not entry_date or entry_date < table.from_date or entry_date > table.to_date:
+            saved_rows.append(None)
+            continue
+        
+        values = build_timekeeping_row_values(entry, sheet_name)
+        base = (values["sheet_name"].strip(), entry_date, values["trip_code"].strip())
+        occurrence = occurrences.get(base, 0)
+        occurrences[base] = occurrence + 1
+        
+        # Ưu tiên khớp theo id (nếu client gửi kèm và id thuộc phạm vi lưu), sau đó theo khóa
+        existing = None
+        try:
+            entry_id = int(entry.get("id")) if entry.get("id") not in (None, "") else None
+        except (TypeError, ValueError):
+            entry_id = None
+        if entry_id is not None and entry_id in existing_by_id and entry_id not in matched_ids:
+            existing = existing_by_id[entry_id]
+        else:
+            candidate = existing_by_key.get(timekeeping_row_key(values["sheet_name"], entry_date, values["trip_code"], occurrence))
+            if candidate is not None and candidate.id not in matched_ids:
+                existing = candidate
+        
+        if existing is None:
+            insert_positions.append(len(saved_rows))
+            saved_rows.append(None)
+            inserts.append(with_normalized_keys(TimekeepingDetail, {
+                "table_id": table.id,
+                "date": entry_date,
+                "created_at": now,
+                "updated_at": now,
+                **values
+            }))
+            continue
+        
+        matched_ids.add(existing.id)
+        if existing.date != entry_date or (existing.sheet_name or "") != values["sheet_name"] or timekeeping_values_differ(existing, values):
+            updates.append(with_normalized_keys(TimekeepingDetail, {"id": existing.id, "date": entry_date, "updated_at": now, **values}))
+            saved_rows.append({"id": existing.id, "revision": timekeeping_revision(now)})
+        else:
+            unchanged += 1
+            saved_rows.append({"id": existing.id, "revision": timekeeping_revision(existing.updated_at)})
+    
+    delete_ids = [row.id for row in existing_rows if row.id not in matched_ids]
+    
+    if delete_ids:
+        db.query(TimekeepingDetail).filter(TimekeepingDetail.id.in_(delete_ids)).delete(synchronize_session=False)
+    if updates:
+        db.bulk_update_mappings(TimekeepingDetail, updates)
+    if inserts:
+        db.bulk_insert_mappings(TimekeepingDetail, inserts)
+        # executemany không trả id: lấy lại id các dòng vừa insert (created_at = now) theo thứ tự insert
+        inserted_ids = [row.id for row in db.query(TimekeepingDetail.id).filter(
+            TimekeepingDetail.table_id == table.id,
+            TimekeepingDetail.created_at == now
+        ).order_by(TimekeepingDetail.id)]
+        for position, inserted_id in zip(insert_positions, inserted_ids):
+            saved_rows[position] = {"id": inserted_id, "revision": timekeeping_revision(now)}
+    
+    return {
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "deleted": len(delete_ids),
+        "unchanged": unchanged,
+        "rows": saved_rows
+    }
+
+@app.post("/api/timekeeping-v1/{table_id}/save")
+async def save_timekeeping_detail(
+    table_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """Lưu dữ liệu chấm công chi tiết"""
+    if current_user is None:
+        return JSONResponse({"success": False, "message": "Bạn cần đăng nhập"}, status_code=401)
+    if not check_page_access(current_user["role"], "/timekeeping-v1", current_user["id"], db):
+        return JSONResponse({"success": False, "message": "Không có quyền truy cập"}, status_code=403)
+
+    table = db.query(TimekeepingTable).filter(TimekeepingTable.id == table_id).first()
+    if not table:
+        return JSONResponse({"success": False, "message": "Không tìm thấy bảng chấm công"}, status_code=404)
+
+    try:
+        payload = await request.json()
+    except Exception:
+        return JSONResponse({"success": False, "message": "Payload không hợp lệ"}, status_code=400)
+
+    scope = payload.get("scope", "sheet")
+    sheet_name = payload.get("sheet_name") or ""
+    entries = payload.get("entries", [])
+
+    # Chỉ ghi phần thay đổi (insert/update/delete) trong một transaction
+    try:
+        counts = upsert_timekeeping_entries(db, table, scope, sheet_name, entries)
+        db.commit()
+        # id/revision mới của từng entry (cùng thứ tự payload) để client autosave tiếp mà vẫn kiểm tra xung đột
+        saved_rows = counts.pop("rows")
+        return JSONResponse({"success": True, "message": "Lưu dữ liệu thành công", "data": counts, "rows": saved_rows})
+    except Exception as e:
+        db.rollback()
+        return JSONResponse({"success": False, "message": f"Lỗi khi lưu dữ liệu: {e}"}, status_code=500)
+
+# ==================== TIMEKEEPING V1 - CELL AUTOSAVE ====================
+# Các cột client được phép sửa từng ô qua PATCH (total_amount luôn được server tính lại)
+TIMEKEEPING_PATCHABLE_FIELDS = set(TIMEKEEPING_DETAIL_FIELDS) - {"total_amount"} | {"date"}
+
+def timekeeping_revision(updated_at: Optional[datetime]) -> str:
+    """Revision của một dòng chấm công = updated_at (mọi thao tác ghi đều cập nhật updated_at)"""
+    return updated_at.isoformat() if updated_at else ""
+
+def timekeeping_detail_to_dict(detail: TimekeepingDetail) -> dict:
+    """Chuyển một dòng TimekeepingDetail sang dict cho frontend"""
+    return {
+        "id": detail.id,
+        "sheet_name": detail.sheet_name or "",
+        "route_code": detail.route_code or "",
+        "route_name": detail.route_name or "",
+        "route_type": detail.route_type or "",
+        "itinerary": detail.itinerary or "",
+        "date": detail.date.isoformat() if detail.date else "",
+        "license_plate": detail.license_plate or "",
+        "driver_name": detail.driver_name or "",
+        "trip_code": detail.trip_code or "",
+        "notes": detail.notes or "",
+        "status": detail.status or "Onl",
+        "distance_km": detail.distance_km or 0,
+        "unit_price": detail.unit_price or 0,
+        "bridge_fee": detail.bridge_fee or 0,
+        "loading_fee": detail.loading_fee or 0,
+        "total_amount": detail.total_amount or 0,
+        "revision": timekeeping_revision(detail.updated_at)
+    }
+
+@app.patch("/api/timekeeping-v1/{table_id}/cells")
+async def patch_timekeeping_cells(
     table_id: int,
     request: Request,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
-    """Lưu dữ liệu chấm công chi tiết"""
+    """
+    Lưu tự động từng ô chấm công (autosave).
+    
+    Payload: {"changes": [{"ref", "id", "revision", "sheet_name", "date", "trip_code", "occurrence",
+                           "insert", "row", "field", "value"}, ...]}
+    - Các change cùng "ref" (hoặc cùng id) thuộc về một dòng.
+    - Dòng có id: kiểm tra revision, nếu thiếu hoặc khác revision hiện tại trên server → conflict, không ghi.
+    - Dòng chưa có id: tìm theo khóa (sheet_name, date, trip_code nếu có gửi, occurrence); nếu "insert" = true
+      hoặc không tìm thấy → tạo dòng mới từ "row".
+    Tất cả thay đổi được ghi trong một transaction.
+    """
     if current_user is None:
         return JSONResponse({"success": False, "message": "Bạn cần đăng nhập"}, status_code=401)
     if not check_page_access(current_user["role"], "/timekeeping-v1", current_user["id"], db):
@@ -10286,79 +11936,152 @@ async def save_timekeeping_detail(
 
     try:
         payload = await request.json()
+        changes = payload.get("changes") or []
+        if not isinstance(changes, list):
+            raise ValueError("changes must be a list")
     except Exception:
         return JSONResponse({"success": False, "message": "Payload không hợp lệ"}, status_code=400)
 
-    scope = payload.get("scope", "sheet")
-    sheet_name = payload.get("sheet_name") or ""
-    entries = payload.get("entries", [])
-
-    def parse_date_safe(date_str: str):
+    def parse_date_safe(date_str):
         try:
             return datetime.strptime(date_str, "%Y-%m-%d").date()
         except Exception:
             return None
 
-    # Xóa dữ liệu cũ theo phạm vi
-    try:
-        if scope == "all":
-            db.query(TimekeepingDetail).filter(TimekeepingDetail.table_id == table_id).delete()
-        else:
-            db.query(TimekeepingDetail).filter(
-                TimekeepingDetail.table_id == table_id,
-                TimekeepingDetail.sheet_name == sheet_name
-            ).delete()
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        return JSONResponse({"success": False, "message": f"Lỗi khi xóa dữ liệu cũ: {e}"}, status_code=500)
+    # Gom các change theo dòng
+    groups = {}
+    for change in changes:
+        if not isinstance(change, dict):
+            continue
+        ref = change.get("ref")
+        if ref in (None, ""):
+            ref = f"id:{change.get('id')}" if change.get("id") else f"key:{change.get('sheet_name')}|{change.get('date')}|{change.get('trip_code') or ''}|{change.get('occurrence') or 0}"
+        groups.setdefault(str(ref), []).append(change)
+
+    applied = []
+    conflicts = []
+    errors = []
+    now = datetime.utcnow()
 
-    # Lưu mới
     try:
-        records_to_add = []
-        for entry in entries:
-            entry_date = parse_date_safe(entry.get("date"))
-            if not entry_date:
+        for ref, group in groups.items():
+            head = group[0]
+            detail = None
+            
+            # 1. Xác định dòng đích
+            if head.get("id"):
+                detail = db.query(TimekeepingDetail).filter(
+                    TimekeepingDetail.id == head.get("id"),
+                    TimekeepingDetail.table_id == table_id
+                ).first()
+                if detail is None:
+                    errors.append({"ref": ref, "message": "Dòng chấm công không còn tồn tại"})
+                    continue
+            elif not head.get("insert"):
+                key_date = parse_date_safe(head.get("date"))
+                if key_date and head.get("sheet_name"):
+                    key_query = db.query(TimekeepingDetail).filter(
+                        TimekeepingDetail.table_id == table_id,
+                        TimekeepingDetail.sheet_name == head.get("sheet_name"),
+                        TimekeepingDetail.date == key_date
+                    )
+                    # Sheet tuyến thường (1 dòng/ngày) không cần gửi trip_code trong khóa
+                    if head.get("trip_code") is not None:
+                        key_query = key_query.filter(
+                            func.coalesce(TimekeepingDetail.trip_code, "") == (head.get("trip_code") or "").strip()
+                        )
+                    same_key = key_query.order_by(TimekeepingDetail.id).all()
+                    occurrence = int(head.get("occurrence") or 0)
+                    if occurrence < len(same_key):
+                        detail = same_key[occurrence]
+            
+            # 2. Kiểm tra xung đột theo revision (dòng có id bắt buộc gửi revision)
+            client_revision = head.get("revision")
+            if detail is not None and (head.get("id") or client_revision not in (None, "")) and client_revision != timekeeping_revision(detail.updated_at):
+                conflicts.append({
+                    "ref": ref,
+                    "id": detail.id,
+                    "fields": [c.get("field") for c in group],
+                    "revision": timekeeping_revision(detail.updated_at),
+                    "row": timekeeping_detail_to_dict(detail)
+                })
                 continue
-            if entry_date < table.from_date or entry_date > table.to_date:
+            
+            # 3. Tạo dòng mới nếu chưa có
+            if detail is None:
+                base_row = dict(head.get("row") or {})
+                base_row.setdefault("sheet_name", head.get("sheet_name"))
+                base_row.setdefault("date", head.get("date"))
+                row_date = parse_date_safe(base_row.get("date"))
+                row_sheet = base_row.get("sheet_name") or ""
+                if not row_date or not row_sheet:
+                    errors.append({"ref": ref, "message": "Thiếu sheet_name hoặc ngày để tạo dòng mới"})
+                    continue
+                detail = TimekeepingDetail(table_id=table_id, date=row_date, **build_timekeeping_row_values(base_row, row_sheet))
+                db.add(detail)
+            
+            # 4. Áp dụng từng ô
+            group_error = None
+            for change in group:
+                field = change.get("field")
+                if not field:
+                    continue
+                if field not in TIMEKEEPING_PATCHABLE_FIELDS:
+                    group_error = f"Không thể sửa cột {field}"
+                    break
+                value = change.get("value")
+                if field in TIMEKEEPING_NUMERIC_FIELDS:
+                    try:
+                        value = float(value or 0)
+                    except (TypeError, ValueError):
+                        group_error = f"Giá trị không hợp lệ cho cột {field}"
+                        break
+                elif field == "date":
+                    value = parse_date_safe(value)
+                    if not value:
+                        group_error = "Ngày không hợp lệ"
+                        break
+                elif field == "status":
+                    value = value or "Onl"
+                else:
+                    value = value or ""
+                setattr(detail, field, value)
+            
+            if detail.date is None or detail.date < table.from_date or detail.date > table.to_date:
+                group_error = group_error or "Ngày nằm ngoài khoảng của bảng chấm công"
+            if group_error:
+                if detail in db.new:
+                    db.expunge(detail)
+                else:
+                    db.refresh(detail)
+                errors.append({"ref": ref, "message": group_error})
                 continue
-
-            # Lấy status, mặc định là "Onl"
-            entry_status = entry.get("status") or "Onl"
             
-            # Nếu status là OFF, đảm bảo total_amount = 0
-            entry_total = float(entry.get("total_amount") or 0)
-            if entry_status == "OFF":
-                entry_total = 0
-
-            detail = TimekeepingDetail(
-                table_id=table_id,
-                sheet_name=entry.get("sheet_name") or sheet_name or entry.get("route_code") or entry.get("route_name") or "",
-                route_code=entry.get("route_code") or "",
-                route_name=entry.get("route_name") or "",
-                route_type=entry.get("route_type") or "",
-                itinerary=entry.get("itinerary") or "",
-                date=entry_date,
-                license_plate=entry.get("license_plate") or "",
-                driver_name=entry.get("driver_name") or "",
-                trip_code=entry.get("trip_code") or "",
-                notes=entry.get("notes") or "",
-                status=entry_status,
-                distance_km=float(entry.get("distance_km") or 0),
-                unit_price=float(entry.get("unit_price") or 0),
-                bridge_fee=float(entry.get("bridge_fee") or 0),
-                loading_fee=float(entry.get("loading_fee") or 0),
-                total_amount=entry_total
+            # 5. Thành tiền luôn do server tính lại
+            detail.total_amount = calculate_timekeeping_total_amount(
+                detail.status, detail.route_type, detail.distance_km,
+                detail.unit_price, detail.bridge_fee, detail.loading_fee
             )
-            records_to_add.append(detail)
-
-        if records_to_add:
-            db.bulk_save_objects(records_to_add)
+            detail.updated_at = now
+            db.flush()
+            applied.append({
+                "ref": ref,
+                "id": detail.id,
+                "revision": timekeeping_revision(detail.updated_at),
+                "total_amount": detail.total_amount
+            })
+        
         db.commit()
-        return JSONResponse({"success": True, "message": "Lưu dữ liệu thành công"})
     except Exception as e:
         db.rollback()
-        return JSONResponse({"success": False, "message": f"Lỗi khi lưu dữ liệu: {e}"}, status_code=500)
+        return JSONResponse({"success": False, "message": f"Lỗi khi lưu tự động: {e}"}, status_code=500)
+
+    return JSONResponse({
+        "success": True,
+        "applied": applied,
+        "conflicts": conflicts,
+        "errors": errors
+    })
 
 @app.get("/api/timekeeping-v1/{table_id}/export-excel")
 async def export_timekeeping_excel(
@@ -10543,6 +12266,284 @@ async def export_timekeeping_excel(
         headers={"Content-Disposition": content_disposition}
     )
 
+# ==================== TIMEKEEPING V1 - EXCEL IMPORT ====================
+# File import dùng cùng bố cục với file export: mỗi sheet là một tuyến, header ở dòng 4, dữ liệu từ dòng 5,
+# cột B..K = Ngày, Biển số, Lái xe, Mã chuyến, Ghi chú, Trạng thái, Km, Đơn giá, Phí cầu, Phí bốc
+# (cột Tổng tiền được tính lại ở server).
+TIMEKEEPING_IMPORT_FIRST_ROW = 5
+TIMEKEEPING_IMPORT_MAX_ERRORS = 500
+
+def timekeeping_excel_sheet_title(name: str) -> str:
+    """Chuẩn hóa tên sheet giống lúc export (bỏ ký tự không hợp lệ, tối đa 31 ký tự) để so khớp không phân biệt hoa thường"""
+    title = ''.join(c for c in (name or "")[:31] if c not in ['\\', '/', '?', '*', '[', ']', ':'])
+    return title.strip().casefold()
+
+def parse_timekeeping_import_date(value) -> Optional[date]:
+    """Ngày trong file Excel: ô kiểu ngày, chuỗi dd/mm/yyyy hoặc yyyy-mm-dd"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        for fmt in ("%d/%m/%Y", "%Y-%m-%d"):
+            try:
+                return datetime.strptime(value.strip(), fmt).date()
+            except ValueError:
+                continue
+    return None
+
+def parse_timekeeping_import_number(value) -> Optional[float]:
+    """Số trong file Excel (ô số hoặc chuỗi có dấu phân cách nghìn ','); ô trống → None"""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return float(str(value).replace(",", "").replace(" ", ""))
+
+def load_timekeeping_import_references(db: Session, table: TimekeepingTable) -> dict:
+    """
+    Dữ liệu tham chiếu cho import, lấy một lần cho cả file: biển số, tên lái xe, tuyến theo tên sheet
+    và lịch sử giá tuyến (để điền đơn giá khi ô Đơn giá trống).
+    """
+    routes_by_title = {}
+    route_prices = {}
+    # Tuyến ONL được ưu tiên khi trùng tên với tuyến đã ngừng
+    routes = db.query(Route).filter(Route.status == 1).order_by(Route.route_status.desc(), Route.id).all()
+    for route in routes:
+        info = {
+            "sheet_name": route.route_code or route.route_name or "",
+            "route_code": route.route_code or "",
+            "route_name": route.route_name or "",
+            "route_type": route.route_type or "",
+            "route_id": route.id,
+            "unit_price": route.unit_price or 0
+        }
+        for name in (route.route_code, route.route_name):
+            title = timekeeping_excel_sheet_title(name)
+            if title and title not in routes_by_title:
+                routes_by_title[title] = info
+    
+    for route_id, application_date, price in db.query(
+        RoutePrice.route_id, RoutePrice.application_date, RoutePrice.unit_price
+    ).filter(RoutePrice.application_date <= table.to_date).order_by(
+        RoutePrice.route_id, RoutePrice.application_date
+    ).all():
+        dates, prices = route_prices.setdefault(route_id, ([], []))
+        dates.append(application_date)
+        prices.append(price)
+    
+    # Sheet đã lưu trong bảng (kể cả tuyến đã ngừng) được giữ nguyên tên
+    saved_sheet_names = [
+        name for (name,) in db.query(TimekeepingDetail.sheet_name).filter(
+            TimekeepingDetail.table_id == table.id
+        ).distinct().all() if name
+    ]
+    
+    return {
+        "license_plates": {plate.strip() for (plate,) in db.query(Vehicle.license_plate).filter(Vehicle.status == 1).all() if plate},
+        "driver_names": {name.strip() for (name,) in db.query(Employee.name).filter(Employee.status == 1).all() if name},
+        "routes_by_title": routes_by_title,
+        "route_prices": route_prices,
+        "saved_sheet_names": {timekeeping_excel_sheet_title(name): name for name in saved_sheet_names}
+    }
+
+def parse_timekeeping_workbook(file_obj, table: TimekeepingTable, references: dict) -> Tuple[dict, list, int]:
+    """
+    Đọc file Excel chấm công ở chế độ read-only (iter_rows, không nạp toàn bộ workbook vào bộ nhớ)
+    và kiểm tra từng dòng với dữ liệu tham chiếu. Không truy cập DB nên có thể chạy trong threadpool.
+    
+    Returns:
+        (entries_by_sheet, errors, row_count) - entries là dict cùng dạng payload của API save.
+        Sheet không có dòng dữ liệu nào không có trong entries_by_sheet (không thay thế dữ liệu đã lưu).
+    """
+    import bisect
+    
+    entries_by_sheet = {}
+    errors = []
+    row_count = 0
+    
+    def add_error(sheet_title, row_num, column, message, value):
+        errors.append({
+            "sheet": sheet_title,
+            "row": row_num,
+            "column": column,
+            "error": message,
+            "value": "" if value is None else str(value)
+        })
+    
+    wb = load_workbook(file_obj, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            title = timekeeping_excel_sheet_title(ws.title)
+            is_tang_cuong = "tăng cường" in title
+            route = references["routes_by_title"].get(title)
+            if route is not None:
+                sheet_name = route["sheet_name"]
+            elif title in references["saved_sheet_names"]:
+                sheet_name = references["saved_sheet_names"][title]
+            elif is_tang_cuong:
+                sheet_name = "TĂNG CƯỜNG"
+            else:
+                add_error(ws.title, None, "Sheet", "Tên sheet không khớp với mã tuyến nào", ws.title)
+                continue
+            is_tang_cuong = is_tang_cuong or "TĂNG CƯỜNG" in sheet_name.upper()
+            
+            entries = entries_by_sheet.setdefault(sheet_name, [])
+            seen_dates = set()
+            for row_num, values in enumerate(
+                ws.iter_rows(min_row=TIMEKEEPING_IMPORT_FIRST_ROW, max_col=11, values_only=True),
+                TIMEKEEPING_IMPORT_FIRST_ROW
+            ):
+                values = tuple(values) + (None,) * (11 - len(values))
+                stt, raw_date, plate, driver, trip_code, notes, raw_status, km, unit_price, bridge_fee, loading_fee = values
+                
+                # Bỏ qua dòng trống và dòng tổng cộng
+                if isinstance(stt, str) and stt.strip().upper() == "TỔNG CỘNG":
+                    continue
+                if all(v is None or (isinstance(v, str) and not v.strip()) for v in values[1:]):
+                    continue
+                row_count += 1
+                row_errors = len(errors)
+                
+                row_date = parse_timekeeping_import_date(raw_date)
+                if row_date is None:
+                    add_error(ws.title, row_num, "B (Ngày)", "Ngày không hợp lệ (dd/mm/yyyy)", raw_date)
+                elif row_date < table.from_date or row_date > table.to_date:
+                    add_error(ws.title, row_num, "B (Ngày)", "Ngày nằm ngoài khoảng của bảng chấm công", raw_date)
+                elif not is_tang_cuong:
+                    if row_date in seen_dates:
+                        add_error(ws.title, row_num, "B (Ngày)", "Sheet tuyến chỉ có một dòng mỗi ngày, ngày bị trùng", raw_date)
+                    seen_dates.add(row_date)
+                
+                plate = str(plate).strip() if plate is not None else ""
+                if plate and plate not in references["license_plates"]:
+                    add_error(ws.title, row_num, "C (Biển số)", "Biển số xe không tồn tại trong hệ thống", plate)
+                driver = str(driver).strip() if driver is not None else ""
+                if driver and driver not in references["driver_names"]:
+                    add_error(ws.title, row_num, "D (Lái xe)", "Lái xe không tồn tại trong hệ thống", driver)
+                
+                entry_status = str(raw_status).strip() if raw_status is not None else ""
+                if not entry_status:
+                    entry_status = "Onl"
+                elif entry_status.upper() in ("ONL", "OFF"):
+                    entry_status = "OFF" if entry_status.upper() == "OFF" else "Onl"
+                else:
+                    add_error(ws.title, row_num, "G (Trạng thái)", "Trạng thái chỉ nhận Onl hoặc OFF", raw_status)
+                
+                numbers = {}
+                for column, field, raw in (
+                    ("H (Km)", "distance_km", km),
+                    ("I (Đơn giá)", "unit_price", unit_price),
+                    ("J (Phí cầu)", "bridge_fee", bridge_fee),
+                    ("K (Phí bốc)", "loading_fee", loading_fee)
+                ):
+                    try:
+                        numbers[field] = parse_timekeeping_import_number(raw)
+                    except (TypeError, ValueError):
+                        add_error(ws.title, row_num, column, "Giá trị phải là số", raw)
+                        numbers[field] = None
+                
+                if len(errors) > row_errors:
+                    continue
+                
+                # Đơn giá trống → lấy giá tuyến áp dụng tại ngày chuyến (RoutePrice, fallback Route.unit_price)
+                if numbers["unit_price"] is None and route is not None and not is_tang_cuong:
+                    dates, prices = references["route_prices"].get(route["route_id"], ([], []))
+                    idx = bisect.bisect_right(dates, row_date) - 1
+                    numbers["unit_price"] = prices[idx] if idx >= 0 else route["unit_price"]
+                
+                route_type = route["route_type"] if route is not None else ("Tăng cường" if is_tang_cuong else "")
+                entries.append({
+                    "sheet_name": sheet_name,
+                    "route_code": route["route_code"] if route is not None else sheet_name,
+                    "route_name": route["route_name"] if route is not None else sheet_name,
+                    "route_type": route_type,
+                    "itinerary": "" if is_tang_cuong else (route["route_name"] if route is not None else ""),
+                    "date": row_date.isoformat(),
+                    "license_plate": plate,
+                    "driver_name": driver,
+                    "trip_code": str(trip_code).strip() if trip_code is not None else "",
+                    "notes": str(notes).strip() if notes is not None else "",
+                    "status": entry_status,
+                    "distance_km": numbers["distance_km"] or 0,
+                    "unit_price": numbers["unit_price"] or 0,
+                    "bridge_fee": numbers["bridge_fee"] or 0,
+                    "loading_fee": numbers["loading_fee"] or 0,
+                    "total_amount": calculate_timekeeping_total_amount(
+                        entry_status, route_type, numbers["distance_km"], numbers["unit_price"],
+                        numbers["bridge_fee"], numbers["loading_fee"]
+                    )
+                })
+    finally:
+        wb.close()
+    
+    # Sheet trống trong file không được xóa dữ liệu đã lưu của sheet đó
+    entries_by_sheet = {sheet_name: entries for sheet_name, entries in entries_by_sheet.items() if entries}
+    return entries_by_sheet, errors, row_count
+
+@app.post("/api/timekeeping-v1/{table_id}/import-excel")
+async def import_timekeeping_excel(
+    table_id: int,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Import bảng chấm công từ file Excel (cùng bố cục file export).
+    Mỗi sheet có dữ liệu trong file thay thế dữ liệu của sheet tương ứng trong bảng (lưu kiểu diff như API save);
+    sheet trống được bỏ qua.
+    File có dòng lỗi sẽ không được ghi gì: trả về danh sách lỗi theo từng dòng để sửa rồi import lại.
+    """
+    if current_user is None:
+        return JSONResponse({"success": False, "message": "Bạn cần đăng nhập"}, status_code=401)
+    if not check_page_access(current_user["role"], "/timekeeping-v1", current_user["id"], db):
+        return JSONResponse({"success": False, "message": "Không có quyền truy cập"}, status_code=403)
+    
+    table = db.query(TimekeepingTable).filter(TimekeepingTable.id == table_id).first()
+    if not table:
+        return JSONResponse({"success": False, "message": "Không tìm thấy bảng chấm công"}, status_code=404)
+    
+    if not (file.filename or "").lower().endswith(".xlsx"):
+        return JSONResponse({"success": False, "message": "Chỉ chấp nhận file Excel .xlsx"}, status_code=400)
+    
+    references = load_timekeeping_import_references(db, table)
+    try:
+        entries_by_sheet, errors, row_count = await run_in_threadpool(
+            parse_timekeeping_workbook, file.file, table, references
+        )
+    except Exception as e:
+        return JSONResponse({"success": False, "message": f"Không thể đọc file Excel: {str(e)}"}, status_code=400)
+    
+    if errors:
+        return JSONResponse({
+            "success": False,
+            "message": f"File có {len(errors)} lỗi, chưa import dữ liệu nào",
+            "row_count": row_count,
+            "error_count": len(errors),
+            "errors": errors[:TIMEKEEPING_IMPORT_MAX_ERRORS]
+        }, status_code=400)
+    
+    if not entries_by_sheet:
+        return JSONResponse({"success": False, "message": "File không có dòng dữ liệu nào, chưa import dữ liệu nào"}, status_code=400)
+    
+    try:
+        sheet_counts = {}
+        for sheet_name, entries in entries_by_sheet.items():
+            counts = upsert_timekeeping_entries(db, table, "sheet", sheet_name, entries)
+            counts.pop("rows", None)
+            sheet_counts[sheet_name] = counts
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        return JSONResponse({"success": False, "message": f"Lỗi khi import: {str(e)}"}, status_code=500)
+    
+    return JSONResponse({
+        "success": True,
+        "message": f"Đã import {row_count} dòng từ {len(sheet_counts)} sheet",
+        "row_count": row_count,
+        "data": sheet_counts
+    })
+
 @app.delete("/api/timekeeping-v1/{table_id}/delete")
 async def delete_timekeeping_table(
     table_id: int,
@@ -10579,6 +12580,67 @@ async def delete_timekeeping_table(
             "message": f"Lỗi khi xóa bảng chấm công: {str(e)}"
         }, status_code=500)
 
+# ==================== TIMEKEEPING V1 - FILTER ====================
+TIMEKEEPING_FILTER_DEFAULT_LIMIT = 200
+TIMEKEEPING_FILTER_MAX_LIMIT = 1000
+
+# Cột trả về cho kết quả lọc (projection - không hydrate ORM object)
+TIMEKEEPING_FILTER_COLUMNS = [
+    "id", "sheet_name", "route_code", "route_name", "route_type", "itinerary", "date", "license_plate",
+    "driver_name", "trip_code", "notes", "status", "distance_km", "unit_price", "bridge_fee", "loading_fee", "total_amount"
+]
+
+def timekeeping_filter_conditions(
+    table_id: int,
+    driver_name: Optional[str] = None,
+    route_code: Optional[str] = None,
+    license_plate: Optional[str] = None,
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    status: Optional[str] = None
+) -> list:
+    """Điều kiện WHERE dùng chung cho API lọc và xuất Excel kết quả lọc"""
+    conditions = [TimekeepingDetail.table_id == table_id]
+    if driver_name:
+        conditions.append(TimekeepingDetail.driver_name == driver_name)
+    if route_code:
+        conditions.append(TimekeepingDetail.route_code == route_code)
+    if license_plate:
+        conditions.append(TimekeepingDetail.license_plate == license_plate)
+    if from_date:
+        conditions.append(TimekeepingDetail.date >= from_date)
+    if to_date:
+        conditions.append(TimekeepingDetail.date <= to_date)
+    if status == "OFF":
+        conditions.append(TimekeepingDetail.status == "OFF")
+    elif status == "Onl":
+        # Dòng cũ có thể để trống status → coi là Onl
+        conditions.append(or_(TimekeepingDetail.status.is_(None), TimekeepingDetail.status != "OFF"))
+    return conditions
+
+def encode_timekeeping_cursor(route_code: str, row_date: date, row_id: int) -> str:
+    """Cursor keyset (route_code, date, id) của dòng cuối trang, mã hóa base64 để client truyền lại nguyên văn"""
+    import json
+    import base64
+    raw = json.dumps([route_code or "", row_date.isoformat(), row_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_timekeeping_cursor(cursor: str) -> Tuple[str, date, int]:
+    """Giải mã cursor; ValueError nếu cursor không hợp lệ"""
+    import json
+    import base64
+    try:
+        route_code, row_date, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        return str(route_code), datetime.strptime(row_date, "%Y-%m-%d").date(), int(row_id)
+    except Exception:
+        raise ValueError("Cursor không hợp lệ")
+
+def parse_optional_query_date(value: Optional[str]) -> Optional[date]:
+    """Ngày dạng YYYY-MM-DD từ query string; chuỗi rỗng → None, sai định dạng → ValueError"""
+    if not value:
+        return None
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
 @app.get("/api/timekeeping-v1/{table_id}/filter")
 async def filter_timekeeping_data(
     table_id: int,
@@ -10586,68 +12648,129 @@ async def filter_timekeeping_data(
     driver_name: Optional[str] = None,
     route_code: Optional[str] = None,
     license_plate: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = TIMEKEEPING_FILTER_DEFAULT_LIMIT,
     current_user = Depends(get_current_user)
 ):
-    """Lọc dữ liệu chấm công theo các điều kiện"""
+    """
+    Lọc dữ liệu chấm công theo các điều kiện, phân trang keyset theo (route_code, date, id).
+    
+    - Mỗi trang tối đa `limit` dòng; `next_cursor` (nếu còn dữ liệu) truyền lại ở tham số `cursor` để lấy trang sau.
+    - `summary` (số dòng, tổng km, tổng thành tiền của toàn bộ kết quả) tính bằng SQL, chỉ trả ở trang đầu.
+    """
     if current_user is None:
         return JSONResponse({"success": False, "message": "Bạn cần đăng nhập"}, status_code=401)
     if not check_page_access(current_user["role"], "/timekeeping-v1", current_user["id"], db):
         return JSONResponse({"success": False, "message": "Không có quyền truy cập"}, status_code=403)
     
     # Lấy thông tin bảng chấm công
-    table = db.query(TimekeepingTable).filter(TimekeepingTable.id == table_id).first()
+    table = db.query(TimekeepingTable.id).filter(TimekeepingTable.id == table_id).first()
     if not table:
         return JSONResponse({"success": False, "message": "Không tìm thấy bảng chấm công"}, status_code=404)
     
     try:
-        # Xây dựng query filter
-        query = db.query(TimekeepingDetail).filter(TimekeepingDetail.table_id == table_id)
-        
-        if driver_name:
-            query = query.filter(TimekeepingDetail.driver_name == driver_name)
-        
-        if route_code:
-            query = query.filter(TimekeepingDetail.route_code == route_code)
+        filter_from_date = parse_optional_query_date(from_date)
+        filter_to_date = parse_optional_query_date(to_date)
+        cursor_key = decode_timekeeping_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return JSONResponse({"success": False, "message": f"Tham số không hợp lệ: {str(e)}"}, status_code=400)
+    limit = max(1, min(int(limit or TIMEKEEPING_FILTER_DEFAULT_LIMIT), TIMEKEEPING_FILTER_MAX_LIMIT))
+    
+    try:
+        conditions = timekeeping_filter_conditions(
+            table_id, driver_name, route_code, license_plate, filter_from_date, filter_to_date, status
+        )
         
-        if license_plate:
-            query = query.filter(TimekeepingDetail.license_plate == license_plate)
+        # route_code NULL (dữ liệu cũ) được sắp như chuỗi rỗng để keyset không bỏ sót dòng
+        route_key = func.coalesce(TimekeepingDetail.route_code, "")
+        query = db.query(*[getattr(TimekeepingDetail, column) for column in TIMEKEEPING_FILTER_COLUMNS]).filter(*conditions)
+        if cursor_key:
+            query = query.filter(tuple_(route_key, TimekeepingDetail.date, TimekeepingDetail.id) > cursor_key)
+        rows = query.order_by(route_key, TimekeepingDetail.date, TimekeepingDetail.id).limit(limit + 1).all()
         
-        # Lấy dữ liệu và sắp xếp theo route_code
-        details = query.order_by(TimekeepingDetail.route_code, TimekeepingDetail.date).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
         
-        # Chuyển đổi sang dictionary
         result_data = []
-        for detail in details:
+        for row in rows:
             result_data.append({
-                "sheet_name": detail.sheet_name or "",
-                "route_code": detail.route_code or "",
-                "route_name": detail.route_name or "",
-                "route_type": detail.route_type or "",
-                "itinerary": detail.itinerary or "",
-                "date": detail.date.isoformat() if detail.date else "",
-                "license_plate": detail.license_plate or "",
-                "driver_name": detail.driver_name or "",
-                "trip_code": detail.trip_code or "",
-                "notes": detail.notes or "",
-                "status": detail.status or "Onl",
-                "distance_km": detail.distance_km or 0,
-                "unit_price": detail.unit_price or 0,
-                "bridge_fee": detail.bridge_fee or 0,
-                "loading_fee": detail.loading_fee or 0,
-                "total_amount": detail.total_amount or 0
+                "id": row.id,
+                "sheet_name": row.sheet_name or "",
+                "route_code": row.route_code or "",
+                "route_name": row.route_name or "",
+                "route_type": row.route_type or "",
+                "itinerary": row.itinerary or "",
+                "date": row.date.isoformat() if row.date else "",
+                "license_plate": row.license_plate or "",
+                "driver_name": row.driver_name or "",
+                "trip_code": row.trip_code or "",
+                "notes": row.notes or "",
+                "status": row.status or "Onl",
+                "distance_km": row.distance_km or 0,
+                "unit_price": row.unit_price or 0,
+                "bridge_fee": row.bridge_fee or 0,
+                "loading_fee": row.loading_fee or 0,
+                "total_amount": row.total_amount or 0
             })
         
-        return JSONResponse({
+        response = {
             "success": True,
             "data": result_data,
-            "count": len(result_data)
-        })
+            "count": len(result_data),
+            "has_more": has_more,
+            "next_cursor": encode_timekeeping_cursor(rows[-1].route_code, rows[-1].date, rows[-1].id) if has_more else None
+        }
+        
+        if not cursor_key:
+            total_count, total_distance, total_amount, off_count = db.query(
+                func.count(TimekeepingDetail.id),
+                func.coalesce(func.sum(TimekeepingDetail.distance_km), 0),
+                func.coalesce(func.sum(TimekeepingDetail.total_amount), 0),
+                func.coalesce(func.sum(case((TimekeepingDetail.status == "OFF", 1), else_=0)), 0)
+            ).filter(*conditions).one()
+            response["summary"] = {
+                "total_count": total_count,
+                "total_distance_km": total_distance,
+                "total_amount": total_amount,
+                "off_count": off_count
+            }
+        
+        return JSONResponse(response)
     except Exception as e:
         return JSONResponse({
             "success": False,
             "message": f"Lỗi khi lọc dữ liệu: {str(e)}"
         }, status_code=500)
 
+@app.get("/api/timekeeping-v1/{table_id}/filter-options")
+async def get_timekeeping_filter_options(
+    table_id: int,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """Danh sách lái xe / mã tuyến / biển số có trong bảng chấm công (DISTINCT trong SQL) cho dropdown bộ lọc"""
+    if current_user is None:
+        return JSONResponse({"success": False, "message": "Bạn cần đăng nhập"}, status_code=401)
+    if not check_page_access(current_user["role"], "/timekeeping-v1", current_user["id"], db):
+        return JSONResponse({"success": False, "message": "Không có quyền truy cập"}, status_code=403)
+    
+    def distinct_values(column):
+        return [
+            value for (value,) in db.query(column).filter(
+                TimekeepingDetail.table_id == table_id, column.isnot(None), column != ""
+            ).distinct().order_by(column).all()
+        ]
+    
+    return JSONResponse({
+        "success": True,
+        "drivers": distinct_values(TimekeepingDetail.driver_name),
+        "route_codes": distinct_values(TimekeepingDetail.route_code),
+        "license_plates": distinct_values(TimekeepingDetail.license_plate)
+    })
+
 @app.get("/api/timekeeping-v1/{table_id}/export-filtered-excel")
 async def export_filtered_timekeeping_excel(
     table_id: int,
@@ -10655,6 +12778,9 @@ async def export_filtered_timekeeping_excel(
     driver_name: Optional[str] = None,
     route_code: Optional[str] = None,
     license_plate: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    status: Optional[str] = None,
     current_user = Depends(get_current_user)
 ):
     """Xuất Excel dữ liệu chấm công đã được lọc"""
@@ -10670,19 +12796,15 @@ async def export_filtered_timekeeping_excel(
     
     try:
         # Xây dựng query filter (giống như endpoint filter)
-        query = db.query(TimekeepingDetail).filter(TimekeepingDetail.table_id == table_id)
-        
-        if driver_name:
-            query = query.filter(TimekeepingDetail.driver_name == driver_name)
-        
-        if route_code:
-            query = query.filter(TimekeepingDetail.route_code == route_code)
-        
-        if license_plate:
-            query = query.filter(TimekeepingDetail.license_plate == license_plate)
+        conditions = timekeeping_filter_conditions(
+            table_id, driver_name, route_code, license_plate,
+            parse_optional_query_date(from_date), parse_optional_query_date(to_date), status
+        )
         
         # Lấy dữ liệu và sắp xếp theo route_code
-        details = query.order_by(TimekeepingDetail.route_code, TimekeepingDetail.date).all()
+        details = db.query(TimekeepingDetail).filter(*conditions).order_by(
+            TimekeepingDetail.route_code, TimekeepingDetail.date, TimekeepingDetail.id
+        ).all()
         
         # Tạo workbook Excel
         wb = Workbook()
@@ -10921,9 +13043,9 @@ async def statistics_finance_page(
     
     # Áp dụng các bộ lọc khác
     if route_code:
-        revenue_query = revenue_query.filter(Route.route_code.ilike(f"%{route_code}%"))
+        revenue_query = revenue_query.filter(Route.route_code_key.contains(normalize_key(route_code), autoescape=True))
     if license_plate:
-        revenue_query = revenue_query.filter(RevenueRecord.license_plate.ilike(f"%{license_plate}%"))
+        revenue_query = revenue_query.filter(RevenueRecord.license_plate_key.contains(normalize_key(license_plate), autoescape=True))
     
     revenue_records = revenue_query.all()
     
@@ -11005,7 +13127,7 @@ async def statistics_finance_details(
     
     # Áp dụng bộ lọc mã tuyến (bắt buộc)
     if route_code:
-        revenue_query = revenue_query.filter(Route.route_code.ilike(f"%{route_code}%"))
+        revenue_query = revenue_query.filter(Route.route_code_key.contains(normalize_key(route_code), autoescape=True))
     else:
         return JSONResponse(
             status_code=400,
@@ -11026,7 +13148,7 @@ async def statistics_finance_details(
     
     # Áp dụng bộ lọc biển số xe
     if license_plate:
-        revenue_query = revenue_query.filter(RevenueRecord.license_plate.ilike(f"%{license_plate}%"))
+        revenue_query = revenue_query.filter(RevenueRecord.license_plate_key.contains(normalize_key(license_plate), autoescape=True))
     
     revenue_records = revenue_query.order_by(RevenueRecord.date.desc()).all()
     
@@ -11122,9 +13244,13 @@ async def administrative_page(
     if status and status in ["active", "expired", "archived"]:
         query = query.filter(Document.status == status)
     
-    # Search by title (case-insensitive for SQLite)
+    # Search by title/description/notes (FTS5, không phân biệt dấu); chưa có search_fts thì LIKE theo title
     if search:
-        query = query.filter(Document.title.like(f"%{search}%"))
+        search_ids = search_entity_ids(db, "document", search)
+        if search_ids is not None:
+            query = query.filter(Document.id.in_(search_ids))
+        else:
+            query = query.filter(Document.title.like(f"%{search}%"))
     
     # Filter by date range (issued_date)
     if date_from:
@@ -11179,7 +13305,7 @@ async def administrative_page(
     document_types_list = [dt[0] for dt in document_types if dt[0]]
     
     # Get employees for dropdown (for administrative documents)
-    employees = db.query(Employee).filter(Employee.status == 1).order_by(Employee.name).all()
+    employees = get_active_employees(db, order_by_name=True)
     
     return templates.TemplateResponse("administrative.html", {
         "request": request,
@@ -11214,6 +13340,9 @@ async def get_documents_api(
     current_user = Depends(get_current_user)
 ):
     """API: Lấy danh sách documents"""
+    etag = versioned_etag(request, db, "documents")
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
     
     try:
         query = db.query(Document)
@@ -11248,7 +13377,7 @@ async def get_documents_api(
                 "created_at": doc.created_at.isoformat() if doc.created_at else None
             })
         
-        return JSONResponse({"success": True, "data": result})
+        return with_etag(JSONResponse({"success": True, "data": result}), etag)
     except Exception as e:
         return JSONResponse({"success": False, "message": str(e)}, status_code=500)
 
@@ -11439,9 +13568,14 @@ async def assign_user_roles(
 
 @app.get("/api/roles", response_class=JSONResponse)
 async def get_roles_api(
+    request: Request,
     db: Session = Depends(get_db)
 ):
     """API: Lấy danh sách roles"""
+    etag = versioned_etag(request, db, "roles")
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    
     try:
         roles = db.query(Role).all()
         result = [{
@@ -11451,7 +13585,7 @@ async def get_roles_api(
             "is_system_role": bool(r.is_system_role),
             "created_at": r.created_at.isoformat() if r.created_at else None
         } for r in roles]
-        return JSONResponse({"success": True, "data": result})
+        return with_etag(JSONResponse({"success": True, "data": result}), etag)
     except Exception as e:
         return JSONResponse({"success": False, "message": str(e)}, status_code=500)
 
@@ -11703,9 +13837,13 @@ async def administrative_page(
     if status and status in ["active", "expired", "archived"]:
         query = query.filter(Document.status == status)
     
-    # Search by title (case-insensitive for SQLite)
+    # Search by title/description/notes (FTS5, không phân biệt dấu); chưa có search_fts thì LIKE theo title
     if search:
-        query = query.filter(Document.title.like(f"%{search}%"))
+        search_ids = search_entity_ids(db, "document", search)
+        if search_ids is not None:
+            query = query.filter(Document.id.in_(search_ids))
+        else:
+            query = query.filter(Document.title.like(f"%{search}%"))
     
     # Filter by date range (issued_date)
     if date_from:
@@ -11760,7 +13898,7 @@ async def administrative_page(
     document_types_list = [dt[0] for dt in document_types if dt[0]]
     
     # Get employees for dropdown (for administrative documents)
-    employees = db.query(Employee).filter(Employee.status == 1).order_by(Employee.name).all()
+    employees = get_active_employees(db, order_by_name=True)
     
     return templates.TemplateResponse("administrative.html", {
         "request": request,
@@ -11795,6 +13933,9 @@ async def get_documents_api(
     current_user = Depends(get_current_user)
 ):
     """API: Lấy danh sách documents"""
+    etag = versioned_etag(request, db, "documents")
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
     
     try:
         query = db.query(Document)
@@ -11833,7 +13974,127 @@ async def get_documents_api(
                 "creator_name": doc.creator.username if doc.creator else None
             })
         
-        return JSONResponse({"success": True, "data": result})
+        return with_etag(JSONResponse({"success": True, "data": result}), etag)
+    except Exception as e:
+        return JSONResponse({"success": False, "message": str(e)}, status_code=500)
+
+@app.get("/api/alerts/expiries", response_class=JSONResponse)
+async def get_expiry_alerts_api(
+    request: Request,
+    days: int = 30,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """API: Giấy tờ đã/sắp hết hạn (đăng kiểm, phù hiệu, bằng lái, CCCD, tài liệu) trong `days` ngày tới, đọc từ expiry_index"""
+    if current_user is None:
+        return JSONResponse({"success": False, "message": "Bạn cần đăng nhập"}, status_code=401)
+    # Chỉ trả giấy tờ của loại dữ liệu user được xem (CCCD/bằng lái nhân viên, xe, tài liệu hành chính)
+    allowed_types = sorted(viewable_entity_types(db, current_user) & set(EXPIRY_SOURCES))
+    if not allowed_types:
+        return JSONResponse({"success": False, "message": "Không có quyền truy cập"}, status_code=403)
+    if days < 0 or days > 365:
+        return JSONResponse({"success": False, "message": "days phải trong khoảng 0-365"}, status_code=400)
+    
+    today = date.today()
+    # Kết quả phụ thuộc ngày hiện tại và quyền của user nên đưa vào ETag
+    etag = versioned_etag(request, db, "vehicles", "employees", "documents", extra=f"{today.isoformat()}|{','.join(allowed_types)}")
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    
+    try:
+        counts = db.query(
+            func.sum(case((ExpiryEntry.expiry_date < today, 1), else_=0)),
+            *[
+                func.sum(case((ExpiryEntry.expiry_date.between(today, today + timedelta(days=horizon)), 1), else_=0))
+                for horizon in EXPIRY_HORIZONS
+            ]
+        ).filter(ExpiryEntry.entity_type.in_(allowed_types)).one()
+        
+        entries = db.query(ExpiryEntry).filter(
+            ExpiryEntry.entity_type.in_(allowed_types),
+            ExpiryEntry.expiry_date <= today + timedelta(days=days)
+        ).order_by(ExpiryEntry.expiry_date, ExpiryEntry.entity_type, ExpiryEntry.entity_id).all()
+        
+        expired, upcoming = [], []
+        for entry in entries:
+            item = {
+                "entity_type": entry.entity_type,
+                "entity_id": entry.entity_id,
+                "field": entry.field,
+                "field_label": EXPIRY_FIELD_LABELS.get(entry.field, entry.field),
+                "label": entry.label,
+                "expiry_date": entry.expiry_date.isoformat(),
+                "days_left": (entry.expiry_date - today).days
+            }
+            (expired if entry.expiry_date < today else upcoming).append(item)
+        
+        return with_etag(JSONResponse({
+            "success": True,
+            "days": days,
+            "counts": {
+                "expired": counts[0] or 0,
+                **{f"within_{horizon}_days": count or 0 for horizon, count in zip(EXPIRY_HORIZONS, counts[1:])}
+            },
+            "expired": expired,
+            "upcoming": upcoming
+        }), etag)
+    except Exception as e:
+        return JSONResponse({"success": False, "message": str(e)}, status_code=500)
+
+@app.get("/api/search", response_class=JSONResponse)
+async def search_api(
+    q: str = "",
+    types: Optional[str] = None,
+    limit: int = 20,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """API: Tìm kiếm toàn văn (không phân biệt dấu) trên tài liệu, nhân viên, biển số xe và tuyến, xếp hạng theo bm25"""
+    if current_user is None:
+        return JSONResponse({"success": False, "message": "Bạn cần đăng nhập"}, status_code=401)
+    entity_types = [t.strip() for t in types.split(",") if t.strip()] if types else None
+    if entity_types and any(t not in SEARCH_SOURCES for t in entity_types):
+        return JSONResponse({"success": False, "message": f"types chỉ gồm: {', '.join(SEARCH_SOURCES)}"}, status_code=400)
+    # Bỏ các loại dữ liệu user không được xem
+    allowed_types = viewable_entity_types(db, current_user)
+    if not allowed_types & set(SEARCH_SOURCES):
+        return JSONResponse({"success": False, "message": "Không có quyền truy cập"}, status_code=403)
+    entity_types = [t for t in (entity_types or SEARCH_SOURCES) if t in allowed_types]
+    if not entity_types:
+        return JSONResponse({"success": True, "query": q, "data": []})
+    if limit < 1 or limit > 100:
+        return JSONResponse({"success": False, "message": "limit phải trong khoảng 1-100"}, status_code=400)
+    if not has_search_index(db):
+        return JSONResponse({"success": False, "message": "Chưa có chỉ mục tìm kiếm, hãy chạy scripts/init_db.py"}, status_code=503)
+    
+    try:
+        hits = search_index_hits(db, q, entity_types, limit)
+        
+        # Lấy tên gốc (có dấu) từ bảng nguồn, mỗi loại một query
+        models = {"document": (Document, "title", "/administrative"), "employee": (Employee, "name", "/employees"),
+                  "vehicle": (Vehicle, "license_plate", "/vehicles"), "route": (Route, "route_code", "/routes")}
+        originals = {}
+        for entity_type in {entity_type for entity_type, _, _ in hits}:
+            model, _, _ = models[entity_type]
+            ids = [entity_id for hit_type, entity_id, _ in hits if hit_type == entity_type]
+            originals.update({(entity_type, obj.id): obj for obj in db.query(model).filter(model.id.in_(ids)).all()})
+        
+        results = []
+        for entity_type, entity_id, score in hits:
+            obj = originals.get((entity_type, entity_id))
+            if obj is None:
+                continue
+            _, title_attr, page_url = models[entity_type]
+            results.append({
+                "entity_type": entity_type,
+                "entity_id": entity_id,
+                "title": getattr(obj, title_attr),
+                "subtitle": obj.route_name if entity_type == "route" else None,
+                "url": page_url,
+                "score": round(-score, 4)
+            })
+        
+        return JSONResponse({"success": True, "query": q, "data": results})
     except Exception as e:
         return JSONResponse({"success": False, "message": str(e)}, status_code=500)
 
@@ -11905,22 +14166,13 @@ async def create_document(
         if not is_valid:
             return JSONResponse({"success": False, "message": error_msg}, status_code=400)
         
-        # Validate file size (10MB limit)
-        MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-        file_content = await file.read()
-        file_size = len(file_content)
-        if file_size > MAX_FILE_SIZE:
-            return JSONResponse({"success": False, "message": f"File size exceeds 10MB limit. File size: {(file_size / 1024 / 1024):.2f}MB"}, status_code=400)
-        
-        # Reset file pointer for saving
-        await file.seek(0)
-        
         # Ensure directories exist
         ensure_document_dirs()
         
         # Determine folder based on category and document type
         folder = get_document_category_folder(category, document_type)
-        category_dir = os.path.join(DOCUMENTS_UPLOAD_DIR, folder)
+        # Ghi theo BASE_DIR như resolve_document_path đọc; DB lưu relative path từ root project
+        category_dir = os.path.join(BASE_DIR, DOCUMENTS_UPLOAD_DIR, folder)
         ensure_directory_exists(category_dir)
         
         # Generate unique filename while preserving original name
@@ -11934,12 +14186,14 @@ async def create_document(
         safe_filename = f"{safe_original_name}_{timestamp}{file_ext}"
         file_path = os.path.join(category_dir, safe_filename)
         
-        # Save file (reuse content already read for size validation)
-        with open(file_path, "wb") as buffer:
-            buffer.write(file_content)
+        # Save file in chunks (10MB limit enforced while streaming)
+        try:
+            await stream_upload_to_disk(file, file_path, MAX_DOCUMENT_SIZE)
+        except UploadTooLargeError:
+            return JSONResponse({"success": False, "message": "File size exceeds 10MB limit"}, status_code=400)
         
         # Relative path for database
-        relative_path = file_path.replace("\\", "/")
+        relative_path = "/".join((DOCUMENTS_UPLOAD_DIR, folder, safe_filename))
         
         # Parse dates
         issued_date_obj = None
@@ -12072,23 +14326,22 @@ async def update_document(
             if not is_valid:
                 return JSONResponse({"success": False, "message": error_msg}, status_code=400)
             
-            # Validate file size (10MB limit)
-            MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-            file_content = await file.read()
-            file_size = len(file_content)
-            if file_size > MAX_FILE_SIZE:
+            # Validate file size (10MB limit) trước khi xóa file cũ
+            file_size = upload_file_size(file)
+            if file_size > MAX_DOCUMENT_SIZE:
                 return JSONResponse({"success": False, "message": f"File size exceeds 10MB limit. File size: {(file_size / 1024 / 1024):.2f}MB"}, status_code=400)
             
             # Delete old file
-            if document.file_path and os.path.exists(document.file_path):
+            old_file_path = resolve_document_path(document.file_path)
+            if old_file_path:
                 try:
-                    os.remove(document.file_path)
+                    os.remove(old_file_path)
                 except Exception:
                     pass
             
             # Save new file
             folder = get_document_category_folder(document.category, document.document_type)
-            category_dir = os.path.join(DOCUMENTS_UPLOAD_DIR, folder)
+            category_dir = os.path.join(BASE_DIR, DOCUMENTS_UPLOAD_DIR, folder)
             ensure_directory_exists(category_dir)
             
             timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
@@ -12100,10 +14353,9 @@ async def update_document(
             safe_filename = f"{safe_original_name}_{timestamp}{file_ext}"
             file_path = os.path.join(category_dir, safe_filename)
             
-            with open(file_path, "wb") as buffer:
-                buffer.write(file_content)
+            await stream_upload_to_disk(file, file_path, MAX_DOCUMENT_SIZE)
             
-            document.file_path = file_path.replace("\\", "/")
+            document.file_path = "/".join((DOCUMENTS_UPLOAD_DIR, folder, safe_filename))
         
         # Update status based on expiry date
         if document.expiry_date and document.expiry_date < date.today():
@@ -12152,9 +14404,10 @@ async def delete_document(
             return JSONResponse({"success": False, "message": "Document not found"}, status_code=404)
         
         # Delete file
-        if document.file_path and os.path.exists(document.file_path):
+        full_path = resolve_document_path(document.file_path)
+        if full_path:
             try:
-                os.remove(document.file_path)
+                os.remove(full_path)
             except Exception as e:
                 print(f"Error deleting file: {e}")
         
@@ -12193,7 +14446,8 @@ async def view_document(
         if not document:
             return HTMLResponse("<h1>Document not found</h1>", status_code=404)
         
-        if not os.path.exists(document.file_path):
+        full_path = resolve_document_path(document.file_path)
+        if not full_path:
             return HTMLResponse("<h1>File not found on server</h1>", status_code=404)
         
         file_ext = os.path.splitext(document.file_path)[1].lower()
@@ -12343,12 +14597,7 @@ async def view_document(
             return HTMLResponse(html_content)
         # For PDF, serve inline
         elif file_ext == ".pdf":
-            from fastapi.responses import FileResponse
-            return FileResponse(
-                document.file_path,
-                media_type="application/pdf",
-                headers={"Content-Disposition": "inline"}
-            )
+            return document_file_response(request, full_path, "application/pdf", "inline")
         else:
             # For DOC/DOCX, redirect to download
             return RedirectResponse(url=f"/documents/download/{document_id}", status_code=303)
@@ -12369,27 +14618,14 @@ async def get_document_file(
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        if not os.path.exists(document.file_path):
+        full_path = resolve_document_path(document.file_path)
+        if not full_path:
             raise HTTPException(status_code=404, detail="File not found on server")
         
-        from fastapi.responses import FileResponse
-        
         file_ext = os.path.splitext(document.file_path)[1].lower()
-        media_types = {
-            ".pdf": "application/pdf",
-            ".doc": "application/msword",
-            ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            ".jpg": "image/jpeg",
-            ".jpeg": "image/jpeg",
-            ".png": "image/png"
-        }
-        media_type = media_types.get(file_ext, "application/octet-stream")
+        media_type = DOCUMENT_MEDIA_TYPES.get(file_ext, "application/octet-stream")
         
-        return FileResponse(
-            document.file_path,
-            media_type=media_type,
-            headers={"Content-Disposition": "inline"}
-        )
+        return document_file_response(request, full_path, media_type, "inline")
     
     except HTTPException:
         raise
@@ -12409,21 +14645,12 @@ async def download_document(
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        if not os.path.exists(document.file_path):
+        full_path = resolve_document_path(document.file_path)
+        if not full_path:
             raise HTTPException(status_code=404, detail="File not found on server")
         
-        from fastapi.responses import FileResponse
-        
         file_ext = os.path.splitext(document.file_path)[1].lower()
-        media_types = {
-            ".pdf": "application/pdf",
-            ".doc": "application/msword",
-            ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            ".jpg": "image/jpeg",
-            ".jpeg": "image/jpeg",
-            ".png": "image/png"
-        }
-        media_type = media_types.get(file_ext, "application/octet-stream")
+        media_type = DOCUMENT_MEDIA_TYPES.get(file_ext, "application/octet-stream")
         
         # Get original filename from file_path or use title
         filename = os.path.basename(document.file_path)
@@ -12438,11 +14665,7 @@ async def download_document(
         encoded_filename = quote(filename, safe='')
         content_disposition = f'attachment; filename*=UTF-8\'\'{encoded_filename}'
         
-        return FileResponse(
-            document.file_path,
-            media_type=media_type,
-            headers={"Content-Disposition": content_disposition}
-        )
+        return document_file_response(request, full_path, media_type, content_disposition)
     
     except HTTPException:
         raise
@@ -32,6 +32,17 @@ def parse_json_field(value):
         # Not valid JSON, treat as plain string
         return [value] if value else []
 
+def file_metadata(cursor, file_path, has_stored_files):
+    """(file_size, sha256) of an attachment; sha256 only for files already in the content-addressed store"""
+    disk_path = file_path if file_path.startswith('Picture/') else f'static/uploads/{file_path}'
+    file_size = os.path.getsize(disk_path) if os.path.isfile(disk_path) else None
+    sha256 = None
+    if has_stored_files:
+        cursor.execute("SELECT sha256 FROM stored_files WHERE path = ?", (disk_path,))
+        row = cursor.fetchone()
+        sha256 = row[0] if row else None
+    return file_size, sha256
+
 def migrate_attachments(db_path='transport.db'):
     """Migrate file attachments from JSON strings to attachments_v2"""
     
@@ -50,6 +61,9 @@ def migrate_attachments(db_path='transport.db'):
         conn.close()
         return False
     
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='stored_files'")
+    has_stored_files = cursor.fetchone() is not None
+    
     migrated_count = 0
     
     # Migrate vehicle inspection_documents
@@ -70,11 +84,12 @@ def migrate_attachments(db_path='transport.db'):
             """, (vehicle_id, file_path))
             if cursor.fetchone()[0] == 0:
                 file_name = extract_filename(file_path)
+                file_size, sha256 = file_metadata(cursor, file_path, has_stored_files)
                 cursor.execute("""
                     INSERT INTO attachments_v2 
-                    (entity_type, entity_id, file_path, file_name, file_type, uploaded_at)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, ('vehicle', vehicle_id, file_path, file_name, 'inspection', created_at))
+                    (entity_type, entity_id, file_path, file_name, file_size, file_type, sha256, uploaded_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, ('vehicle', vehicle_id, file_path, file_name, file_size, 'inspection', sha256, created_at))
                 migrated_count += 1
     
     print(f"   Migrated {migrated_count} inspection documents")
@@ -97,11 +112,12 @@ def migrate_attachments(db_path='transport.db'):
             """, (vehicle_id, file_path))
             if cursor.fetchone()[0] == 0:
                 file_name = extract_filename(file_path)
+                file_size, sha256 = file_metadata(cursor, file_path, has_stored_files)
                 cursor.execute("""
                     INSERT INTO attachments_v2 
-                    (entity_type, entity_id, file_path, file_name, file_type, uploaded_at)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, ('vehicle', vehicle_id, file_path, file_name, 'phu_hieu', created_at))
+                    (entity_type, entity_id, file_path, file_name, file_size, file_type, sha256, uploaded_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, ('vehicle', vehicle_id, file_path, file_name, file_size, 'phu_hieu', sha256, created_at))
                 phu_hieu_count += 1
     
     print(f"   Migrated {phu_hieu_count} phu_hieu files")
@@ -125,11 +141,12 @@ def migrate_attachments(db_path='transport.db'):
             """, (employee_id, file_path))
             if cursor.fetchone()[0] == 0:
                 file_name = extract_filename(file_path)
+                file_size, sha256 = file_metadata(cursor, file_path, has_stored_files)
                 cursor.execute("""
                     INSERT INTO attachments_v2 
-                    (entity_type, entity_id, file_path, file_name, file_type, uploaded_at)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, ('employee', employee_id, file_path, file_name, 'document', created_at))
+                    (entity_type, entity_id, file_path, file_name, file_size, file_type, sha256, uploaded_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, ('employee', employee_id, file_path, file_name, file_size, 'document', sha256, created_at))
                 employee_count += 1
     
     print(f"   Migrated {employee_count} employee documents")
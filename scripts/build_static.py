@@ -0,0 +1,90 @@
+"""
+Sinh sẵn biến thể nén (.gz, và .br nếu cài package brotli) cho file text trong static/.
+
+CachedStaticFiles trong main.py sẽ trả biến thể này khi client gửi Accept-Encoding phù hợp.
+Chạy lại sau mỗi lần deploy/sửa CSS/JS; biến thể cũ hơn file gốc sẽ bị bỏ qua khi phục vụ.
+
+Ví dụ:
+    python scripts/build_static.py
+    python scripts/build_static.py --clean
+"""
+import sys
+import os
+import gzip
+import argparse
+
+# Adds the project root to sys.path so we can import from main
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if path not in sys.path:
+    sys.path.insert(0, path)
+
+# Script không render template nên bỏ qua bước warm-up
+os.environ.setdefault("TEMPLATE_WARMUP", "0")
+
+from main import STATIC_DIR, COMPRESSIBLE_STATIC_EXTENSIONS, PRECOMPRESSED_ENCODINGS
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def build(static_dir: str):
+    written = skipped = 0
+    for root, _, files in os.walk(static_dir):
+        for name in files:
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_STATIC_EXTENSIONS:
+                continue
+            source = os.path.join(root, name)
+            with open(source, "rb") as f:
+                data = f.read()
+            source_mtime = os.stat(source).st_mtime_ns
+            for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+                if encoding == "br" and brotli is None:
+                    continue
+                target = source + suffix
+                if os.path.exists(target) and os.stat(target).st_mtime_ns >= source_mtime:
+                    skipped += 1
+                    continue
+                compressed = compress(data, encoding)
+                # Không lợi gì thì không ghi, server sẽ trả file gốc
+                if len(compressed) >= len(data):
+                    if os.path.exists(target):
+                        os.remove(target)
+                    continue
+                with open(target, "wb") as f:
+                    f.write(compressed)
+                written += 1
+                print(f"{os.path.relpath(target, static_dir)}: {len(data)} -> {len(compressed)} bytes")
+    return written, skipped
+
+
+def clean(static_dir: str):
+    removed = 0
+    suffixes = tuple(suffix for _, suffix in PRECOMPRESSED_ENCODINGS)
+    for root, _, files in os.walk(static_dir):
+        for name in files:
+            if name.endswith(suffixes) and os.path.splitext(name[:name.rfind(".")])[1].lower() in COMPRESSIBLE_STATIC_EXTENSIONS:
+                os.remove(os.path.join(root, name))
+                removed += 1
+    return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sinh biến thể .gz/.br cho file tĩnh")
+    parser.add_argument("--clean", action="store_true", help="Xóa các biến thể đã sinh")
+    args = parser.parse_args()
+
+    if args.clean:
+        print(f"Removed {clean(STATIC_DIR)} file(s)")
+    else:
+        if brotli is None:
+            print("brotli chưa được cài, chỉ sinh .gz")
+        written, skipped = build(STATIC_DIR)
+        print(f"Done: {written} written, {skipped} up to date")
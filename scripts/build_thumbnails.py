@@ -0,0 +1,64 @@
+"""
+Sinh ảnh thu nhỏ (thumb/medium) cho ảnh giấy tờ đã upload trước khi có pipeline thumbnail.
+
+Quét Picture/ và static/uploads/ (path cũ), bỏ qua các thư mục thumbs/.
+Ảnh đã có thumbnail mới hơn file gốc sẽ được bỏ qua, nên chạy lại nhiều lần vẫn an toàn.
+
+Ví dụ:
+    python scripts/build_thumbnails.py
+    python scripts/build_thumbnails.py --force
+"""
+import sys
+import os
+import argparse
+import time
+
+# Adds the project root to sys.path so we can import from main
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if path not in sys.path:
+    sys.path.insert(0, path)
+
+# Script không render template nên bỏ qua bước warm-up
+os.environ.setdefault("TEMPLATE_WARMUP", "0")
+
+from main import (
+    PICTURE_BASE_DIR, THUMBNAIL_DIR_NAME, THUMBNAIL_SOURCE_EXTENSIONS,
+    generate_thumbnails,
+)
+
+SOURCE_DIRS = [PICTURE_BASE_DIR, "static/uploads"]
+
+
+def iter_source_images():
+    for base_dir in SOURCE_DIRS:
+        for root, dirs, files in os.walk(base_dir):
+            # Không sinh thumbnail của thumbnail
+            dirs[:] = [d for d in dirs if d != THUMBNAIL_DIR_NAME]
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in THUMBNAIL_SOURCE_EXTENSIONS:
+                    yield os.path.join(root, name).replace("\\", "/")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sinh ảnh thu nhỏ cho ảnh giấy tờ đã upload")
+    parser.add_argument("--force", action="store_true", help="Sinh lại kể cả khi thumbnail đã có")
+    args = parser.parse_args()
+
+    # Path trong DB là relative từ root project
+    os.chdir(path)
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        print("Chưa cài Pillow (pip install Pillow), không thể tạo thumbnail")
+        sys.exit(1)
+
+    started = time.perf_counter()
+    processed = failed = 0
+    for file_path in iter_source_images():
+        try:
+            generate_thumbnails(file_path, force=args.force)
+            processed += 1
+        except Exception as e:
+            failed += 1
+            print(f"Lỗi {file_path}: {e}")
+    print(f"Done: {processed} image(s), {failed} error(s) in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,101 @@
+"""
+Chuyển file đính kèm đã upload (Picture/... theo timestamp và static/uploads/ kiểu cũ) vào kho
+content-addressed Picture/blobs/, gộp các bản trùng nội dung và ghi ref_count vào stored_files.
+
+Cập nhật attachments_v2 (và cột JSON tương thích của nhân viên/xe) sang path blob; file gốc chỉ
+bị xóa sau khi commit thành công. Dòng trỏ tới file không tồn tại được giữ nguyên.
+Chạy scripts/init_db.py trước để dữ liệu từ các cột JSON cũ đã có trong attachments_v2.
+
+Ví dụ:
+    python scripts/dedupe_uploads.py --dry-run
+    python scripts/dedupe_uploads.py
+"""
+import sys
+import os
+import shutil
+import argparse
+
+# Adds the project root to sys.path so we can import from main
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if path not in sys.path:
+    sys.path.insert(0, path)
+
+# Script không render template nên bỏ qua bước warm-up
+os.environ.setdefault("TEMPLATE_WARMUP", "0")
+
+from main import (
+    SessionLocal, Attachment, BLOB_DIR, ATTACHMENT_JSON_COLUMNS,
+    attachment_disk_path, blob_file_path, hash_upload, acquire_stored_file,
+    generate_thumbnails, delete_file_if_exists, sync_attachment_json,
+)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gộp file upload trùng nội dung vào kho content-addressed")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ thống kê, không ghi DB/đĩa")
+    args = parser.parse_args()
+
+    # Path trong DB là relative từ root project
+    os.chdir(path)
+    blob_prefix = BLOB_DIR.replace("\\", "/") + "/"
+
+    db = SessionLocal()
+    hashes = {}  # source path -> (size, sha256)
+    unique_blobs = {}  # sha256 -> (blob path, size)
+    migrated_sources = set()
+    touched_entities = set()  # (entity_type, entity_id, kind)
+    references = 0
+    bytes_before = 0
+    try:
+        attachments = db.query(Attachment).filter(
+            ~Attachment.file_path.startswith(blob_prefix)
+        ).order_by(Attachment.id).all()
+        for attachment in attachments:
+            source = attachment_disk_path(attachment.file_path)
+            if not os.path.isfile(source):
+                continue
+            if source not in hashes:
+                with open(source, "rb") as f:
+                    hashes[source] = hash_upload(f, max_size=0)
+            size, sha256 = hashes[source]
+            references += 1
+            bytes_before += size
+            target = unique_blobs.setdefault(sha256, (blob_file_path(sha256, os.path.splitext(source)[1].lower()), size))[0]
+            migrated_sources.add(source)
+
+            if args.dry_run:
+                continue
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy2(source, target)
+                try:
+                    generate_thumbnails(target)
+                except Exception as e:
+                    print(f"Lỗi khi tạo ảnh thu nhỏ cho {target}: {e}")
+            attachment.file_path = acquire_stored_file(db, sha256, target, size)
+            attachment.file_size = size
+            attachment.sha256 = sha256
+            touched_entities.add((attachment.entity_type, attachment.entity_id, attachment.file_type))
+
+        bytes_after = sum(size for _, size in unique_blobs.values())
+        print(f"{references} reference(s) -> {len(unique_blobs)} blob(s); "
+              f"{bytes_before / 1024 / 1024:.1f}MB -> {bytes_after / 1024 / 1024:.1f}MB")
+
+        if args.dry_run:
+            db.rollback()
+        else:
+            for entity_type, entity_id, kind in touched_entities:
+                model, _ = ATTACHMENT_JSON_COLUMNS[(entity_type, kind)]
+                entity = db.get(model, entity_id)
+                if entity:
+                    sync_attachment_json(db, entity, entity_type, kind)
+            db.commit()
+            # File gốc đã được thay bằng blob, xóa sau khi commit thành công
+            for source in migrated_sources:
+                delete_file_if_exists(source)
+            print(f"Removed {len(migrated_sources)} original file(s)")
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,75 @@
+"""
+Dọn file mồ côi trong Picture/, static/uploads/ và uploads/documents/ và báo cáo dung lượng theo nhóm.
+
+File không còn được DB tham chiếu (attachments_v2, cột JSON giấy tờ của nhân viên/xe, stored_files,
+documents.file_path) được chuyển vào .storage_quarantine/<timestamp>/ thay vì xóa ngay; các lô cách ly
+cũ hơn --purge-days ngày mới bị xóa hẳn. File mới ghi trong --grace-hours giờ gần nhất luôn được giữ
+(có thể thuộc upload chưa commit). Có thể chạy định kỳ (Scheduled task trên PythonAnywhere).
+
+Ví dụ:
+    python scripts/gc_files.py                      # Chỉ báo cáo dung lượng + danh sách file mồ côi
+    python scripts/gc_files.py --quarantine         # Chuyển file mồ côi vào thư mục cách ly
+    python scripts/gc_files.py --quarantine --purge-days 14
+"""
+import sys
+import os
+import argparse
+
+# Adds the project root to sys.path so we can import from main
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if path not in sys.path:
+    sys.path.insert(0, path)
+
+# Script không render template nên bỏ qua bước warm-up
+os.environ.setdefault("TEMPLATE_WARMUP", "0")
+
+from main import SessionLocal, scan_storage, quarantine_orphans, purge_quarantine
+
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dọn file upload mồ côi và báo cáo dung lượng lưu trữ")
+    parser.add_argument("--quarantine", action="store_true", help="Chuyển file mồ côi vào .storage_quarantine/")
+    parser.add_argument("--purge-days", type=int, default=None, help="Xóa hẳn các lô cách ly cũ hơn N ngày")
+    parser.add_argument("--grace-hours", type=float, default=1, help="Bỏ qua file mới ghi trong N giờ (mặc định 1)")
+    parser.add_argument("--list", action="store_true", help="In danh sách file mồ côi")
+    args = parser.parse_args()
+
+    # Path trong DB là relative từ root project
+    os.chdir(path)
+
+    db = SessionLocal()
+    try:
+        report = scan_storage(db, grace_seconds=int(args.grace_hours * 3600))
+
+        print(f"{'Nhóm':<36} {'Số file':>8} {'Dung lượng':>12} {'Mồ côi':>8} {'DL mồ côi':>12}")
+        for category, stats in report["categories"].items():
+            print(
+                f"{category:<36} {stats['files']:>8} {format_size(stats['bytes']):>12} "
+                f"{stats['orphan_files']:>8} {format_size(stats['orphan_bytes']):>12}"
+            )
+        orphan_bytes = sum(size for _, size in report["orphans"])
+        print(
+            f"{'Tổng':<36} {report['files']:>8} {format_size(report['bytes']):>12} "
+            f"{len(report['orphans']):>8} {format_size(orphan_bytes):>12}"
+        )
+
+        if args.list:
+            for file_path, size in report["orphans"]:
+                print(f"  {file_path} ({format_size(size)})")
+
+        if args.quarantine and report["orphans"]:
+            moved, batch_dir = quarantine_orphans(db, [file_path for file_path, _ in report["orphans"]])
+            print(f"Đã chuyển {moved} file mồ côi vào {batch_dir}" if moved else "Không có file nào cần cách ly")
+
+        if args.purge_days is not None:
+            removed_files, removed_bytes = purge_quarantine(args.purge_days)
+            print(f"Đã xóa hẳn {removed_files} file ({format_size(removed_bytes)}) cách ly quá {args.purge_days} ngày")
+    finally:
+        db.close()
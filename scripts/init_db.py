@@ -144,6 +144,13 @@ def migrate_timekeeping_details():
                     except Exception as e:
                         print(f"Error adding column {col_name}: {e}")
                         conn.rollback()
+            
+            # Index cho phân trang keyset của API lọc chấm công
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_timekeeping_details_filter_keyset "
+                "ON timekeeping_details (table_id, coalesce(route_code, ''), date, id)"
+            ))
+            conn.commit()
     except Exception as e:
         print(f"Migration error: {e}")
 
@@ -383,6 +390,131 @@ def migrate_route_status():
         print(f"Migration error for routes.route_status: {e}")
         return False
 
+# Migration: Bảng attachments_v2 thay cho các cột JSON đường dẫn file
+def migrate_attachments_table():
+    """Thêm cột sha256 vào attachments_v2 (nếu bảng được tạo từ schema_v2.sql) và chuyển dữ liệu từ các cột JSON cũ"""
+    from sqlalchemy import inspect, text
+    
+    try:
+        inspector = inspect(engine)
+        if 'attachments_v2' not in inspector.get_table_names():
+            print("Table attachments_v2 does not exist yet, will be created by create_all")
+            return
+        
+        existing_columns = [col['name'] for col in inspector.get_columns('attachments_v2')]
+        
+        with engine.connect() as conn:
+            if 'sha256' not in existing_columns:
+                conn.execute(text("ALTER TABLE attachments_v2 ADD COLUMN sha256 VARCHAR(64)"))
+                print("Added column sha256 to attachments_v2")
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_attachments_v2_sha256 ON attachments_v2 (sha256)"))
+            conn.commit()
+        
+        # Chuyển Employee.documents / Vehicle.inspection_documents / Vehicle.phu_hieu_files sang bảng
+        # (bỏ qua file đã có dòng tương ứng nên chạy lại nhiều lần vẫn an toàn)
+        if engine.url.get_backend_name() == "sqlite":
+            from migrate_attachments import migrate_attachments
+            cwd = os.getcwd()
+            os.chdir(path)  # Path trong cột JSON là relative từ root project
+            try:
+                migrate_attachments(engine.url.database)
+            finally:
+                os.chdir(cwd)
+    except Exception as e:
+        print(f"Migration error for attachments_v2: {e}")
+
+def migrate_normalized_keys():
+    """Thêm các cột *_key chuẩn hóa (bỏ dấu, viết hoa) + routes.is_tang_cuong, tạo index và tính lại giá trị"""
+    from sqlalchemy import inspect, text
+    from main import NORMALIZED_KEY_COLUMNS, Route, normalize_key, is_tang_cuong_code
+    
+    try:
+        inspector = inspect(engine)
+        with engine.connect() as conn:
+            for model, key_columns in NORMALIZED_KEY_COLUMNS.items():
+                table = model.__tablename__
+                if table not in inspector.get_table_names():
+                    print(f"Table {table} does not exist yet, will be created by create_all")
+                    continue
+                
+                existing_columns = [col['name'] for col in inspector.get_columns(table)]
+                new_columns = {key_column: "VARCHAR" for key_column in key_columns}
+                if model is Route:
+                    new_columns["is_tang_cuong"] = "INTEGER DEFAULT 0"
+                for column, column_type in new_columns.items():
+                    if column not in existing_columns:
+                        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+                        print(f"Added column {column} to {table} table")
+                    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_{column} ON {table} ({column})"))
+                
+                # Tính lại giá trị chuẩn hóa cho dữ liệu cũ (bằng Python: SQLite không bỏ dấu được)
+                source_columns = list(key_columns.values())
+                rows = conn.execute(text(f"SELECT id, {', '.join(source_columns)} FROM {table}")).fetchall()
+                updates = []
+                for row in rows:
+                    values = {"id": row[0]}
+                    for key_column, value in zip(key_columns, row[1:]):
+                        values[key_column] = normalize_key(value) or None
+                    if model is Route:
+                        values["is_tang_cuong"] = 1 if is_tang_cuong_code(row[1]) else 0
+                    updates.append(values)
+                if updates:
+                    assignments = ", ".join(f"{column} = :{column}" for column in updates[0] if column != "id")
+                    conn.execute(text(f"UPDATE {table} SET {assignments} WHERE id = :id"), updates)
+                print(f"Updated normalized keys for {len(updates)} rows in {table}")
+            conn.commit()
+    except Exception as e:
+        print(f"Migration error for normalized keys: {e}")
+
+def migrate_expiry_index():
+    """Dựng lại expiry_index từ ngày hết hạn hiện có của xe, nhân viên và tài liệu"""
+    from main import SessionLocal, rebuild_expiry_index
+    
+    db = SessionLocal()
+    try:
+        total = rebuild_expiry_index(db)
+        db.commit()
+        print(f"Rebuilt expiry_index: {total} entries")
+    except Exception as e:
+        db.rollback()
+        print(f"Migration error for expiry_index: {e}")
+    finally:
+        db.close()
+
+def migrate_search_index():
+    """Tạo bảng FTS5 search_fts + trigger đồng bộ và nạp lại dữ liệu tìm kiếm (chỉ SQLite)"""
+    if engine.url.get_backend_name() != "sqlite":
+        print("Skipping search_fts: FTS5 index is only supported on SQLite")
+        return
+    from main import SessionLocal, rebuild_search_index
+    
+    db = SessionLocal()
+    try:
+        total = rebuild_search_index(db)
+        db.commit()
+        print(f"Rebuilt search_fts: {total} entries")
+    except Exception as e:
+        db.rollback()
+        print(f"Migration error for search_fts: {e}")
+    finally:
+        db.close()
+
+def migrate_fuel_records_index():
+    """Tạo index (date, license_plate) cho fuel_records: dùng khi kiểm tra trùng lặp lúc import Excel"""
+    from sqlalchemy import inspect, text
+    
+    try:
+        inspector = inspect(engine)
+        if 'fuel_records' not in inspector.get_table_names():
+            print("Table fuel_records does not exist yet, will be created by create_all")
+            return
+        with engine.connect() as conn:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_fuel_records_date_plate ON fuel_records (date, license_plate)"))
+            conn.commit()
+        print("Ensured index idx_fuel_records_date_plate on fuel_records")
+    except Exception as e:
+        print(f"Migration error for fuel_records index: {e}")
+
 if __name__ == "__main__":
     migrate_accounts()
     migrate_revenue_records()
@@ -393,6 +525,11 @@ if __name__ == "__main__":
     migrate_vehicle_assignments()
     migrate_employee_social_insurance_salary()
     migrate_route_status()
+    migrate_normalized_keys()
+    migrate_attachments_table()
+    migrate_expiry_index()
+    migrate_search_index()
+    migrate_fuel_records_index()
     
     print("Migrating RBAC and initializing permissions...")
     from main import SessionLocal, initialize_permissions
@@ -0,0 +1,50 @@
+"""
+Tính lại doanh thu (RevenueRecord), bản ghi thu nhập tự động (FinanceTransaction) và
+đơn giá/thành tiền chấm công (TimekeepingDetail) cho một khoảng ngày.
+
+Dùng khi sửa lùi giá tuyến hoặc giá dầu, thay vì mở /revenue?selected_date=... từng ngày.
+
+Ví dụ:
+    python scripts/recompute_range.py --from 2025-01-01 --to 2025-12-31 --workers 4
+    python scripts/recompute_range.py --from 2025-12-01 --to 2025-12-31 --dry-run
+"""
+import sys
+import os
+import argparse
+from datetime import datetime
+
+# Adds the project root to sys.path so we can import from main
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if path not in sys.path:
+    sys.path.insert(0, path)
+
+from main import recompute_date_range
+
+
+def parse_date(value: str):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Ngày không hợp lệ: {value} (định dạng YYYY-MM-DD)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tính lại doanh thu / finance / chấm công cho một khoảng ngày")
+    parser.add_argument("--from", dest="from_date", type=parse_date, required=True, help="Từ ngày (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="to_date", type=parse_date, required=True, help="Đến ngày (YYYY-MM-DD)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Số process tính song song")
+    parser.add_argument("--chunk-days", type=int, default=7, help="Số ngày mỗi chunk")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ tính và in thống kê, không ghi DB")
+    args = parser.parse_args()
+
+    print(f"Recomputing {args.from_date} -> {args.to_date} with {args.workers} worker(s)...")
+    stats = recompute_date_range(
+        args.from_date,
+        args.to_date,
+        workers=args.workers,
+        chunk_days=args.chunk_days,
+        dry_run=args.dry_run
+    )
+    for key, value in stats.items():
+        print(f"  {key}: {value}")
+    print("Done." if not args.dry_run else "Dry run - no changes written.")